@@ -0,0 +1,211 @@
+# batch.py
+# Offline batch-API execution of the synthesis pipeline.
+#
+#   export: write every stage request that is ready (its inputs are known) across the dataset
+#           into one OpenAI-style batch JSONL, with deterministic custom ids "<sample_id>:<item_id>:<stage>"
+#   ingest: read the provider's result file, store the parsed stage results and write the
+#           records of items whose stages are all done; then export again for the next stages
+#   local:  answer a request file through the configured endpoint (a stand-in for the batch service)
+#
+#   python -m src.batch export --requests data/batch/requests.jsonl
+#   python -m src.batch ingest --results data/batch/results.jsonl
+#
+
+import argparse
+import asyncio
+import json
+import os
+from collections import defaultdict
+from typing import Any, Dict, Optional, Tuple
+
+from .client import build_client, parse_json_content, token_usage
+from .config import SynthesisConfig
+from .io_utils import iter_jsonl
+from .json_repair import RepairStats
+from .retry import classify_error
+from .routing import stage_model
+from .schemas import stage_validator
+from .stages import assemble_record, is_complete, item_key, resolve_ready_stages
+from .state import StageStore, iter_pending_states
+from .synthesis import default_config
+
+
+BATCH_URL = "/v1/chat/completions"
+
+
+def custom_id(key: str, stage: str) -> str:
+    return f"{key}:{stage}"
+
+
+def parse_custom_id(value: str) -> Tuple[str, str]:
+    key, stage = value.rsplit(":", 1)
+    return key, stage
+
+
+def advance(cfg: SynthesisConfig, store: StageStore, requests_path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Write the records of finished items to the output file and, if requests_path is given,
+    the batch requests of every stage that is ready to run.
+    """
+    finished = 0
+    pending: Dict[str, int] = defaultdict(int)
+
+    for path in (cfg.output_file, requests_path):
+        directory = os.path.dirname(path) if path else ""
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    requests_file = open(requests_path, "w", encoding="utf-8") if requests_path else None
+    try:
+        with open(cfg.output_file, "a", encoding="utf-8") as out:
+            for state in iter_pending_states(cfg, store):
+                ready = resolve_ready_stages(cfg, state)
+                if is_complete(state):
+                    record = assemble_record(cfg, state, store.usage.get(item_key(state.item), {}))
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    finished += 1
+                    continue
+                for stage, (system_prompt, user_content) in ready:
+                    pending[stage.name] += 1
+                    if requests_file is None:
+                        continue
+                    request = {
+                        "custom_id": custom_id(item_key(state.item), stage.name),
+                        "method": "POST",
+                        "url": BATCH_URL,
+                        "body": {
+                            "model": stage_model(cfg, stage.name),
+                            "messages": [
+                                {"role": "system", "content": system_prompt},
+                                {"role": "user", "content": user_content},
+                            ],
+                            "response_format": {"type": "json_object"},
+                        },
+                    }
+                    requests_file.write(json.dumps(request, ensure_ascii=False) + "\n")
+    finally:
+        if requests_file is not None:
+            requests_file.close()
+
+    return {"finished": finished, "pending_requests": dict(pending)}
+
+
+def ingest_results(
+    cfg: SynthesisConfig,
+    store: StageStore,
+    results_path: str,
+    repair_stats: RepairStats,
+) -> Dict[str, Dict[str, int]]:
+    """
+    Store every successful, valid result from a batch result file.
+    Failed, malformed or invalid results are counted and left pending, so the next export asks again;
+    lines without a parseable custom_id are skipped with a warning.
+    """
+    counts: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    bad_lines = 0
+    with open(results_path, "r", encoding="utf-8") as f:
+        lines = [line for line in f if line.strip()]
+    for raw in lines:
+        try:
+            line = json.loads(raw)
+            key, stage = parse_custom_id(line["custom_id"])
+        except (ValueError, KeyError, TypeError, AttributeError):
+            bad_lines += 1
+            continue
+        if stage in store.results.get(key, {}):
+            counts[stage]["duplicate"] += 1
+            continue
+
+        response = line.get("response") or {}
+        if line.get("error") or response.get("status_code") != 200:
+            counts[stage]["error"] += 1
+            continue
+
+        try:
+            body = response["body"]
+            content = (body["choices"][0]["message"]["content"] or "").strip()
+        except (KeyError, IndexError, TypeError, AttributeError):
+            counts[stage]["error"] += 1
+            continue
+        try:
+            parsed = parse_json_content(content, repair_stats)
+            validate = stage_validator(stage) if cfg.validate_schemas else None
+            if validate is not None:
+                validate(parsed)
+        except ValueError as e:
+            counts[stage][classify_error(e)] += 1
+            continue
+
+        store.record(key, stage, parsed, {**token_usage(body.get("usage")), "calls": 1})
+        counts[stage]["ok"] += 1
+
+    store.flush()
+    if bad_lines:
+        print(f"[Ingest] skipped {bad_lines} unparseable lines in {results_path}")
+    return {stage: dict(c) for stage, c in counts.items()}
+
+
+async def answer_requests_locally(cfg: SynthesisConfig, requests_path: str, results_path: str) -> int:
+    """
+    Local stand-in for a batch service: send each request in the file to the configured
+    endpoint and write the answers in the batch result format.
+    """
+    client = build_client(cfg.base_url, cfg.api_key_env)
+    semaphore = asyncio.Semaphore(cfg.max_concurrency)
+
+    async def answer(index: int, request: Dict[str, Any]) -> Dict[str, Any]:
+        async with semaphore:
+            try:
+                resp = await client.chat.completions.create(**request["body"])
+            except Exception as e:
+                return {"id": f"local-{index}", "custom_id": request["custom_id"], "response": None,
+                        "error": {"message": str(e)}}
+            return {
+                "id": f"local-{index}",
+                "custom_id": request["custom_id"],
+                "response": {"status_code": 200, "body": resp.model_dump()},
+                "error": None,
+            }
+
+    requests = list(iter_jsonl(requests_path))
+    try:
+        results = await asyncio.gather(*(answer(i, r) for i, r in enumerate(requests)))
+    finally:
+        await client.close()
+    with open(results_path, "w", encoding="utf-8") as f:
+        for result in results:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    return len(results)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the synthesis pipeline through batch request/result files.")
+    parser.add_argument("command", choices=["export", "ingest", "local"])
+    parser.add_argument("--requests", type=str, default="data/batch/requests.jsonl", help="Batch request JSONL.")
+    parser.add_argument("--results", type=str, default="data/batch/results.jsonl", help="Batch result JSONL.")
+    args = parser.parse_args()
+
+    cfg = default_config()
+
+    if args.command == "local":
+        n = asyncio.run(answer_requests_locally(cfg, args.requests, args.results))
+        print(f"[Done] {n} results written to: {args.results}")
+        return
+
+    store = StageStore(cfg.state_file)
+    try:
+        if args.command == "ingest":
+            repair_stats = RepairStats()
+            print(f"Ingested: {ingest_results(cfg, store, args.results, repair_stats)}")
+            print(f"JSON repairs: {repair_stats.summary()}")
+            summary = advance(cfg, store)
+        else:
+            summary = advance(cfg, store, args.requests)
+            print(f"[Done] requests written to: {args.requests}")
+    finally:
+        store.close()
+    print(f"Finished items: {summary['finished']}, pending requests: {summary['pending_requests']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+# bench.py
+# Offline end-to-end throughput benchmark: generate a synthetic LMSYS-style dataset, answer every
+# request from the mock endpoint (mock_server.py) and drive synthesis.run() over it.
+#
+#   python -m src.bench --samples 200 --concurrency 32 --latency-median-s 0.5 --rate-limit-rate 0.01
+#
+# Reports samples/s, requests/s, p50/p99 item latency and peak RSS of the pipeline process
+# (the mock server runs in a subprocess unless --in-process); --report appends the result to a JSONL.
+
+import argparse
+import asyncio
+import dataclasses
+import json
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from .mock_server import MockServer, add_behavior_args, behavior_from_args
+from .synthesis import default_config, run
+
+_WORDS = (
+    "please explain how the model handles this case and give an example with code "
+    "what about performance memory latency tokens prompt answer question summary detail"
+).split()
+
+
+def write_synthetic_dataset(path: str, samples: int, min_rounds: int, max_rounds: int, words: int, seed: int) -> None:
+    """LMSYS-like samples: `rounds` user/assistant pairs of about `words` words per message."""
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(samples):
+            conversation = []
+            for _ in range(rng.randint(min_rounds, max_rounds)):
+                for role in ("user", "assistant"):
+                    n = max(1, int(rng.gauss(words, words / 3)))
+                    conversation.append({"role": role, "content": " ".join(rng.choice(_WORDS) for _ in range(n))})
+            f.write(json.dumps({"id": f"bench-{i:06d}", "conversation": conversation}) + "\n")
+
+
+def peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024, 1)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _start_subprocess_server(args: argparse.Namespace) -> Tuple[asyncio.subprocess.Process, int]:
+    port = _free_port()
+    cmd = [sys.executable, "-m", "src.mock_server", "--port", str(port)]
+    for name in ("latency_median_s", "latency_sigma", "error_rate", "rate_limit_rate", "malformed_rate", "retry_after_s"):
+        cmd += [f"--{name.replace('_', '-')}", str(getattr(args, name))]
+    if args.seed is not None:
+        cmd += ["--seed", str(args.seed)]
+    proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE)
+    line = await asyncio.wait_for(proc.stdout.readline(), timeout=30)
+    if not line.startswith(b"[Mock] serving"):
+        raise RuntimeError(f"mock server did not start: {line!r}")
+    return proc, port
+
+
+async def bench(args: argparse.Namespace) -> Dict[str, Any]:
+    workdir = tempfile.mkdtemp(prefix="proutt-bench-")
+    input_file = os.path.join(workdir, "input.jsonl")
+    write_synthetic_dataset(input_file, args.samples, args.min_rounds, args.max_rounds, args.words, args.seed or 0)
+
+    server, proc = None, None
+    if args.in_process:
+        server = MockServer(behavior_from_args(args), seed=args.seed)
+        port = await server.start()
+    else:
+        proc, port = await _start_subprocess_server(args)
+
+    os.environ.setdefault("MOCK_API_KEY", "mock")
+    cfg = dataclasses.replace(
+        default_config(),
+        base_url=f"http://127.0.0.1:{port}/v1",
+        api_key_env="MOCK_API_KEY",
+        model_id="mock",
+        input_file=input_file,
+        output_file=os.path.join(workdir, "output.jsonl"),
+        state_file=os.path.join(workdir, "state.jsonl"),
+        cache_path=None,
+        resume=False,
+        max_concurrency=args.concurrency,
+        adaptive_concurrency=args.adaptive,
+    )
+    started = time.monotonic()
+    try:
+        rt = await run(cfg)
+    finally:
+        if server is not None:
+            await server.close()
+        if proc is not None:
+            proc.terminate()
+            await proc.wait()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    wall_s = time.monotonic() - started
+
+    item_seconds = rt.metrics.histograms.get("item_seconds", {}).get(())
+    requests = sum(rt.metrics.counters.get("llm_requests_total", {}).values())
+    records = rt.writer.written
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "samples": args.samples,
+        "records": records,
+        "failed_samples": rt.failed_samples,
+        "concurrency": args.concurrency,
+        "adaptive": args.adaptive,
+        "latency_median_s": args.latency_median_s,
+        "wall_s": round(wall_s, 3),
+        "items_per_s": round(records / wall_s, 3),
+        "requests_per_s": round(requests / wall_s, 3),
+        "item_p50_s": item_seconds.quantile(0.5) if item_seconds else None,
+        "item_p99_s": item_seconds.quantile(0.99) if item_seconds else None,
+        "peak_rss_mb": peak_rss_mb(),
+        "retries": rt.retry_stats.summary()["retries"],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="End-to-end synthesis throughput benchmark against a mock endpoint.")
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--min-rounds", type=int, default=2)
+    parser.add_argument("--max-rounds", type=int, default=6)
+    parser.add_argument("--words", type=int, default=60, help="Mean words per message.")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--adaptive", action="store_true", help="Use the adaptive (AIMD) limiter.")
+    parser.add_argument("--in-process", action="store_true", help="Run the mock server on the pipeline's event loop.")
+    parser.add_argument("--report", type=str, default=None, help="Append the result to this JSONL.")
+    parser.add_argument("--keep", action="store_true", help="Keep the synthetic input and output files.")
+    add_behavior_args(parser)
+    args = parser.parse_args()
+
+    result = asyncio.run(bench(args))
+    print(f"[Bench] {json.dumps(result)}")
+    if args.report:
+        with open(args.report, "a", encoding="utf-8") as f:
+            f.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .schemas import SchemaError
+
+
+class ResponseCache:
+    """
+    Persistent content-addressed cache of chat_once_json results, stored in SQLite.
+    Keyed by a hash of (model_id, system_prompt, user_content); stores the parsed JSON and token usage.
+    Entries older than max_age_s are treated as misses; when the store exceeds max_bytes,
+    the least recently used entries are evicted.
+    Hits update accessed_at in memory; the touches are written in batches (with the next put,
+    every _TOUCH_EVERY hits, before eviction and on close) so a hit does not commit.
+    """
+
+    _EVICT_EVERY = 100
+    _TOUCH_EVERY = 100
+
+    def __init__(
+        self,
+        path: str,
+        max_age_s: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+    ) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_age_s = max_age_s
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._touched: Dict[str, float] = {}
+
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                usage TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON responses (accessed_at)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model_id: str, system_prompt: str, user_content: str) -> str:
+        payload = json.dumps([model_id, system_prompt, user_content], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(
+        self, key: str, validate: Optional[Callable[[Any], None]] = None
+    ) -> Optional[Tuple[Any, Dict[str, int]]]:
+        """
+        Stored (parsed, usage) for key, or None on a miss.
+        If validate is given and raises SchemaError for the stored response, the entry is invalidated
+        and the lookup counts as a miss; only responses that pass count as hits.
+        """
+        row = self._conn.execute(
+            "SELECT response, usage, created_at FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        now = time.time()
+        if row is None or (self.max_age_s is not None and now - row[2] > self.max_age_s):
+            self.misses += 1
+            return None
+
+        parsed = json.loads(row[0])
+        if validate is not None:
+            try:
+                validate(parsed)
+            except SchemaError:
+                self.invalidate(key)
+                self.misses += 1
+                return None
+
+        self._touched[key] = now
+        if len(self._touched) >= self._TOUCH_EVERY:
+            self.flush()
+        self.hits += 1
+        return parsed, json.loads(row[1])
+
+    def invalidate(self, key: str) -> None:
+        self._touched.pop(key, None)
+        self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+        self._conn.commit()
+
+    def flush(self) -> None:
+        """Write the pending accessed_at touches."""
+        if self._touched:
+            self._write_touches()
+            self._conn.commit()
+
+    def _write_touches(self) -> None:
+        self._conn.executemany(
+            "UPDATE responses SET accessed_at = ? WHERE key = ?",
+            [(accessed_at, key) for key, accessed_at in self._touched.items()],
+        )
+        self._touched.clear()
+
+    def put(self, key: str, parsed: Any, usage: Dict[str, int]) -> None:
+        response = json.dumps(parsed, ensure_ascii=False)
+        usage_text = json.dumps(usage)
+        now = time.time()
+        # Pending touches ride along with this commit
+        self._touched.pop(key, None)
+        self._write_touches()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO responses (key, response, usage, size, created_at, accessed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (key, response, usage_text, len(response) + len(usage_text), now, now),
+        )
+        self._conn.commit()
+
+        self._puts += 1
+        if self._puts % self._EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self) -> int:
+        """Drop expired entries, then least recently used ones until under max_bytes."""
+        self.flush()
+        removed = 0
+        if self.max_age_s is not None:
+            cur = self._conn.execute(
+                "DELETE FROM responses WHERE created_at < ?", (time.time() - self.max_age_s,)
+            )
+            removed += cur.rowcount
+
+        if self.max_bytes is not None:
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                excess = total - self.max_bytes
+                freed = 0
+                victims = []
+                for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at"):
+                    victims.append((key,))
+                    freed += size
+                    if freed >= excess:
+                        break
+                self._conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+                removed += len(victims)
+
+        self._conn.commit()
+        return removed
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+    def close(self) -> None:
+        self.flush()
+        self._conn.close()
@@ -0,0 +1,284 @@
+# classifier.py
+# Local classifier for the utterance_category_gt stage (Statement / Question / Instruction of item["label"]).
+#
+# A multinomial logistic model over hashed features of the user reply and the assistant message before it:
+# word uni/bigrams, first words, final punctuation and a few rule features (interrogatives, auxiliaries,
+# imperative verbs, "please", code). Without a trained model, hand-set weights on the rule features alone
+# are used. Trained from the utterance_category_gt answers of earlier synthesized records; the holdout
+# report shows coverage and LLM agreement per confidence threshold, to pick local_classifier_min_confidence.
+#
+#   python -m src.classifier train --records data/synthesized_raw/LMSYS.jsonl --model data/classifier.json
+#   python -m src.classifier eval --records data/synthesized_raw/LMSYS.jsonl [--model data/classifier.json]
+#
+
+import argparse
+import json
+import math
+import os
+import random
+import re
+import zlib
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from .config import SynthesisConfig
+from .io_utils import iter_jsonl
+from .resolvers import LocalResolver
+from .schemas import CATEGORIES
+from .stages import UTTERANCE_CATEGORY_GT, ItemState
+from .utils import in_holdout
+
+# Marks answers given by the classifier, so they are never used to train it
+LOCAL_REASONING_PREFIX = "[local classifier]"
+
+DEFAULT_DIM = 1 << 18
+THRESHOLDS = (0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.98, 0.99)
+
+_TOKEN_RE = re.compile(r"[a-z0-9']+|[^\sa-z0-9]")
+
+WH_WORDS = {"what", "why", "how", "when", "where", "who", "whom", "whose", "which"}
+AUXILIARIES = {
+    "is", "are", "was", "were", "am", "do", "does", "did", "can", "could", "will", "would",
+    "shall", "should", "may", "might", "have", "has", "had", "isn't", "aren't", "don't", "doesn't",
+}
+IMPERATIVES = {
+    "write", "give", "make", "create", "list", "explain", "tell", "show", "generate", "translate",
+    "summarize", "summarise", "rewrite", "describe", "add", "change", "use", "continue", "provide",
+    "fix", "convert", "compose", "draft", "help", "let's", "try", "remove", "replace", "implement",
+    "suggest", "find", "calculate", "compare", "answer", "act", "imagine", "pretend", "repeat", "shorten",
+}
+
+# The rule-only model: weights on rule features, bias favouring Statement (the category without markers)
+RULE_WEIGHTS: Dict[str, Dict[str, float]] = {
+    "Question": {"r:ends_q": 3.0, "r:has_q": 1.0, "r:starts_wh": 1.5, "r:starts_aux": 1.5},
+    "Instruction": {"r:starts_imperative": 3.0, "r:please": 1.5, "r:code": 0.5},
+    "Statement": {"r:prev_ends_q": 0.5, "r:no_marker": 1.0},
+}
+RULE_BIAS: Dict[str, float] = {"Question": 0.0, "Instruction": 0.0, "Statement": 0.5}
+
+
+def _content(message: Any) -> str:
+    return str(message.get("content", "")) if isinstance(message, dict) else str(message)
+
+
+def feature_names(text: str, previous: str = "") -> List[str]:
+    """The named binary features of a user reply (and the assistant message it answers)."""
+    lowered = text.strip().lower()
+    tokens = _TOKEN_RE.findall(lowered)
+    words = [t for t in tokens if t[0].isalnum()]
+    first = words[0] if words else ""
+    stripped = lowered.rstrip()
+    last_char = stripped[-1:] if stripped else ""
+
+    names = [f"w:{t}" for t in tokens]
+    names += [f"b:{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    names += [f"first:{first}", f"first2:{' '.join(words[:2])}", f"last:{last_char}"]
+
+    rules = {
+        "r:ends_q": last_char in ("?", "？"),
+        "r:has_q": "?" in lowered or "？" in lowered,
+        "r:starts_wh": first in WH_WORDS,
+        "r:starts_aux": first in AUXILIARIES,
+        "r:starts_imperative": first in IMPERATIVES or (first == "please" and len(words) > 1),
+        "r:please": "please" in words or "pls" in words,
+        "r:code": "```" in text or text.count("\n") > 3,
+        "r:prev_ends_q": previous.rstrip().endswith(("?", "？")),
+        "r:short": len(words) < 4,
+    }
+    markers = ("r:ends_q", "r:starts_wh", "r:starts_aux", "r:starts_imperative", "r:please")
+    rules["r:no_marker"] = not any(rules[m] for m in markers)
+    names += [name for name, on in rules.items() if on]
+    return names
+
+
+def _hash(name: str, dim: int) -> int:
+    return zlib.crc32(name.encode("utf-8")) % dim
+
+
+def softmax(scores: Dict[str, float]) -> Dict[str, float]:
+    top = max(scores.values())
+    exp = {k: math.exp(v - top) for k, v in scores.items()}
+    total = sum(exp.values())
+    return {k: v / total for k, v in exp.items()}
+
+
+class UtteranceClassifier:
+    """Multinomial logistic regression over hashed binary features (sparse weights per category)."""
+
+    def __init__(
+        self,
+        weights: Optional[Dict[str, Dict[int, float]]] = None,
+        bias: Optional[Dict[str, float]] = None,
+        dim: int = DEFAULT_DIM,
+    ) -> None:
+        self.dim = dim
+        self.weights: Dict[str, Dict[int, float]] = weights or {c: {} for c in CATEGORIES}
+        self.bias: Dict[str, float] = bias or {c: 0.0 for c in CATEGORIES}
+
+    @classmethod
+    def rules(cls) -> "UtteranceClassifier":
+        weights = {c: {_hash(name, DEFAULT_DIM): w for name, w in RULE_WEIGHTS[c].items()} for c in CATEGORIES}
+        return cls(weights, dict(RULE_BIAS))
+
+    def _features(self, text: str, previous: str) -> List[int]:
+        return sorted({_hash(name, self.dim) for name in feature_names(text, previous)})
+
+    def _scores(self, features: Sequence[int]) -> Dict[str, float]:
+        return {c: self.bias[c] + sum(self.weights[c].get(f, 0.0) for f in features) for c in CATEGORIES}
+
+    def predict_proba(self, text: str, previous: str = "") -> Dict[str, float]:
+        return softmax(self._scores(self._features(text, previous)))
+
+    def classify(self, text: str, previous: str = "") -> Tuple[str, float]:
+        """(most likely category, its probability)."""
+        proba = self.predict_proba(text, previous)
+        category = max(proba, key=proba.get)
+        return category, proba[category]
+
+    @classmethod
+    def fit(
+        cls,
+        examples: Sequence[Tuple[str, str, str]],
+        dim: int = DEFAULT_DIM,
+        epochs: int = 8,
+        learning_rate: float = 0.2,
+        seed: int = 0,
+    ) -> "UtteranceClassifier":
+        """SGD on the log loss over (text, previous, category) examples."""
+        model = cls(dim=dim)
+        encoded = [(model._features(text, previous), category) for text, previous, category in examples]
+        rng = random.Random(seed)
+        for epoch in range(epochs):
+            rng.shuffle(encoded)
+            lr = learning_rate / (1 + epoch)
+            for features, category in encoded:
+                proba = softmax(model._scores(features))
+                for c in CATEGORIES:
+                    grad = proba[c] - (c == category)
+                    if grad == 0.0:
+                        continue
+                    model.bias[c] -= lr * grad
+                    weights = model.weights[c]
+                    for f in features:
+                        weights[f] = weights.get(f, 0.0) - lr * grad
+        return model
+
+    def save(self, path: str) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        data = {
+            "dim": self.dim,
+            "bias": self.bias,
+            "weights": {c: {str(f): round(w, 6) for f, w in ws.items() if abs(w) > 1e-6} for c, ws in self.weights.items()},
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+
+    @classmethod
+    def load(cls, path: str) -> "UtteranceClassifier":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        weights = {c: {int(k): w for k, w in ws.items()} for c, ws in data["weights"].items()}
+        return cls(weights, data["bias"], data["dim"])
+
+
+def iter_examples(path: str) -> Iterator[Tuple[Any, str, str, str]]:
+    """(sample_id, user reply, assistant message, LLM category) from synthesized records, skipping local answers."""
+    for record in iter_jsonl(path):
+        gt = record.get("utterance_category_gt") or {}
+        category = gt.get("predicted_category")
+        if category not in CATEGORIES or str(gt.get("reasoning", "")).startswith(LOCAL_REASONING_PREFIX):
+            continue
+        yield record["sample_id"], str(record["label"]), _content(record["context"][-1]), category
+
+
+def agreement_report(
+    model: UtteranceClassifier,
+    examples: Sequence[Tuple[str, str, str]],
+) -> Dict[str, Any]:
+    """Agreement with the LLM overall, and coverage / agreement of the answers at or above each threshold."""
+    scored = []
+    for text, previous, category in examples:
+        predicted, confidence = model.classify(text, previous)
+        scored.append((confidence, predicted == category))
+    n = len(scored)
+    report: Dict[str, Any] = {"examples": n, "agreement": sum(ok for _, ok in scored) / n if n else None}
+    for threshold in THRESHOLDS:
+        kept = [ok for confidence, ok in scored if confidence >= threshold]
+        report[f">={threshold}"] = {
+            "coverage": round(len(kept) / n, 4) if n else 0.0,
+            "agreement": round(sum(kept) / len(kept), 4) if kept else None,
+        }
+    return report
+
+
+def print_report(title: str, report: Dict[str, Any]) -> None:
+    agreement = report["agreement"]
+    print(f"{title}: {report['examples']} examples, agreement {agreement:.1%}" if agreement is not None
+          else f"{title}: no examples")
+    for threshold in THRESHOLDS:
+        row = report[f">={threshold}"]
+        kept = "-" if row["agreement"] is None else f"{row['agreement']:.1%}"
+        print(f"  confidence >= {threshold:<5} coverage {row['coverage']:>7.1%}  agreement {kept:>6}")
+
+
+class CategoryResolver(LocalResolver):
+    """Answers utterance_category_gt locally when the classifier's probability reaches min_confidence."""
+
+    stage = UTTERANCE_CATEGORY_GT
+
+    def __init__(self, model: UtteranceClassifier, min_confidence: float, audit_rate: float = 0.0) -> None:
+        super().__init__(audit_rate)
+        self.model = model
+        self.min_confidence = min_confidence
+
+    def guess(self, cfg: SynthesisConfig, state: ItemState) -> Tuple[Any, bool]:
+        category, confidence = self.model.classify(str(state.item["label"]), _content(state.item["context"][-1]))
+        result = {"reasoning": f"{LOCAL_REASONING_PREFIX} p={confidence:.3f}", "predicted_category": category}
+        return result, confidence >= self.min_confidence
+
+    def agrees(self, cfg: SynthesisConfig, local: Any, llm: Any) -> bool:
+        return local["predicted_category"] == llm["predicted_category"]
+
+
+def build_category_resolver(cfg: SynthesisConfig) -> CategoryResolver:
+    if cfg.local_classifier_model:
+        model = UtteranceClassifier.load(cfg.local_classifier_model)
+    else:
+        model = UtteranceClassifier.rules()
+    return CategoryResolver(model, cfg.local_classifier_min_confidence, audit_rate=cfg.local_audit_rate)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Train or evaluate the local utterance category classifier.")
+    parser.add_argument("command", choices=["train", "eval"])
+    parser.add_argument("--records", type=str, default="data/synthesized_raw/LMSYS.jsonl", help="Synthesized records.")
+    parser.add_argument("--model", type=str, default=None, help="Model file (written by train; None evaluates the rules).")
+    parser.add_argument("--holdout", type=float, default=0.2, help="Share of samples held out for the train report.")
+    parser.add_argument("--epochs", type=int, default=8)
+    args = parser.parse_args()
+
+    examples = list(iter_examples(args.records))
+    if args.command == "eval":
+        model = UtteranceClassifier.load(args.model) if args.model else UtteranceClassifier.rules()
+        print_report(args.model or "rules", agreement_report(model, [e[1:] for e in examples]))
+        return
+
+    if not args.model:
+        parser.error("train needs --model")
+    train = [e[1:] for e in examples if not in_holdout(e[0], args.holdout)]
+    holdout = [e[1:] for e in examples if in_holdout(e[0], args.holdout)]
+    counts: Dict[str, int] = defaultdict(int)
+    for _, _, category in train:
+        counts[category] += 1
+    print(f"Training on {len(train)} records {dict(counts)}, holding out {len(holdout)}")
+    model = UtteranceClassifier.fit(train, epochs=args.epochs)
+    print_report("Holdout, trained model", agreement_report(model, holdout))
+    print_report("Holdout, rules", agreement_report(UtteranceClassifier.rules(), holdout))
+    model.save(args.model)
+    print(f"[Done] model written to: {args.model}")
+
+
+if __name__ == "__main__":
+    main()
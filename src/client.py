@@ -1,11 +1,23 @@
 import json
 import os
-import random
 import asyncio
-from typing import Any, Dict, Tuple, Optional
+import time
+from typing import Any, Callable, Dict, Sequence, Set, Tuple, Optional, Union
 
 from openai import AsyncOpenAI
 
+from .cache import ResponseCache
+from .config import Endpoint
+from .json_repair import RepairStats, salvage_json
+from .ledger import UsageLedger
+from .limiter import AdaptiveLimiter, RateLimiter
+from .metrics import Metrics
+from .pool import ClientPool, PooledEndpoint
+from .prompts import Schema_Reask_Prompt
+from .retry import RATE_LIMITED, SCHEMA, TRANSIENT, RetryPolicy, RetryStats, classify_error
+from .tracing import Tracer, trace_async, trace_sync
+from .utils import accumulate_token_usage, empty_token_usage, estimate_tokens
+
 
 JsonDict = Dict[str, Any]
 TokenUsage = Dict[str, int]
@@ -18,52 +30,241 @@ def build_client(base_url: str, api_key_env: str) -> AsyncOpenAI:
     api_key = os.environ.get(api_key_env)
     if not api_key:
         raise RuntimeError(f"Missing environment variable: {api_key_env}")
-    return AsyncOpenAI(base_url=base_url, api_key=api_key)
+    # The SDK's own retries are off: chat_once_json's RetryPolicy (and the limiters) must see every 429/5xx.
+    return AsyncOpenAI(base_url=base_url, api_key=api_key, max_retries=0)
+
+
+def build_client_pool(endpoints: Sequence[Endpoint], max_failures: int = 3, eject_s: float = 30.0) -> ClientPool:
+    """
+    One AsyncOpenAI client per configured endpoint (base URL + key), balanced by a ClientPool.
+    """
+    pooled = [
+        PooledEndpoint(
+            name=ep.name or f"{ep.base_url}#{ep.api_key_env}",
+            client=build_client(ep.base_url, ep.api_key_env),
+            weight=ep.weight,
+            model_id=ep.model_id,
+        )
+        for ep in endpoints
+    ]
+    return ClientPool(pooled, max_failures=max_failures, eject_s=eject_s)
+
+
+def token_usage(usage: Any) -> TokenUsage:
+    """
+    Token counts from a response's usage (an SDK object, or a plain dict from a batch result file).
+    cached_tokens is read from prompt_tokens_details.cached_tokens (OpenAI, GLM and most compatible APIs)
+    or prompt_cache_hit_tokens (DeepSeek).
+    """
+    def get(obj: Any, name: str) -> int:
+        if obj is None:
+            return 0
+        if isinstance(obj, dict):
+            return obj.get(name) or 0
+        return getattr(obj, name, 0) or 0
+
+    details = usage.get("prompt_tokens_details") if isinstance(usage, dict) else getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": get(usage, "prompt_tokens"),
+        "completion_tokens": get(usage, "completion_tokens"),
+        "total_tokens": get(usage, "total_tokens"),
+        "cached_tokens": get(details, "cached_tokens") or get(usage, "prompt_cache_hit_tokens"),
+    }
+
+
+def parse_json_content(content: str, repair_stats: Optional[RepairStats] = None) -> Any:
+    """json.loads, falling back to local salvage; raises ValueError if the content cannot be repaired."""
+    try:
+        return json.loads(content)
+    except json.JSONDecodeError:
+        try:
+            parsed, repair = salvage_json(content)
+        except ValueError:
+            if repair_stats is not None:
+                repair_stats.record("unrepairable")
+            raise
+        if repair_stats is not None:
+            repair_stats.record(repair)
+        return parsed
 
 
 async def chat_once_json(
-    client: AsyncOpenAI,
+    client: Union[AsyncOpenAI, ClientPool],
     model_id: str,
     system_prompt: str,
     user_content: str,
     retries: int = 3,
     retry_base_sleep_s: float = 1.0,
+    retry_policy: Optional[RetryPolicy] = None,
+    retry_stats: Optional[RetryStats] = None,
+    stage: str = "",
+    repair_stats: Optional[RepairStats] = None,
+    validate: Optional[Callable[[Any], None]] = None,
+    reask_with_error: bool = False,
+    cache: Optional[ResponseCache] = None,
+    limiter: Optional[AdaptiveLimiter] = None,
+    request_slots: Optional[asyncio.Semaphore] = None,
+    rate_limiter: Optional[RateLimiter] = None,
+    expected_completion_tokens: int = 512,
+    ledger: Optional[UsageLedger] = None,
+    metrics: Optional[Metrics] = None,
+    tracer: Optional[Tracer] = None,
 ) -> Tuple[JsonDict, TokenUsage]:
     """
     One JSON-mode chat completion with retry.
-    Returns (parsed_json, token_usage).
+    Returns (parsed_json, token_usage); token_usage sums every response billed for this call (including
+    ones rejected and re-asked) and counts them under "calls".
+    Failed attempts are classified and retried per retry_policy (by default built from
+    retries / retry_base_sleep_s); retries and give-ups are counted in retry_stats under `stage`.
+    Content that is not valid JSON goes through local salvage (json_repair) before a retry is paid for.
+    If validate is given it must raise SchemaError for a malformed result; the request is then re-asked,
+    with the violation appended to the user message when reask_with_error is set.
+    If a cache is given, an identical earlier request is answered from it without calling the API;
+    such a hit reports no tokens, only "cache_hits": 1.
+    If a limiter is given, every attempt holds one of its in-flight slots.
+    If request_slots is given, every attempt also holds one of its slots (a fixed in-flight limit).
+    If a rate_limiter is given, every attempt first reserves one request and its estimated tokens.
+    If client is a ClientPool, each attempt picks an endpoint and retries fail over to other endpoints.
+    If a ledger is given, the usage of every response (also ones rejected and retried) is recorded under `stage`.
+    If metrics are given, attempts, latencies, retries and tokens are counted per stage (and endpoint).
+    If a tracer is given, limiter waits, API attempts, parsing and retry backoffs become trace spans.
     """
+    cache_key = None
+    if cache is not None:
+        cache_key = cache.make_key(model_id, system_prompt, user_content)
+        # A stored response that no longer validates is dropped and the request goes to the API
+        cached = cache.get(cache_key, validate)
+        if cached is not None:
+            if metrics is not None:
+                metrics.inc("llm_cache_hits_total", {"stage": stage})
+            if tracer is not None:
+                tracer.annotate(cache="hit")
+            # Nothing was billed this time; the stored usage stays in the cache only
+            usage = empty_token_usage()
+            usage["cache_hits"] = 1
+            return cached[0], usage
+
+    estimated = 0
+    if rate_limiter is not None:
+        estimated = estimate_tokens(system_prompt) + estimate_tokens(user_content) + expected_completion_tokens
+
+    if retry_policy is None:
+        retry_policy = RetryPolicy(max_attempts=retries, base_delay_s=retry_base_sleep_s)
+
     last_err: Optional[Exception] = None
+    kind = TRANSIENT
+    attempts = 0
+    rate_limited_attempts = 0
+    failed_endpoints: Set[str] = set()
+    request_content = user_content
+    billed = empty_token_usage()
 
-    for attempt in range(retries):
+    while True:
         try:
-            resp = await client.chat.completions.create(
-                model=model_id,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_content},
-                ],
-                response_format={"type": "json_object"},
-            )
-
-            content = (resp.choices[0].message.content or "").strip()
-            usage = getattr(resp, "usage", None)
-            tokens = {
-                "prompt_tokens": getattr(usage, "prompt_tokens", 0) if usage else 0,
-                "completion_tokens": getattr(usage, "completion_tokens", 0) if usage else 0,
-                "total_tokens": getattr(usage, "total_tokens", 0) if usage else 0,
-            }
-
-            parsed = json.loads(content)
-            return parsed, tokens
-
-        except json.JSONDecodeError as e:
-            last_err = e
+            # Everything acquired for this attempt is released in the finally below, also when the
+            # task is cancelled while waiting for a later slot
+            reserved = limiter_held = slot_held = False
+            endpoint: Optional[PooledEndpoint] = None
+            started: Optional[float] = None
+            call_err: Optional[BaseException] = None
+            try:
+                with trace_async(tracer, "wait", "limiter"):
+                    if rate_limiter is not None:
+                        await rate_limiter.acquire(estimated)
+                        reserved = True
+                    if limiter is not None:
+                        await limiter.acquire()
+                        limiter_held = True
+                    if request_slots is not None:
+                        await request_slots.acquire()
+                        slot_held = True
+                api, endpoint_model_id = client, model_id
+                if isinstance(client, ClientPool):
+                    endpoint = client.acquire(avoid=failed_endpoints)
+                    api, endpoint_model_id = endpoint.client, endpoint.model_id or model_id
+                labels = {"stage": stage, "endpoint": endpoint.name if endpoint is not None else "default"}
+                if metrics is not None:
+                    metrics.add_gauge("llm_requests_in_flight", {"stage": stage}, 1)
+                started = time.monotonic()
+                # Sent: the reserved tokens are reconciled with the response (or stay spent)
+                reserved = False
+                with trace_async(tracer, "request", "llm", endpoint=labels["endpoint"]) as span:
+                    resp = await api.chat.completions.create(
+                        model=endpoint_model_id,
+                        messages=[
+                            {"role": "system", "content": system_prompt},
+                            {"role": "user", "content": request_content},
+                        ],
+                        response_format={"type": "json_object"},
+                    )
+                    content = (resp.choices[0].message.content or "").strip()
+                    span["response_chars"] = len(content)
+            except BaseException as e:
+                call_err = e
+                raise
+            finally:
+                latency = time.monotonic() - started if started is not None else 0.0
+                if metrics is not None and started is not None:
+                    metrics.add_gauge("llm_requests_in_flight", {"stage": stage}, -1)
+                    metrics.observe("llm_request_seconds", labels, latency)
+                    outcome = "ok" if call_err is None else classify_error(call_err)
+                    metrics.inc("llm_requests_total", {**labels, "outcome": outcome})
+                if reserved:
+                    rate_limiter.refund(estimated)
+                if limiter_held:
+                    limiter.release(latency, error=call_err)
+                if slot_held:
+                    request_slots.release()
+                if endpoint is not None:
+                    client.release(endpoint, error=call_err)
+                    if call_err is not None:
+                        failed_endpoints.add(endpoint.name)
+
+            tokens = token_usage(getattr(resp, "usage", None))
+            accumulate_token_usage(billed, {**tokens, "calls": 1})
+            if ledger is not None:
+                ledger.record(stage, endpoint_model_id, tokens)
+            if metrics is not None:
+                for token_type in ("prompt", "completion", "cached"):
+                    metrics.inc("llm_tokens_total", {"stage": stage, "type": token_type}, tokens[f"{token_type}_tokens"])
+            if rate_limiter is not None:
+                rate_limiter.reconcile(estimated, tokens["total_tokens"])
+
+            with trace_sync(tracer, "parse_json", "cpu", stage=stage, chars=len(content)):
+                parsed = parse_json_content(content, repair_stats)
+                if validate is not None:
+                    validate(parsed)
+            if cache is not None:
+                cache.put(cache_key, parsed, billed)
+            return parsed, billed
+
         except Exception as e:
             last_err = e
+            kind = classify_error(e)
+            if kind == SCHEMA and reask_with_error:
+                request_content = user_content + Schema_Reask_Prompt.format(error=e)
+
+        if kind == RATE_LIMITED:
+            rate_limited_attempts += 1
+        else:
+            attempts += 1
+        if not retry_policy.should_retry(kind, attempts, rate_limited_attempts):
+            break
 
-        # Backoff before next attempt
-        if attempt < retries - 1:
-            await asyncio.sleep(retry_base_sleep_s + random.random())
+        if retry_stats is not None:
+            retry_stats.record_retry(stage, kind)
+        if metrics is not None:
+            metrics.inc("llm_retries_total", {"stage": stage, "kind": kind})
+        if tracer is not None:
+            tracer.annotate(retries=attempts + rate_limited_attempts)
+        retry_index = rate_limited_attempts - 1 if kind == RATE_LIMITED else attempts - 1
+        with trace_async(tracer, "backoff", "retry", kind=kind):
+            await asyncio.sleep(retry_policy.delay_s(kind, retry_index, last_err))
 
-    raise RuntimeError(f"chat_once_json failed after {retries} retries: {last_err}")
+    if retry_stats is not None:
+        retry_stats.record_failure(stage, kind)
+    if metrics is not None:
+        metrics.inc("llm_failures_total", {"stage": stage, "kind": kind})
+    raise RuntimeError(
+        f"chat_once_json failed after {attempts + rate_limited_attempts} attempts ({kind}): {last_err}"
+    ) from last_err
@@ -1,4 +1,30 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    """Provider quota for one model; None means unlimited."""
+    rpm: Optional[float] = None
+    tpm: Optional[float] = None
+
+
+@dataclass(frozen=True)
+class ModelPrice:
+    """Price per million tokens for one model; cached prompt tokens default to the input price."""
+    input_per_1m: float
+    output_per_1m: float
+    cached_input_per_1m: Optional[float] = None
+
+
+@dataclass(frozen=True)
+class Endpoint:
+    """One OpenAI-compatible backend (or API key) for the client pool."""
+    base_url: str
+    api_key_env: str
+    weight: float = 1.0
+    model_id: Optional[str] = None  # served model name, if it differs from SynthesisConfig.model_id
+    name: Optional[str] = None
 
 
 @dataclass(frozen=True)
@@ -8,6 +34,34 @@ class SynthesisConfig:
     api_key_env: str
     model_id: str
 
+    # Endpoints/keys to load-balance over instead of base_url/api_key_env (when non-empty)
+    endpoints: Tuple[Endpoint, ...] = ()
+    endpoint_max_failures: int = 3
+    endpoint_eject_s: float = 30.0
+
+    # Per-stage routing (routing.py): the model per stage name (default model_id) and the endpoints serving
+    # a model (default: endpoints / base_url). A stage in cascade_models is first answered by that smaller
+    # model with cascade_max_attempts attempts, and escalated to its own model when the answer still fails
+    # or is low-confidence (evaluate: top_sim within cascade_margin of a threshold)
+    stage_models: Dict[str, str] = field(default_factory=dict)
+    model_endpoints: Dict[str, Tuple[Endpoint, ...]] = field(default_factory=dict)
+    cascade_models: Dict[str, str] = field(default_factory=dict)
+    cascade_max_attempts: int = 1
+    cascade_margin: float = 0.05
+
+    # Local resolvers (resolvers.py) answer a stage on the CPU when confident and defer to the LLM otherwise;
+    # local_audit_rate of the confident answers still go to the LLM to measure agreement.
+    # local_classifier: utterance_category_gt from classifier.py (trained weights from local_classifier_model,
+    # or the rule weights when None)
+    local_classifier: bool = False
+    local_classifier_model: Optional[str] = None
+    local_classifier_min_confidence: float = 0.9
+    local_audit_rate: float = 0.05
+    # local_similarity: evaluate_reason from similarity.py's char n-gram TF-IDF cosine when the best score is past
+    # a calibrated cutoff (calibration file from `python -m src.similarity calibrate`; None uses raw-cosine cutoffs)
+    local_similarity: bool = False
+    local_similarity_calibration: Optional[str] = None
+
     # Thresholds and limits
     high_confidence_threshold: float = 0.8
     low_confidence_threshold: float = 0.3
@@ -16,6 +70,89 @@ class SynthesisConfig:
     # Concurrency
     max_concurrency: int = 10
 
+    # Adaptive (AIMD) limit on in-flight requests, starting from max_concurrency
+    adaptive_concurrency: bool = False
+    adaptive_min_concurrency: int = 1
+    adaptive_max_concurrency: int = 64
+    adaptive_latency_target_s: Optional[float] = None
+
+    # Retry policy (see retry.RetryPolicy)
+    retry_max_attempts: int = 3
+    retry_max_rate_limited_attempts: int = 8
+    retry_base_delay_s: float = 1.0
+    retry_max_delay_s: float = 30.0
+    retry_max_retry_after_s: float = 120.0
+
+    # Chat history compaction (history.compact_history): token budget for the history embedded in
+    # prompts, per stage name overriding the default; None embeds the full history
+    history_max_tokens: Optional[int] = None
+    history_stage_max_tokens: Dict[str, int] = field(default_factory=dict)
+    history_keep_last_rounds: int = 2
+
+    # Validate each stage's JSON against schemas.STAGE_SCHEMAS and re-ask only that stage on a violation
+    validate_schemas: bool = True
+    schema_reask_with_error: bool = True
+
+    # Client-side RPM/TPM limits per model id; tokens are estimated as prompt + expected completion
+    rate_limits: Dict[str, RateLimit] = field(default_factory=dict)
+    rate_limit_burst_s: float = 10.0
+    expected_completion_tokens: int = 512
+
+    # Spend budget for one run (see ledger.UsageLedger): total tokens and/or cost from model_prices.
+    # Once reached, no new samples are scheduled and in-flight ones drain.
+    model_prices: Dict[str, ModelPrice] = field(default_factory=dict)
+    budget_tokens: Optional[int] = None
+    budget_cost: Optional[float] = None
+
+    # Metrics (metrics.py): Prometheus text at http://metrics_host:metrics_port/metrics and/or
+    # a JSON snapshot rewritten every metrics_interval_s; both off when None
+    metrics_port: Optional[int] = None
+    metrics_host: str = "127.0.0.1"
+    metrics_file: Optional[str] = None
+    metrics_interval_s: float = 15.0
+
+    # Chrome/Perfetto trace of items, stages, API attempts and event-loop lag (tracing.py); None disables it
+    trace_file: Optional[str] = None
+    trace_loop_lag_interval_s: float = 0.05
+
     # I/O
     input_file: str = r"data\raw\LMSYS.jsonl"
     output_file: str = r"data\synthesized_raw\LMSYS.jsonl"
+
+    # Output writer: batch size, flush interval and optional fsync per batch
+    write_batch_size: int = 64
+    write_flush_interval_s: float = 1.0
+    write_fsync: bool = False
+
+    # Stage result store for runs driven outside process_item (batch files, stage waves)
+    state_file: str = "data/state/LMSYS.stages.jsonl"
+
+    # Multi-round expansion (stages.item_ids): besides the final round (item_id 0), one item per earlier round
+    # whose context has at least expand_min_context_rounds rounds (item_id k predicts the user turn k rounds
+    # before the last), at most max_items_per_sample per sample (None: every round). With incremental_intent_tree
+    # an item's intent tree updates the previous round's tree with the new turns instead of re-reading the whole
+    # history; the other stages still embed each item's full history (see history_max_tokens)
+    expand_rounds: bool = False
+    expand_min_context_rounds: int = 1
+    max_items_per_sample: Optional[int] = 4
+    incremental_intent_tree: bool = True
+
+    # Stage waves (waves.py): workers per stage name, overriding max_concurrency for that wave
+    stage_concurrency: Dict[str, int] = field(default_factory=dict)
+
+    # Lease queue shared by several workers (lease.py); None runs this process alone over input_file.
+    # Each worker writes output_file's shard for its worker_id (default: host-pid)
+    lease_db: Optional[str] = None
+    worker_id: Optional[str] = None
+    lease_s: float = 300.0
+    lease_heartbeat_s: float = 60.0
+    lease_poll_s: float = 5.0
+    lease_max_attempts: int = 3
+
+    # Resume: skip samples whose (sample_id, item_id) is already in output_file
+    resume: bool = True
+
+    # Response cache (SQLite); None disables it
+    cache_path: Optional[str] = None
+    cache_max_age_s: Optional[float] = None
+    cache_max_bytes: Optional[int] = None
@@ -0,0 +1,377 @@
+# estimate.py
+# Dry run: project the tokens, cost and duration of a synthesis job without calling the API.
+#
+# Every stage prompt of every pending item (not in the output file yet) is rendered exactly as the pipeline would render it
+# (prompts.py, messages2history_round and history compaction), with schema-shaped placeholder results
+# standing in for the outputs of earlier stages. Prompt tokens are counted with tiktoken when it is
+# installed, otherwise with utils.estimate_tokens. The step 7 branches are weighted by an expected
+# top_sim mix, and each stage is priced at its routed model (cascaded stages at the small model plus the
+# expected escalations). If the output file already holds records, they calibrate the estimate: branch mix,
+# billed calls per stage (local answers, cascade escalations and schema re-asks, from each record's
+# stage_calls), completion tokens per call, cached-token share and a prompt-token correction factor.
+#
+#   python -m src.synthesis --dry-run
+#   python -m src.estimate --concurrency 32 --context-window 128000 --branch-mix 0.2,0.6,0.2
+#
+
+import argparse
+import json
+import os
+import random
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .config import SynthesisConfig
+from .io_utils import iter_jsonl, load_completed_keys
+from .ledger import UsageLedger
+from .routing import cascade_model, stage_model
+from .schemas import sample_stage_result
+from .stages import (
+    EVALUATE_REASON,
+    INCORRECT_PATH,
+    INTENT_TREE,
+    NEGATIVE_REVISE,
+    REVISE,
+    STAGES,
+    UTTERANCE_CATEGORY_GT,
+    ItemState,
+    build_item_states,
+    item_key,
+)
+from .utils import estimate_tokens, messages2history_round
+
+
+def token_counter(model_id: str) -> Tuple[Callable[[str], int], str]:
+    """(count function, name): tiktoken's encoding for the model if available, else the local estimator."""
+    try:
+        import tiktoken
+    except ImportError:
+        return estimate_tokens, "estimate_tokens"
+    try:
+        encoding = tiktoken.encoding_for_model(model_id)
+    except KeyError:
+        encoding = tiktoken.get_encoding("o200k_base")
+    return (lambda text: len(encoding.encode(text, disallowed_special=()))), f"tiktoken/{encoding.name}"
+
+
+@dataclass
+class Calibration:
+    """Expectations for the job, by default assumptions, refined from existing output records."""
+    branch_mix: Tuple[float, float, float] = (0.2, 0.6, 0.2)  # share of items with high / mid / low top_sim
+    completion_tokens_per_call: Optional[float] = None  # None: cfg.expected_completion_tokens
+    cached_ratio: float = 0.0
+    prompt_factor: float = 1.0  # actual / estimated prompt tokens
+    stage_calls: Dict[str, float] = field(default_factory=dict)  # billed calls per item that needs the stage
+    records: int = 0
+
+
+@dataclass
+class StageProjection:
+    calls: float = 0.0
+    prompt_tokens: float = 0.0
+    completion_tokens: float = 0.0
+
+
+@dataclass
+class Projection:
+    samples: int = 0
+    items: int = 0
+    done: int = 0  # items already in the output file
+    skipped: int = 0
+    stages: Dict[str, StageProjection] = field(default_factory=lambda: defaultdict(StageProjection))
+    over_context: List[Tuple[str, str, int]] = field(default_factory=list)  # (item key, stage, tokens)
+
+
+def placeholder_result(cfg: SynthesisConfig, stage: str, rng: random.Random) -> Any:
+    """A schema-valid stand-in result; evaluate scores sit between the thresholds so every later stage renders."""
+    result = sample_stage_result(stage, rng)
+    if stage == EVALUATE_REASON:
+        mid = (cfg.low_confidence_threshold + cfg.high_confidence_threshold) / 2
+        for element in result:
+            element["similarity"] = mid
+    return result
+
+
+def render_item_prompts(
+    cfg: SynthesisConfig, state: ItemState, rng: random.Random, incremental: bool = True
+) -> Dict[str, str]:
+    """
+    Every stage's full prompt text (system + user) for one item; with incremental, an expanded item
+    builds on a placeholder tree for the previous round.
+    """
+    if incremental and state.new_turns:
+        state.previous_intent_tree = placeholder_result(cfg, INTENT_TREE, rng)
+    prompts: Dict[str, str] = {}
+    for stage in STAGES:
+        prompt = stage.build(cfg, state)
+        if prompt is not None:
+            prompts[stage.name] = prompt[0] + prompt[1]
+        state.results[stage.name] = placeholder_result(cfg, stage.name, rng)
+    return prompts
+
+
+def stage_weights(mix: Tuple[float, float, float]) -> Dict[str, float]:
+    """Expected calls per item for the branch stages: REVISE unless top_sim is high, the rejected side unless low."""
+    high, _, low = mix
+    return {REVISE: 1.0 - high, INCORRECT_PATH: 1.0 - low, NEGATIVE_REVISE: 1.0 - low}
+
+
+def calibrate(cfg: SynthesisConfig, count: Callable[[str], int]) -> Calibration:
+    """Refine the default expectations from the records already in the output file (if any)."""
+    calibration = Calibration()
+    if not os.path.exists(cfg.output_file):
+        return calibration
+    high = low = calls = completion = prompt = cached = estimated = 0
+    needed: Dict[str, int] = defaultdict(int)
+    stage_calls: Dict[str, int] = defaultdict(int)
+    rng = random.Random(0)
+    for record in iter_jsonl(cfg.output_file):
+        usage = record.get("usage") or {}
+        if usage.get("cache_hits") or not usage.get("prompt_tokens"):
+            continue  # (partly) answered from the response cache; its usage undercounts the API calls
+        top_sim = record["top_sim"]
+        high += top_sim >= cfg.high_confidence_threshold
+        low += top_sim < cfg.low_confidence_threshold
+        completion += usage.get("completion_tokens", 0)
+        prompt += usage["prompt_tokens"]
+        cached += usage.get("cached_tokens", 0)
+        item = {k: record[k] for k in ("sample_id", "item_id", "context", "label", "negative_label")}
+        state = ItemState(item=item, chat_history=messages2history_round(item["context"]))
+        prompts = render_item_prompts(cfg, state, rng)
+        if "revised_insight_reason" not in record:
+            prompts.pop(REVISE, None)
+        if "incorrect_path" not in record["rejected"]:
+            prompts.pop(INCORRECT_PATH, None)
+            prompts.pop(NEGATIVE_REVISE, None)
+        # Records written before stage_calls existed: one call per stage the item needed
+        counts = record.get("stage_calls") or {stage: 1 for stage in prompts}
+        for stage, text in prompts.items():
+            needed[stage] += 1
+            stage_calls[stage] += counts.get(stage, 0)
+            calls += counts.get(stage, 0)
+            estimated += counts.get(stage, 0) * count(text)
+        calibration.records += 1
+    if calibration.records:
+        n = calibration.records
+        calibration.branch_mix = (high / n, (n - high - low) / n, low / n)
+        calibration.completion_tokens_per_call = completion / calls if calls else None
+        calibration.cached_ratio = cached / prompt
+        calibration.prompt_factor = prompt / estimated if estimated else 1.0
+        calibration.stage_calls = {stage: stage_calls[stage] / needed[stage] for stage in needed}
+    return calibration
+
+
+def project(
+    cfg: SynthesisConfig,
+    calibration: Calibration,
+    count: Callable[[str], int],
+    context_window: Optional[int],
+) -> Projection:
+    projection = Projection()
+    weights = stage_weights(calibration.branch_mix)
+    completion = calibration.completion_tokens_per_call or cfg.expected_completion_tokens
+    rng = random.Random(0)
+    completed = load_completed_keys(cfg.output_file, repair=False) if cfg.resume else set()
+    for sample in iter_jsonl(cfg.input_file):
+        states = build_item_states(cfg, sample)
+        if not states:
+            projection.skipped += 1
+            continue
+        pending = [state for state in states if (state.item["sample_id"], state.item["item_id"]) not in completed]
+        projection.done += len(states) - len(pending)
+        if not pending:
+            continue
+        projection.samples += 1
+        projection.items += len(pending)
+        for state in pending:
+            # The run only builds on the previous round's tree if that item is synthesized alongside
+            incremental = (sample["id"], state.item["item_id"] + 1) not in completed
+            for stage, text in render_item_prompts(cfg, state, rng, incremental).items():
+                tokens = count(text) * calibration.prompt_factor
+                weight = weights.get(stage, 1.0)
+                entry = projection.stages[stage]
+                entry.calls += weight
+                entry.prompt_tokens += weight * tokens
+                entry.completion_tokens += weight * completion
+                if context_window is not None and tokens + completion > context_window:
+                    projection.over_context.append((item_key(state.item), stage, int(tokens)))
+    return projection
+
+
+def projected_duration_s(
+    cfg: SynthesisConfig,
+    model_load: Dict[str, Tuple[float, float]],
+    completion_per_call: float,
+    concurrency: int,
+    latency_base_s: float,
+    output_tokens_per_s: float,
+) -> Dict[str, float]:
+    """Wall time bounded by concurrency x per-call latency and, per routed model, by its RPM/TPM limits.
+
+    model_load maps each model to its projected (calls, tokens); the slowest bound is the projection.
+    """
+    calls = sum(model_calls for model_calls, _ in model_load.values())
+    latency = latency_base_s + completion_per_call / output_tokens_per_s
+    bounds = {"latency_per_call_s": latency, "concurrency_bound_s": calls * latency / max(concurrency, 1)}
+    for model_id, (model_calls, tokens) in sorted(model_load.items()):
+        limit = cfg.rate_limits.get(model_id)
+        if limit is not None and limit.rpm:
+            bounds[f"rpm_bound_s[{model_id}]"] = model_calls / limit.rpm * 60
+        if limit is not None and limit.tpm:
+            bounds[f"tpm_bound_s[{model_id}]"] = tokens / limit.tpm * 60
+    bounds["projected_s"] = max(v for k, v in bounds.items() if "_bound_s" in k)
+    return bounds
+
+
+def run_estimate(
+    cfg: SynthesisConfig,
+    concurrency: Optional[int] = None,
+    context_window: Optional[int] = 128_000,
+    branch_mix: Optional[Tuple[float, float, float]] = None,
+    latency_base_s: float = 1.0,
+    output_tokens_per_s: float = 40.0,
+    escalation_rate: float = 0.25,
+    show_over_context: int = 20,
+) -> Dict[str, Any]:
+    count, counter_name = token_counter(cfg.model_id)
+    calibration = calibrate(cfg, count)
+    if branch_mix is not None:
+        calibration.branch_mix = branch_mix
+    projection = project(cfg, calibration, count, context_window)
+    completion = calibration.completion_tokens_per_call or cfg.expected_completion_tokens
+
+    ledger = UsageLedger(cfg.model_prices)
+    print(f"[Dry run] {projection.samples} samples ({projection.skipped} skipped), {projection.items} pending items "
+          f"({projection.done} already in {cfg.output_file}) from {cfg.input_file}")
+    print(f"Token counter: {counter_name}, calibrated on {calibration.records} records: "
+          f"branch mix high/mid/low {tuple(round(x, 3) for x in calibration.branch_mix)}, "
+          f"{completion:.0f} completion tokens per call, cached {calibration.cached_ratio:.1%}, "
+          f"prompt factor {calibration.prompt_factor:.3f}")
+    print(f"{'stage':<28}{'calls':>10}{'prompt tok':>14}{'compl tok':>12}{'cost':>12}")
+    totals = StageProjection()
+    total_cost = 0.0
+    unpriced = set()
+    stages: Dict[str, Dict[str, float]] = {}
+    model_load: Dict[str, Tuple[float, float]] = {}
+    for stage in STAGES:
+        entry = projection.stages.get(stage.name)
+        if entry is None:
+            continue
+        # Billed calls per item that needs the stage: calibrated, or one, and for a cascaded stage one to its
+        # small model plus escalation_rate to its own model (calibrated: the calls beyond one escalate)
+        model_id = stage_model(cfg, stage.name)
+        small_model = cascade_model(cfg, stage.name)
+        ratio = calibration.stage_calls.get(stage.name)
+        if small_model is None:
+            routes = [(model_id, 1.0 if ratio is None else ratio)]
+        elif ratio is None:
+            routes = [(small_model, 1.0), (model_id, escalation_rate)]
+        else:
+            routes = [(small_model, min(ratio, 1.0)), (model_id, max(ratio - 1.0, 0.0))]
+        calls = prompt_tokens = completion_tokens = cost = 0.0
+        for model_id, share in routes:
+            usage = {
+                "prompt_tokens": int(share * entry.prompt_tokens),
+                "completion_tokens": int(share * entry.completion_tokens),
+                "cached_tokens": int(share * entry.prompt_tokens * calibration.cached_ratio),
+            }
+            calls += share * entry.calls
+            prompt_tokens += usage["prompt_tokens"]
+            completion_tokens += usage["completion_tokens"]
+            model_calls, model_tokens = model_load.get(model_id, (0.0, 0.0))
+            model_load[model_id] = (
+                model_calls + share * entry.calls,
+                model_tokens + usage["prompt_tokens"] + usage["completion_tokens"],
+            )
+            cost += ledger.cost(model_id, usage)
+            if model_id not in cfg.model_prices:
+                unpriced.add(model_id)
+        stages[stage.name] = {
+            "models": [model_id for model_id, _ in routes],
+            "calls": calls,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cost": cost,
+        }
+        print(f"{stage.name:<28}{calls:>10.0f}{prompt_tokens:>14,.0f}{completion_tokens:>12,.0f}{cost:>12.4f}"
+              f"  {' -> '.join(model_id for model_id, _ in routes)}")
+        totals.calls += calls
+        totals.prompt_tokens += prompt_tokens
+        totals.completion_tokens += completion_tokens
+        total_cost += cost
+    print(f"{'total':<28}{totals.calls:>10.0f}{totals.prompt_tokens:>14,.0f}{totals.completion_tokens:>12,.0f}{total_cost:>12.4f}")
+    if unpriced:
+        print(f"(no price for {sorted(unpriced)} in model_prices: cost shown as 0)")
+    local_stages = [UTTERANCE_CATEGORY_GT] * cfg.local_classifier + [EVALUATE_REASON] * cfg.local_similarity
+    uncalibrated = [stage for stage in local_stages if stage not in calibration.stage_calls]
+    if uncalibrated:
+        print(f"(local answers for {uncalibrated} are not calibrated yet: every such call is projected to the API)")
+
+    concurrency = concurrency or cfg.max_concurrency
+    duration = projected_duration_s(
+        cfg, model_load, completion, concurrency, latency_base_s, output_tokens_per_s,
+    )
+    print(f"Projected duration at concurrency {concurrency}: {duration['projected_s'] / 3600:.2f} h "
+          f"({', '.join(f'{k}={v:,.1f}' for k, v in duration.items() if k != 'projected_s')})")
+
+    if context_window is not None:
+        flagged = {key for key, _, _ in projection.over_context}
+        print(f"Items with a prompt over the {context_window:,}-token context window: {len(flagged)}")
+        for key, stage, tokens in projection.over_context[:show_over_context]:
+            print(f"  {key} {stage}: ~{tokens:,} prompt tokens")
+
+    return {
+        "samples": projection.samples,
+        "items": projection.items,
+        "stages": stages,
+        "calls": totals.calls,
+        "prompt_tokens": totals.prompt_tokens,
+        "completion_tokens": totals.completion_tokens,
+        "cost": total_cost,
+        "duration": duration,
+        "over_context": projection.over_context,
+    }
+
+
+def add_estimate_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--concurrency", type=int, default=None, help="Concurrency for the time projection.")
+    parser.add_argument("--context-window", type=int, default=128_000, help="Model context window in tokens.")
+    parser.add_argument("--branch-mix", type=str, default=None,
+                        help="Share of items with high,mid,low top_sim (overrides calibration), e.g. 0.2,0.6,0.2.")
+    parser.add_argument("--latency-base-s", type=float, default=1.0, help="Per-call latency before the first token.")
+    parser.add_argument("--output-tokens-per-s", type=float, default=40.0, help="Generation speed per call.")
+    parser.add_argument("--escalation-rate", type=float, default=0.25,
+                        help="Share of cascaded calls expected to escalate (when not calibrated from records).")
+
+
+def estimate_from_args(cfg: SynthesisConfig, args: argparse.Namespace) -> Dict[str, Any]:
+    mix = tuple(float(x) for x in args.branch_mix.split(",")) if args.branch_mix else None
+    if mix is not None and len(mix) != 3:
+        raise ValueError("--branch-mix needs three comma-separated shares (high,mid,low)")
+    return run_estimate(
+        cfg,
+        concurrency=args.concurrency,
+        context_window=args.context_window,
+        branch_mix=mix,
+        latency_base_s=args.latency_base_s,
+        output_tokens_per_s=args.output_tokens_per_s,
+        escalation_rate=args.escalation_rate,
+    )
+
+
+def main() -> None:
+    from .synthesis import default_config
+
+    parser = argparse.ArgumentParser(description="Project tokens, cost and duration of a synthesis job (no API calls).")
+    add_estimate_args(parser)
+    parser.add_argument("--json", type=str, default=None, help="Also write the projection to this JSON file.")
+    args = parser.parse_args()
+    result = estimate_from_args(default_config(), args)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from .utils import estimate_tokens, messages2history_round
+
+Turn = Tuple[str, str]  # (role, content)
+
+_MIN_TURN_TOKENS = 32
+
+
+def split_rounds(messages: List[Dict[str, Any]]) -> List[List[Turn]]:
+    """
+    Split a message list into the rounds messages2history_round numbers: a round starts at a user turn
+    that does not follow another user turn (system prompts in between do not count). Turns before the
+    first user turn belong to the first round; system prompts stay where they are.
+    """
+    leading: List[Turn] = []
+    rounds: List[List[Turn]] = []
+    last_role = None
+    for message in messages:
+        role = (message.get("role") or "").lower()
+        content = (message.get("content") or "").strip()
+        if role == "user" and last_role != "user":
+            rounds.append([] if rounds else leading)
+        (rounds[-1] if rounds else leading).append((role, content))
+        if role != "system":
+            last_role = role
+    if not rounds and leading:
+        rounds.append(leading)
+    return rounds
+
+
+def render_rounds(rounds: List[List[Turn]], dropped: Optional[Set[int]] = None, first_round: int = 1) -> str:
+    """
+    Render like messages2history_round. Rounds whose index is in dropped are summarized by an
+    "[Rounds i-j omitted]" marker; only their system prompts are kept.
+    """
+    dropped = dropped or set()
+    lines: List[str] = []
+    omitted: List[int] = []
+
+    def flush_omitted() -> None:
+        if omitted:
+            span = f"{omitted[0]}" if len(omitted) == 1 else f"{omitted[0]}-{omitted[-1]}"
+            lines.append(f"\n[Round {span} omitted]" if len(omitted) == 1 else f"\n[Rounds {span} omitted]")
+            omitted.clear()
+
+    for index, turns in enumerate(rounds):
+        number = index + first_round
+        if index in dropped:
+            omitted.append(number)
+            lines.extend(f"[System Prompt]: {content}" for role, content in turns if role == "system")
+            continue
+        flush_omitted()
+        header = True
+        for role, content in turns:
+            if role == "system":
+                lines.append(f"[System Prompt]: {content}")
+                continue
+            if role == "user" and header:
+                lines.append(f"\n[Round {number}]")
+                header = False
+            lines.append(f"{role.capitalize()}: {content}")
+    flush_omitted()
+    return "\n".join(lines)
+
+
+def truncate_text(text: str, max_tokens: int) -> str:
+    """Keep the head of text within about max_tokens (estimate_tokens), marking the cut."""
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    cut = len(text) * max_tokens // tokens
+    while cut > 0 and estimate_tokens(text[:cut]) > max_tokens:
+        cut = cut * 9 // 10
+    return f"{text[:cut].rstrip()} ...[truncated {len(text) - cut} chars]"
+
+
+def compact_history(messages: List[Dict[str, Any]], max_tokens: int, keep_last_rounds: int = 2) -> str:
+    """
+    Render the conversation within about max_tokens. A history that fits is returned exactly as
+    messages2history_round renders it. Otherwise, touching only rounds before the last
+    keep_last_rounds (which stay verbatim), in order until it fits:
+      1. turns identical to an earlier turn become "[same as Round k]",
+      2. older turns are cut to a per-turn token cap, halved step by step,
+      3. the oldest rounds are dropped.
+    System prompts are never shortened or dropped.
+    """
+    full = messages2history_round(messages)
+    if estimate_tokens(full) <= max_tokens:
+        return full
+
+    rounds = split_rounds(messages)
+    split = max(len(rounds) - keep_last_rounds, 0)
+    older: List[List[Turn]] = [list(turns) for turns in rounds[:split]]
+    recent: List[List[Turn]] = [list(turns) for turns in rounds[split:]]
+    dropped: Set[int] = set()
+
+    def render() -> str:
+        return render_rounds(older + recent, dropped)
+
+    seen: Dict[Turn, int] = {}
+    for number, turns in enumerate(older, start=1):
+        for i, turn in enumerate(turns):
+            if turn[0] == "system":
+                continue
+            if turn in seen:
+                turns[i] = (turn[0], f"[same as Round {seen[turn]}]")
+            else:
+                seen[turn] = number
+    history = render()
+    if estimate_tokens(history) <= max_tokens:
+        return history
+
+    original = [list(turns) for turns in older]
+    cap = max((estimate_tokens(content) for turns in original for _, content in turns), default=0)
+    while cap > _MIN_TURN_TOKENS:
+        cap //= 2
+        older = [
+            [(role, content if role == "system" else truncate_text(content, cap)) for role, content in turns]
+            for turns in original
+        ]
+        history = render()
+        if estimate_tokens(history) <= max_tokens:
+            return history
+
+    for i in range(len(older)):
+        dropped.add(i)
+        history = render()
+        if estimate_tokens(history) <= max_tokens:
+            break
+    return history
@@ -1,5 +1,10 @@
+import asyncio
 import json
-from typing import Any, Dict, Iterable, List
+import os
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from .tracing import Tracer, trace_sync
+from .utils import accumulate_token_usage, empty_token_usage
 
 
 def read_jsonl(path: str) -> List[Dict[str, Any]]:
@@ -7,23 +12,202 @@ def read_jsonl(path: str) -> List[Dict[str, Any]]:
         return [json.loads(line) for line in f]
 
 
+def iter_jsonl(path: str) -> Iterator[Dict[str, Any]]:
+    """Lazily yield one JSON object per non-empty line."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def count_lines(path: str, chunk_size: int = 1 << 20) -> int:
+    """Count lines without decoding the file (used for progress totals)."""
+    count = 0
+    last = b"\n"
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            count += chunk.count(b"\n")
+            last = chunk[-1:]
+    if last != b"\n":
+        count += 1
+    return count
+
+
 def append_jsonl(path: str, obj: Dict[str, Any]) -> None:
     """
     Append one JSON object as a line.
-    Note: called from multiple async tasks; use an async-safe writer if needed.
-    In practice, a single-process append often works, but it can interleave under heavy concurrency.
+    Note: not safe to call from many concurrent tasks (lines can interleave); use JsonlWriter there.
     """
     with open(path, "a", encoding="utf-8") as f:
         f.write(json.dumps(obj, ensure_ascii=False) + "\n")
 
 
+class JsonlWriter:
+    """
+    Single writer for an output JSONL shared by many async tasks.
+    Records arrive over a bounded asyncio queue and are serialized and appended off the event loop
+    in batches of up to batch_size, at least every flush_interval_s; lines never interleave.
+    on_written, if given, is called (in the writer thread) with each batch once it is flushed (and fsynced).
+    With a tracer, every batch write is a span on the writer thread.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        batch_size: int = 64,
+        flush_interval_s: float = 1.0,
+        fsync: bool = False,
+        on_written: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+        tracer: Optional[Tracer] = None,
+    ) -> None:
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self.fsync = fsync
+        self.on_written = on_written
+        self.tracer = tracer
+        self.written = 0
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=batch_size * 4)
+        self._wake = asyncio.Event()
+        self._closing = False
+        self._file = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._task = asyncio.ensure_future(self._run())
+
+    async def write(self, obj: Dict[str, Any]) -> None:
+        """
+        Queue one record, waiting while the queue is full.
+        Raises RuntimeError (from the writer's own error, if it failed) once the writer task has stopped.
+        """
+        self._check_running()
+        if self._queue.full():
+            # Race the put against the writer task, so a writer that dies with a full queue fails its callers.
+            put = asyncio.ensure_future(self._queue.put(obj))
+            try:
+                done, _ = await asyncio.wait({put, self._task}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                put.cancel()
+            if put not in done:
+                self._check_running()
+        else:
+            self._queue.put_nowait(obj)
+        if self._queue.qsize() >= self.batch_size:
+            self._wake.set()
+
+    def _check_running(self) -> None:
+        task = self._task
+        if task is not None and not task.done():
+            return
+        error = None if task is None or task.cancelled() else task.exception()
+        if error is not None:
+            raise RuntimeError(f"JsonlWriter for {self.path} failed: {error}") from error
+        raise RuntimeError(f"JsonlWriter for {self.path} is not running")
+
+    async def close(self) -> None:
+        """Flush everything queued so far and close the file."""
+        if self._task is None:
+            return
+        self._closing = True
+        self._wake.set()
+        try:
+            await self._task
+        finally:
+            self._file.close()
+            self._task = None
+
+    async def _run(self) -> None:
+        while not (self._closing and self._queue.empty()):
+            if not self._closing and self._queue.qsize() < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval_s)
+                except asyncio.TimeoutError:
+                    pass
+            self._wake.clear()
+
+            batch = []
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            if batch:
+                await asyncio.to_thread(self._write_batch, batch)
+
+    def _write_batch(self, batch: List[Dict[str, Any]]) -> None:
+        with trace_sync(self.tracer, "write_batch", "io", records=len(batch)) as span:
+            data = "".join(json.dumps(obj, ensure_ascii=False) + "\n" for obj in batch)
+            span["chars"] = len(data)
+            self._file.write(data)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+        self.written += len(batch)
+        if self.on_written is not None:
+            self.on_written(batch)
+
+
+def repair_jsonl_tail(path: str) -> None:
+    """Truncate a partial last line (crash mid-write) so later appends start on a clean line."""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size == 0:
+            return
+        pos = size
+        while pos > 0:
+            step = min(1 << 16, pos)
+            f.seek(pos - step)
+            chunk = f.read(step)
+            newline = chunk.rfind(b"\n")
+            if newline >= 0:
+                good_end = pos - step + newline + 1
+                break
+            pos -= step
+        else:
+            good_end = 0
+        if good_end != size:
+            print(f"[Resume] truncating partial last line in {path} ({size - good_end} bytes)")
+            f.truncate(good_end)
+
+
+def load_completed_keys(path: str, repair: bool = True) -> Set[Tuple[Any, Any]]:
+    """
+    Scan an existing output JSONL and return the (sample_id, item_id) pairs already written.
+    A partial last line is truncated first (unless repair is False, for read-only callers);
+    unparseable lines are skipped with a warning.
+    """
+    completed: Set[Tuple[Any, Any]] = set()
+    if not os.path.exists(path):
+        return completed
+
+    if repair:
+        repair_jsonl_tail(path)
+    bad_lines = 0
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                obj = json.loads(line)
+                completed.add((obj["sample_id"], obj["item_id"]))
+            except (ValueError, KeyError, TypeError):
+                bad_lines += 1
+
+    if bad_lines:
+        print(f"[Resume] skipped {bad_lines} unparseable lines in {path}")
+    return completed
+
+
 def sum_usage_from_jsonl(path: str) -> Dict[str, int]:
-    usage_all = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    usage_all = empty_token_usage()
     with open(path, "r", encoding="utf-8") as f:
         for line in f:
             item = json.loads(line)
-            usage = item.get("usage", {})
-            usage_all["prompt_tokens"] += usage.get("prompt_tokens", 0)
-            usage_all["completion_tokens"] += usage.get("completion_tokens", 0)
-            usage_all["total_tokens"] += usage.get("total_tokens", 0)
+            accumulate_token_usage(usage_all, item.get("usage", {}))
     return usage_all
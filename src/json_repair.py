@@ -0,0 +1,147 @@
+import json
+import re
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+_FENCE_RE = re.compile(r"```[A-Za-z0-9_-]*\s*\n?(.*?)\n?\s*```", re.DOTALL)
+
+# Full-width punctuation the models sometimes emit as JSON syntax (e.g. the "，" in the
+# Utterance_Classification_Sys_Prompt example). Only replaced outside string literals.
+_PUNCTUATION = {"，": ",", "：": ":", "｛": "{", "｝": "}", "［": "[", "］": "]"}
+
+
+def _strip_fence(text: str) -> Optional[str]:
+    match = _FENCE_RE.search(text)
+    return match.group(1) if match else None
+
+
+def _balanced_end(text: str, start: int) -> Optional[int]:
+    """
+    Index just past the value opened at text[start], ignoring brackets inside strings.
+    Returns -1 for a mismatched closer and None if the text ends before the value closes.
+    """
+    stack: List[str] = []
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if not stack or stack.pop() != ch:
+                return -1
+            if not stack:
+                return i + 1
+    return None
+
+
+def _parses(text: str) -> bool:
+    try:
+        json.loads(text)
+    except ValueError:
+        return False
+    return True
+
+
+def _extract_balanced(text: str) -> Optional[str]:
+    """
+    The first top-level {...} or [...] value that parses (as is or once punctuation is normalized).
+    Bracketed prose such as "Note [x]:" is skipped; a value that parses is preferred over the values nested in it.
+    """
+    start = 0
+    while True:
+        starts = [i for i in (text.find("{", start), text.find("[", start)) if i >= 0]
+        if not starts:
+            return None
+        start = min(starts)
+        end = _balanced_end(text, start)
+        if end is None:
+            # Truncated: anything further is nested in this value, not a top-level candidate
+            return None
+        if end < 0:
+            start += 1
+            continue
+        candidate = text[start:end]
+        if _parses(candidate) or _parses(_normalize_punctuation(candidate)):
+            return candidate
+        start = end
+
+
+def _normalize_punctuation(text: str) -> Optional[str]:
+    """Map full-width JSON punctuation outside strings to ASCII and drop trailing commas."""
+    out: List[str] = []
+    in_string = False
+    escaped = False
+    for ch in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            out.append(ch)
+            continue
+        if ch == '"':
+            in_string = True
+        ch = _PUNCTUATION.get(ch, ch)
+        if ch in "}]":
+            j = len(out) - 1
+            while j >= 0 and out[j].isspace():
+                j -= 1
+            if j >= 0 and out[j] == ",":
+                del out[j]
+        out.append(ch)
+    return "".join(out)
+
+
+_REPAIRS: List[Tuple[str, Callable[[str], Optional[str]]]] = [
+    ("strip_fence", _strip_fence),
+    ("extract_balanced", _extract_balanced),
+    ("normalize_punctuation", _normalize_punctuation),
+]
+
+
+def salvage_json(text: str) -> Tuple[Any, str]:
+    """
+    Try cheap local repairs on a completion that json.loads rejected, cumulatively and in order:
+    strip a markdown code fence, cut out the first top-level JSON value that parses, normalize punctuation.
+    Returns (parsed, "+"-joined names of the repairs applied); raises ValueError if none helps.
+    """
+    current = text
+    applied: List[str] = []
+    for name, repair in _REPAIRS:
+        repaired = repair(current)
+        if repaired is None or repaired == current:
+            continue
+        current = repaired
+        applied.append(name)
+        try:
+            return json.loads(current), "+".join(applied)
+        except ValueError:
+            continue
+    raise ValueError("no local repair produced valid JSON")
+
+
+class RepairStats:
+    """How often each repair (combination) salvaged a response, and how often none did."""
+
+    def __init__(self) -> None:
+        self.counts: Dict[str, int] = defaultdict(int)
+
+    def record(self, repair: str) -> None:
+        self.counts[repair] += 1
+
+    def summary(self) -> Dict[str, int]:
+        return dict(self.counts)
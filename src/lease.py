@@ -0,0 +1,273 @@
+# lease.py
+# Share one synthesis job between several worker processes (or hosts, with the lease database
+# and the input on shared storage).
+#
+#   python -m src.synthesis --lease-db data/state/LMSYS.leases.sqlite            # on every worker
+#   python -m src.lease status --lease-db data/state/LMSYS.leases.sqlite
+#   python -m src.lease merge                                                     # once all are done
+#
+# Each worker writes its own shard next to output_file (LMSYS.<worker_id>.jsonl); merge combines
+# the shards into output_file, without duplicates and ordered by sample_id.
+
+import argparse
+import dataclasses
+import glob
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Tuple
+
+from .config import SynthesisConfig
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def shard_path(output_file: str, worker_id: str) -> str:
+    root, ext = os.path.splitext(output_file)
+    return f"{root}.{worker_id}{ext}"
+
+
+def worker_config(cfg: SynthesisConfig) -> SynthesisConfig:
+    """The config of one lease worker: a worker id and this worker's output shard as output_file."""
+    worker_id = cfg.worker_id or default_worker_id()
+    return dataclasses.replace(cfg, worker_id=worker_id, output_file=shard_path(cfg.output_file, worker_id))
+
+
+class LeaseQueue:
+    """
+    SQLite table of input samples shared by the workers of one job.
+    A worker claims samples for lease_s seconds, renews its leases with heartbeat() and marks a
+    sample done once its record is written; when a worker crashes, its leases expire and the
+    samples are claimed again by someone else. A sample is handed out at most max_attempts times.
+    Uses SQLite's default rollback journal rather than WAL, which does not work on network file systems.
+    """
+
+    def __init__(self, path: str, worker_id: str, lease_s: float = 300.0, max_attempts: int = 3) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.worker_id = worker_id
+        self.lease_s = lease_s
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS samples ("
+            " sample_id TEXT PRIMARY KEY, offset INTEGER NOT NULL, status TEXT NOT NULL,"
+            " worker TEXT, lease_until REAL, attempts INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS samples_status ON samples (status, lease_until)")
+
+    def _transaction(self, statements: Iterable[Tuple[str, Any]]) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for sql, params in statements:
+                    self._conn.execute(sql, params)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def seed(self, input_file: str) -> int:
+        """Register every sample of input_file with its byte offset (idempotent); returns the number added."""
+        rows = []
+        offset = 0
+        with open(input_file, "rb") as f:
+            for line in f:
+                if line.strip():
+                    rows.append((str(json.loads(line)["id"]), offset, PENDING))
+                offset += len(line)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            before = self._conn.execute("SELECT COUNT(*) FROM samples").fetchone()[0]
+            self._conn.executemany("INSERT OR IGNORE INTO samples (sample_id, offset, status) VALUES (?, ?, ?)", rows)
+            after = self._conn.execute("SELECT COUNT(*) FROM samples").fetchone()[0]
+            self._conn.execute("COMMIT")
+        return after - before
+
+    def claim(self, n: int) -> List[Tuple[str, int]]:
+        """Lease up to n pending (or expired) samples to this worker; returns their (sample_id, offset)."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT sample_id, offset FROM samples WHERE attempts < ?"
+                    " AND (status = ? OR (status = ? AND lease_until < ?)) ORDER BY rowid LIMIT ?",
+                    (self.max_attempts, PENDING, LEASED, now, n),
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE samples SET status = ?, worker = ?, lease_until = ?, attempts = attempts + 1"
+                    " WHERE sample_id = ?",
+                    [(LEASED, self.worker_id, now + self.lease_s, sample_id) for sample_id, _ in rows],
+                )
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+        return rows
+
+    def heartbeat(self) -> None:
+        """Extend every lease this worker holds."""
+        self._transaction([(
+            "UPDATE samples SET lease_until = ? WHERE status = ? AND worker = ?",
+            (time.time() + self.lease_s, LEASED, self.worker_id),
+        )])
+
+    def complete(self, sample_ids: Iterable[str]) -> None:
+        self._transaction(
+            ("UPDATE samples SET status = ?, worker = ?, lease_until = NULL WHERE sample_id = ?",
+             (DONE, self.worker_id, sample_id))
+            for sample_id in sample_ids
+        )
+
+    def release(self, sample_id: str) -> None:
+        """Give a leased sample back (failed or not started) so it can be claimed again."""
+        self._transaction([(
+            "UPDATE samples SET status = ?, lease_until = NULL WHERE sample_id = ? AND status = ? AND worker = ?",
+            (PENDING, sample_id, LEASED, self.worker_id),
+        )])
+
+    def in_flight(self) -> int:
+        """Samples under a live lease (of any worker), which may still complete or come back."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM samples WHERE status = ? AND lease_until >= ?", (LEASED, time.time())
+            ).fetchone()[0]
+
+    def stats(self) -> Dict[str, int]:
+        now = time.time()
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM samples GROUP BY status").fetchall())
+            exhausted = self._conn.execute(
+                "SELECT COUNT(*) FROM samples WHERE attempts >= ? AND (status = ? OR (status = ? AND lease_until < ?))",
+                (self.max_attempts, PENDING, LEASED, now),
+            ).fetchone()[0]
+        return {**counts, "exhausted": exhausted}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class SampleCompletion:
+    """
+    Completes a sample's lease once the records of all of its items are written: expect() sets the
+    item count when the sample starts (1 if never set), written() is the writer's on_written callback.
+    """
+
+    def __init__(self, leases: LeaseQueue) -> None:
+        self.leases = leases
+        self._pending: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def expect(self, sample_id: str, items: int) -> None:
+        with self._lock:
+            self._pending[sample_id] = items
+
+    def written(self, batch: List[Dict[str, Any]]) -> None:
+        done = []
+        with self._lock:
+            for record in batch:
+                sample_id = str(record["sample_id"])
+                left = self._pending.pop(sample_id, 1) - 1
+                if left > 0:
+                    self._pending[sample_id] = left
+                else:
+                    done.append(sample_id)
+        if done:
+            self.leases.complete(done)
+
+
+def read_sample_at(f, offset: int) -> Dict[str, Any]:
+    f.seek(offset)
+    return json.loads(f.readline())
+
+
+def _sort_key(sample_id: Any) -> Tuple[int, Any]:
+    return (0, sample_id) if isinstance(sample_id, (int, float)) else (1, str(sample_id))
+
+
+def merge_shards(shard_paths: List[str], output_path: str) -> Dict[str, int]:
+    """
+    Merge worker shards into one JSONL ordered by (sample_id, item_id), keeping the first copy of
+    records written twice (a lease that expired while its worker was still busy). Only an index of
+    the records is kept in memory; unparseable lines (a shard's partial last line) are skipped.
+    """
+    index: Dict[Tuple[Any, Any], Tuple[int, int]] = {}
+    duplicates = 0
+    bad_lines = 0
+    for shard, path in enumerate(shard_paths):
+        offset = 0
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    obj = json.loads(line)
+                    key = (obj["sample_id"], obj["item_id"])
+                except (ValueError, KeyError, TypeError):
+                    bad_lines += 1
+                else:
+                    if key in index:
+                        duplicates += 1
+                    else:
+                        index[key] = (shard, offset)
+                offset += len(line)
+
+    directory = os.path.dirname(output_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    files = [open(path, "rb") for path in shard_paths]
+    try:
+        with open(output_path, "wb") as out:
+            for key in sorted(index, key=lambda k: (_sort_key(k[0]), _sort_key(k[1]))):
+                shard, offset = index[key]
+                files[shard].seek(offset)
+                line = files[shard].readline()
+                out.write(line if line.endswith(b"\n") else line + b"\n")
+    finally:
+        for f in files:
+            f.close()
+    return {"records": len(index), "duplicates": duplicates, "bad_lines": bad_lines}
+
+
+def main() -> None:
+    from .synthesis import default_config
+
+    cfg = default_config()
+    parser = argparse.ArgumentParser(description="Inspect a lease queue or merge worker output shards.")
+    parser.add_argument("command", choices=["status", "merge"])
+    parser.add_argument("--lease-db", type=str, default=cfg.lease_db, help="Lease database (status).")
+    parser.add_argument("--shards", type=str, default=shard_path(cfg.output_file, "*"), help="Shard glob (merge).")
+    parser.add_argument("--output", type=str, default=cfg.output_file, help="Merged JSONL (merge).")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        if not args.lease_db:
+            parser.error("--lease-db is required")
+        queue = LeaseQueue(args.lease_db, worker_id="status", max_attempts=cfg.lease_max_attempts)
+        try:
+            print(f"Samples: {queue.stats()}, in flight: {queue.in_flight()}")
+        finally:
+            queue.close()
+        return
+
+    shards = sorted(p for p in glob.glob(args.shards) if os.path.abspath(p) != os.path.abspath(args.output))
+    if not shards:
+        parser.error(f"no shards match {args.shards}")
+    print(f"Merging {len(shards)} shards: {merge_shards(shards, args.output)}")
+    print(f"[Done] merged output written to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import threading
+from collections import defaultdict
+from typing import Dict, Mapping, Optional, Tuple
+
+from .config import ModelPrice
+from .utils import accumulate_token_usage, empty_token_usage
+
+
+class UsageLedger:
+    """
+    Run-wide token usage and cost per (stage, model), fed by every API response, including
+    attempts that were retried afterwards. Cost uses the per-model price table (models without a
+    price cost 0). Once max_tokens or max_cost is reached the ledger is exhausted and callers stop
+    scheduling new work; requests already in flight still complete and are recorded.
+    The budget covers this run only: usage of items finished in earlier runs is not counted.
+    """
+
+    def __init__(
+        self,
+        prices: Optional[Mapping[str, ModelPrice]] = None,
+        max_tokens: Optional[int] = None,
+        max_cost: Optional[float] = None,
+    ) -> None:
+        self.prices = dict(prices or {})
+        self.max_tokens = max_tokens
+        self.max_cost = max_cost
+        self.usage: Dict[Tuple[str, str], Dict[str, int]] = defaultdict(empty_token_usage)
+        self.costs: Dict[Tuple[str, str], float] = defaultdict(float)
+        self.total_tokens = 0
+        self.total_cost = 0.0
+        self._lock = threading.Lock()
+
+    def cost(self, model_id: str, usage: Mapping[str, int]) -> float:
+        price = self.prices.get(model_id)
+        if price is None:
+            return 0.0
+        cached = usage.get("cached_tokens", 0)
+        cached_rate = price.input_per_1m if price.cached_input_per_1m is None else price.cached_input_per_1m
+        return (
+            (usage.get("prompt_tokens", 0) - cached) * price.input_per_1m
+            + cached * cached_rate
+            + usage.get("completion_tokens", 0) * price.output_per_1m
+        ) / 1_000_000
+
+    def record(self, stage: str, model_id: str, usage: Mapping[str, int]) -> None:
+        cost = self.cost(model_id, usage)
+        with self._lock:
+            accumulate_token_usage(self.usage[(stage, model_id)], usage)
+            self.costs[(stage, model_id)] += cost
+            self.total_tokens += usage.get("total_tokens", 0)
+            self.total_cost += cost
+
+    @property
+    def exhausted(self) -> bool:
+        if self.max_tokens is not None and self.total_tokens >= self.max_tokens:
+            return True
+        return self.max_cost is not None and self.total_cost >= self.max_cost
+
+    def summary(self) -> Dict[str, Dict[str, object]]:
+        """Usage and cost per "stage/model", most expensive (then most tokens) first."""
+        with self._lock:
+            keys = sorted(self.usage, key=lambda k: (self.costs[k], self.usage[k]["total_tokens"]), reverse=True)
+            return {
+                f"{stage}/{model_id}": {**self.usage[(stage, model_id)], "cost": round(self.costs[(stage, model_id)], 6)}
+                for stage, model_id in keys
+            }
@@ -0,0 +1,177 @@
+import asyncio
+import time
+from typing import Dict, Optional
+
+import openai
+
+
+def is_overload_error(err: BaseException) -> bool:
+    """429s, 5xx responses and timeouts: signs the endpoint is saturated."""
+    if isinstance(err, (openai.RateLimitError, openai.APITimeoutError, asyncio.TimeoutError)):
+        return True
+    if isinstance(err, openai.APIStatusError):
+        return err.status_code >= 500
+    return False
+
+
+class AdaptiveLimiter:
+    """
+    AIMD limit on in-flight LLM requests.
+    The window grows by about one request per window's worth of healthy completions
+    (latency at or below latency_target_s, if set) and is multiplied by `decrease` on
+    overload errors, at most once per typical request latency so a burst of 429s counts once.
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        decrease: float = 0.5,
+        latency_target_s: Optional[float] = None,
+    ) -> None:
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease = decrease
+        self.latency_target_s = latency_target_s
+        self.limit = float(min(max(initial, min_limit), max_limit))
+        self.in_flight = 0
+        self.increases = 0
+        self.decreases = 0
+        self._latency_ewma: Optional[float] = None
+        self._last_decrease = 0.0
+        self._released = asyncio.Event()
+
+    @property
+    def window(self) -> int:
+        return int(self.limit)
+
+    async def acquire(self) -> None:
+        while self.in_flight >= self.window:
+            self._released.clear()
+            await self._released.wait()
+        self.in_flight += 1
+
+    def release(self, latency_s: float, error: Optional[BaseException] = None) -> None:
+        """
+        Return a slot. Successes grow the window, overload errors shrink it,
+        other errors (e.g. 400s) leave it unchanged.
+        """
+        self.in_flight -= 1
+        if error is None:
+            self._on_success(latency_s)
+        elif is_overload_error(error):
+            self._on_overload()
+        self._released.set()
+
+    def _on_success(self, latency_s: float) -> None:
+        if self._latency_ewma is None:
+            self._latency_ewma = latency_s
+        else:
+            self._latency_ewma = 0.8 * self._latency_ewma + 0.2 * latency_s
+
+        if self.latency_target_s is not None and latency_s > self.latency_target_s:
+            return
+        if self.limit < self.max_limit:
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self.increases += 1
+
+    def _on_overload(self) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < (self._latency_ewma or 0.0):
+            return
+        self._last_decrease = now
+        self.limit = max(float(self.min_limit), self.limit * self.decrease)
+        self.decreases += 1
+
+    def stats(self) -> dict:
+        return {
+            "window": self.window,
+            "in_flight": self.in_flight,
+            "increases": self.increases,
+            "decreases": self.decreases,
+        }
+
+
+class TokenBucket:
+    """
+    Refills at rate_per_s up to capacity. take() waits in FIFO order until enough is available;
+    adjust() settles the difference once the real cost is known and may leave the bucket in debt.
+    """
+
+    def __init__(self, rate_per_s: float, capacity: float) -> None:
+        self.rate_per_s = rate_per_s
+        self.capacity = capacity
+        self.level = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate_per_s)
+        self._updated = now
+
+    async def take(self, amount: float) -> None:
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self.level < amount:
+                await asyncio.sleep((amount - self.level) / self.rate_per_s)
+                self._refill()
+            self.level -= amount
+
+    def adjust(self, delta: float) -> None:
+        """Positive delta refunds, negative delta charges extra."""
+        self._refill()
+        self.level = min(self.capacity, self.level + delta)
+
+    def available(self) -> float:
+        """The current level (negative while in debt)."""
+        self._refill()
+        return self.level
+
+
+class RateLimiter:
+    """
+    Client-side requests-per-minute and tokens-per-minute limits for one model.
+    Each call reserves one request and an estimated token count up front;
+    reconcile() corrects the token bucket with the usage the API reports.
+    """
+
+    def __init__(
+        self,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        burst_s: float = 10.0,
+    ) -> None:
+        self.requests = TokenBucket(rpm / 60.0, max(1.0, rpm / 60.0 * burst_s)) if rpm else None
+        self.tokens = TokenBucket(tpm / 60.0, tpm / 60.0 * burst_s) if tpm else None
+        self.estimated_tokens = 0
+        self.actual_tokens = 0
+
+    async def acquire(self, estimated_tokens: int) -> None:
+        if self.requests is not None:
+            await self.requests.take(1)
+        if self.tokens is not None:
+            await self.tokens.take(estimated_tokens)
+
+    def refund(self, estimated_tokens: int) -> None:
+        """Return a reservation whose request was never sent."""
+        if self.requests is not None:
+            self.requests.adjust(1)
+        if self.tokens is not None:
+            self.tokens.adjust(estimated_tokens)
+
+    def reconcile(self, estimated_tokens: int, actual_tokens: int) -> None:
+        self.estimated_tokens += estimated_tokens
+        self.actual_tokens += actual_tokens
+        if self.tokens is not None and actual_tokens:
+            self.tokens.adjust(estimated_tokens - actual_tokens)
+
+    def levels(self) -> Dict[str, float]:
+        """Current level of each configured bucket ("requests", "tokens")."""
+        buckets = {"requests": self.requests, "tokens": self.tokens}
+        return {name: bucket.available() for name, bucket in buckets.items() if bucket is not None}
+
+    def stats(self) -> dict:
+        return {"estimated_tokens": self.estimated_tokens, "actual_tokens": self.actual_tokens}
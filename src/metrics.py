@@ -0,0 +1,215 @@
+import asyncio
+import bisect
+import json
+import os
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+Labels = Tuple[Tuple[str, str], ...]
+
+LATENCY_BUCKETS_S = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+# Finer buckets (+25% each, 0.1 s to about 30 min) for whole-item latency quantiles
+ITEM_BUCKETS_S = tuple(round(0.1 * 1.25 ** i, 3) for i in range(45))
+
+HELP = {
+    "llm_request_seconds": "Latency of single API attempts.",
+    "llm_requests_total": "API attempts by outcome (ok or error kind).",
+    "llm_requests_in_flight": "API attempts currently waiting for a response.",
+    "llm_concurrency_window": "Adaptive (AIMD) limit on in-flight API attempts.",
+    "rate_limit_available": "Requests or tokens currently available in a model's RPM/TPM bucket.",
+    "llm_retries_total": "Retried attempts by error kind.",
+    "llm_failures_total": "Calls that gave up after their last retry, by error kind.",
+    "llm_tokens_total": "Tokens reported by the API (prompt, completion, cached).",
+    "llm_cache_hits_total": "Calls answered from the local response cache.",
+    "stage_seconds": "Latency of a stage call including retries and waits for limiters.",
+    "stage_calls_total": "Stage calls by outcome.",
+    "item_seconds": "Latency of an item from its first stage to its record being queued for writing.",
+    "samples_total": "Finished samples by outcome.",
+}
+
+
+def _labels(labels: Optional[Dict[str, str]]) -> Labels:
+    return tuple(sorted((labels or {}).items()))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels, extra: Sequence[Tuple[str, str]] = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS_S) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot: above the largest bucket
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Estimate of the q-quantile, interpolated linearly within its bucket like Prometheus'
+        histogram_quantile (None when empty; the largest bound if it falls above the last bucket).
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, self.counts):
+            if count and seen + count >= rank:
+                return round(lower + (bound - lower) * (rank - seen) / count, 4)
+            seen += count
+            lower = bound
+        return self.buckets[-1]
+
+
+class Metrics:
+    """
+    In-process counters, gauges and latency histograms keyed by metric name and labels (stage,
+    endpoint, kind, ...). Updated from the event loop only; exported as Prometheus text or a JSON snapshot.
+    Collectors are called before every export to set gauges read from other components (limiters).
+    """
+
+    def __init__(self) -> None:
+        self.started = time.time()
+        self.counters: Dict[str, Dict[Labels, float]] = defaultdict(lambda: defaultdict(float))
+        self.gauges: Dict[str, Dict[Labels, float]] = defaultdict(lambda: defaultdict(float))
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = defaultdict(dict)
+        self.collectors: List[Callable[["Metrics"], None]] = []
+
+    def inc(self, name: str, labels: Optional[Dict[str, str]] = None, value: float = 1.0) -> None:
+        self.counters[name][_labels(labels)] += value
+
+    def add_gauge(self, name: str, labels: Optional[Dict[str, str]] = None, value: float = 1.0) -> None:
+        self.gauges[name][_labels(labels)] += value
+
+    def set_gauge(self, name: str, labels: Optional[Dict[str, str]], value: float) -> None:
+        self.gauges[name][_labels(labels)] = value
+
+    def add_collector(self, collect: Callable[["Metrics"], None]) -> None:
+        self.collectors.append(collect)
+
+    def _collect(self) -> None:
+        for collect in self.collectors:
+            collect(self)
+
+    def observe(
+        self,
+        name: str,
+        labels: Optional[Dict[str, str]],
+        value: float,
+        buckets: Sequence[float] = LATENCY_BUCKETS_S,
+    ) -> None:
+        key = _labels(labels)
+        histogram = self.histograms[name].get(key)
+        if histogram is None:
+            histogram = self.histograms[name][key] = Histogram(buckets)
+        histogram.observe(value)
+
+    def render_prometheus(self) -> str:
+        self._collect()
+        lines: List[str] = []
+        for kind, metrics in (("counter", self.counters), ("gauge", self.gauges)):
+            for name, series in sorted(metrics.items()):
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        for name, series in sorted(self.histograms.items()):
+            lines.append(f"# HELP {name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in sorted(series.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', f'{bound:g}')])} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram.count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum:g}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, Any]:
+        """JSON-friendly view: totals, per-second rates over the run, histogram count/mean/p50/p90/p99."""
+        self._collect()
+        uptime = max(time.time() - self.started, 1e-9)
+
+        def series_name(labels: Labels) -> str:
+            return ",".join(f"{k}={v}" for k, v in labels) or "all"
+
+        return {
+            "time": time.time(),
+            "uptime_s": round(uptime, 3),
+            "counters": {
+                name: {series_name(l): {"total": v, "per_s": round(v / uptime, 4)} for l, v in sorted(series.items())}
+                for name, series in sorted(self.counters.items())
+            },
+            "gauges": {
+                name: {series_name(l): v for l, v in sorted(series.items())}
+                for name, series in sorted(self.gauges.items())
+            },
+            "histograms": {
+                name: {
+                    series_name(l): {
+                        "count": h.count,
+                        "mean": round(h.sum / h.count, 4) if h.count else None,
+                        "p50": h.quantile(0.5),
+                        "p90": h.quantile(0.9),
+                        "p99": h.quantile(0.99),
+                    }
+                    for l, h in sorted(series.items())
+                }
+                for name, series in sorted(self.histograms.items())
+            },
+        }
+
+
+def write_json_atomic(path: str, obj: Dict[str, Any]) -> None:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False, indent=2, default=str)
+    os.replace(tmp, path)
+
+
+async def write_metrics_periodically(metrics: Metrics, path: str, interval_s: float) -> None:
+    while True:
+        await asyncio.sleep(interval_s)
+        await asyncio.to_thread(write_json_atomic, path, metrics.snapshot())
+
+
+async def serve_metrics(metrics: Metrics, host: str, port: int) -> asyncio.AbstractServer:
+    """A minimal HTTP server answering GET /metrics with the Prometheus text format."""
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request = (await reader.readline()).decode("latin-1").split()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            if len(request) >= 2 and request[0] == "GET" and request[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", metrics.render_prometheus().encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
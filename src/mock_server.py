@@ -0,0 +1,202 @@
+# mock_server.py
+# A local OpenAI-compatible endpoint for benchmarks and offline runs. Answers POST .../chat/completions
+# for every stage's system prompt with JSON that satisfies schemas.STAGE_SCHEMAS, after a
+# log-normally distributed latency, and injects 5xx errors, 429s and malformed JSON at the given rates.
+#
+#   python -m src.mock_server --port 8000 --latency-median-s 0.8 --rate-limit-rate 0.02
+#   # then point base_url at http://127.0.0.1:8000/v1 (any API key)
+#
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Set, Tuple
+
+from .prompts import *
+from .schemas import sample_stage_result
+from .stages import (
+    EVALUATE_REASON,
+    GT_INSIGHT_PATH,
+    INCORRECT_PATH,
+    INSIGHT_REASON,
+    INTENT_TREE,
+    REVISE,
+    UTTERANCE_CATEGORY_GT,
+    UTTERANCE_CATEGORY_REASON,
+)
+from .utils import estimate_tokens
+
+SYSTEM_PROMPT_STAGES: Dict[str, str] = {
+    INITIAL_EXTRACTION_SYS_PROMPT: INTENT_TREE,
+    INCREMENTAL_EXTRACTION_SYS_PROMPT: INTENT_TREE,
+    Utterance_Classification_Sys_Prompt: UTTERANCE_CATEGORY_REASON,
+    Utterance_Classification_GT_Sys_Prompt: UTTERANCE_CATEGORY_GT,
+    Insight_Sys_Prompt: INSIGHT_REASON,
+    Evaluate_Sys_Prompt: EVALUATE_REASON,
+    GT_Insight_Path_Sys_Prompt: GT_INSIGHT_PATH,
+    Mining_Revise_Sys_Prompt: REVISE,  # NEGATIVE_REVISE uses the same prompts and schema
+    Explore_Revise_Sys_Prompt: REVISE,
+    Incorrect_Path_Sys_Prompt: INCORRECT_PATH,
+    Incorrect_Path_With_Reference_Sys_Prompt: INCORRECT_PATH,
+}
+
+
+@dataclass(frozen=True)
+class MockBehavior:
+    latency_median_s: float = 0.5
+    latency_sigma: float = 0.5  # of the log-normal latency; 0 for a fixed latency
+    error_rate: float = 0.0  # share of requests answered with HTTP 500
+    rate_limit_rate: float = 0.0  # share answered with HTTP 429 (with retry-after)
+    malformed_rate: float = 0.0  # share of completions with broken JSON (half of them locally repairable)
+    retry_after_s: float = 1.0
+
+
+class MockServer:
+    """asyncio HTTP/1.1 server (with keep-alive) speaking enough of the chat completions API for the pipeline."""
+
+    def __init__(self, behavior: MockBehavior, seed: Optional[int] = None) -> None:
+        self.behavior = behavior
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.counts: Dict[str, int] = {}
+        self._seen_prefixes: Set[str] = set()
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def _count(self, outcome: str) -> None:
+        self.counts[outcome] = self.counts.get(outcome, 0) + 1
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    return
+                headers: Dict[str, str] = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", "0")))
+                method, path = request_line.decode("latin-1").split()[:2]
+                status, extra, payload = await self._respond(method, path, body)
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                head = [f"HTTP/1.1 {status}", "Content-Type: application/json", f"Content-Length: {len(data)}"]
+                head += [f"{k}: {v}" for k, v in extra.items()]
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + data)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            # Server shutdown with a keep-alive connection still open: a normal close
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, method: str, path: str, body: bytes) -> Tuple[str, Dict[str, str], Any]:
+        if method != "POST" or not path.split("?")[0].endswith("/chat/completions"):
+            return "404 Not Found", {}, {"error": {"message": f"no route for {method} {path}"}}
+        request = json.loads(body)
+        self.requests += 1
+        b = self.behavior
+        latency = b.latency_median_s * (math.exp(self.rng.gauss(0.0, b.latency_sigma)) if b.latency_sigma else 1.0)
+        await asyncio.sleep(latency)
+
+        roll = self.rng.random()
+        if roll < b.rate_limit_rate:
+            self._count("rate_limited")
+            error = {"error": {"message": "Rate limit reached (mock)", "type": "rate_limit_error"}}
+            return "429 Too Many Requests", {"retry-after": f"{b.retry_after_s:g}"}, error
+        if roll < b.rate_limit_rate + b.error_rate:
+            self._count("error")
+            return "500 Internal Server Error", {}, {"error": {"message": "Internal error (mock)", "type": "server_error"}}
+
+        messages = request.get("messages", [])
+        system = next((m["content"] for m in messages if m.get("role") == "system"), "")
+        content = json.dumps(sample_stage_result(SYSTEM_PROMPT_STAGES.get(system), self.rng), ensure_ascii=False)
+        if self.rng.random() < b.malformed_rate:
+            self._count("malformed")
+            content = f"```json\n{content}\n```" if self.rng.random() < 0.5 else content[: len(content) // 2]
+        else:
+            self._count("ok")
+
+        prompt_tokens = sum(estimate_tokens(m.get("content") or "") for m in messages)
+        # Rough provider prefix cache: a system prompt seen before counts as cached.
+        cached_tokens = estimate_tokens(system) if system in self._seen_prefixes else 0
+        self._seen_prefixes.add(system)
+        completion_tokens = estimate_tokens(content)
+        return "200 OK", {}, {
+            "id": f"mock-{self.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": cached_tokens},
+            },
+        }
+
+
+def add_behavior_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency-median-s", type=float, default=MockBehavior.latency_median_s)
+    parser.add_argument("--latency-sigma", type=float, default=MockBehavior.latency_sigma)
+    parser.add_argument("--error-rate", type=float, default=MockBehavior.error_rate)
+    parser.add_argument("--rate-limit-rate", type=float, default=MockBehavior.rate_limit_rate)
+    parser.add_argument("--malformed-rate", type=float, default=MockBehavior.malformed_rate)
+    parser.add_argument("--retry-after-s", type=float, default=MockBehavior.retry_after_s)
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def behavior_from_args(args: argparse.Namespace) -> MockBehavior:
+    return MockBehavior(
+        latency_median_s=args.latency_median_s,
+        latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        malformed_rate=args.malformed_rate,
+        retry_after_s=args.retry_after_s,
+    )
+
+
+async def serve(behavior: MockBehavior, host: str, port: int, seed: Optional[int]) -> None:
+    server = MockServer(behavior, seed=seed)
+    port = await server.start(host, port)
+    print(f"[Mock] serving http://{host}:{port}/v1 with {behavior}", flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+        print(f"[Mock] {server.requests} requests: {server.counts}", flush=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible chat completions endpoint.")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    add_behavior_args(parser)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(behavior_from_args(args), args.host, args.port, args.seed))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import time
+from dataclasses import dataclass
+from typing import Any, Collection, Dict, List, Optional
+
+import openai
+from openai import AsyncOpenAI
+
+from .limiter import is_overload_error
+
+
+def is_endpoint_error(err: BaseException) -> bool:
+    """Errors that say something about the endpoint (not the request): connection, timeout, 429, 5xx."""
+    return isinstance(err, openai.APIConnectionError) or is_overload_error(err)
+
+
+@dataclass
+class PooledEndpoint:
+    name: str
+    client: AsyncOpenAI
+    weight: float = 1.0
+    model_id: Optional[str] = None
+    outstanding: int = 0
+    consecutive_failures: int = 0
+    ejected_until: float = 0.0
+    requests: int = 0
+    errors: int = 0
+    ejections: int = 0
+
+
+class ClientPool:
+    """
+    Spreads requests over several OpenAI-compatible endpoints serving the same model.
+    Picks the healthy endpoint with the fewest outstanding requests per unit of weight;
+    an endpoint that fails max_failures times in a row is ejected for eject_s seconds
+    (passive health check). If every endpoint is ejected, the one due back first is used.
+    """
+
+    def __init__(self, endpoints: List[PooledEndpoint], max_failures: int = 3, eject_s: float = 30.0) -> None:
+        if not endpoints:
+            raise ValueError("ClientPool needs at least one endpoint")
+        self.endpoints = endpoints
+        self.max_failures = max_failures
+        self.eject_s = eject_s
+
+    def acquire(self, avoid: Collection[str] = ()) -> PooledEndpoint:
+        """Pick an endpoint for one attempt, preferring ones not in `avoid` (failover)."""
+        now = time.monotonic()
+        healthy = [ep for ep in self.endpoints if ep.ejected_until <= now]
+        candidates = [ep for ep in healthy if ep.name not in avoid] or healthy
+        if candidates:
+            endpoint = min(candidates, key=lambda ep: (ep.outstanding + 1) / ep.weight)
+        else:
+            endpoint = min(self.endpoints, key=lambda ep: ep.ejected_until)
+        endpoint.outstanding += 1
+        endpoint.requests += 1
+        return endpoint
+
+    def release(self, endpoint: PooledEndpoint, error: Optional[BaseException] = None) -> None:
+        endpoint.outstanding -= 1
+        if error is None:
+            endpoint.consecutive_failures = 0
+            return
+        if not is_endpoint_error(error):
+            return
+        endpoint.errors += 1
+        endpoint.consecutive_failures += 1
+        if endpoint.consecutive_failures >= self.max_failures:
+            endpoint.ejected_until = time.monotonic() + self.eject_s
+            endpoint.consecutive_failures = 0
+            endpoint.ejections += 1
+            print(f"[Pool] endpoint {endpoint.name} ejected for {self.eject_s:.0f}s")
+
+    async def close(self) -> None:
+        """Close every endpoint's client (and its keep-alive connections)."""
+        for ep in self.endpoints:
+            await ep.client.close()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            ep.name: {"requests": ep.requests, "errors": ep.errors, "ejections": ep.ejections}
+            for ep in self.endpoints
+        }
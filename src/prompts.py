@@ -22,6 +22,34 @@ INITIAL_EXTRACTION_USER_PROMPT = '''user-assistant conversation history:
 {chat_history}
 """'''
 
+INCREMENTAL_EXTRACTION_SYS_PROMPT = '''You are an intent extraction assistant. You are given the [existing intent tree], extracted from a user-assistant conversation so far, and the [new conversation turns] that follow it. Update the intent tree with the intents the user expresses in the new turns, keeping the same nested JSON structure:
+{
+  "Type1": {
+    "Slot1": "Value (concise and brief)",
+    "Slot2": "Value (concise and brief)",
+    ...
+  },
+  "Type2": {
+    ...
+  }
+  ...
+}
+
+- "Type1", "Type2": Represent the intent topics.
+- "Slot1", "Slot2": Represent the attributes under each intent topic.
+- "Value": The value of the attribute, which must be a string. Values must be concise. If too long, shorten or summarize.
+- Add new intent topics and attributes, and update attribute values the user changed. Keep every other topic, attribute and value of the existing intent tree unchanged.
+
+Only output the complete updated JSON that strictly follows this structure. Do NOT add any extra explanations or comments.'''
+
+INCREMENTAL_EXTRACTION_USER_PROMPT = '''existing intent tree:
+{intent_tree}
+
+new conversation turns:
+"""
+{new_turns}
+"""'''
+
 Utterance_Classification_Sys_Prompt = '''Your task is: Based on [user-assistant conversation history] (with particular focus on the context of the last assistant reply), predict which sentence category the user’s next input might belong to.
 ## Sentence Category Definitions
 - Statement: The user expresses an opinion, feeling, fact, explanation, or feedback, in a calm tone, usually without a question or command nature.
@@ -439,4 +467,8 @@ Finally, I need to infer potential inputs that may interest the user based on th
 [Exploration View Analysis]: {exploration_reasoning}
 </think>
 The user’s next input is most likely: 
-{predictions}'''
\ No newline at end of file
+{predictions}'''
+
+Schema_Reask_Prompt = '''
+
+Note: your previous output did not follow the required JSON format ({error}). Output the complete JSON again, strictly following the required format.'''
@@ -0,0 +1,53 @@
+import random
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import Any, Dict, Tuple
+
+from .config import SynthesisConfig
+from .stages import ItemState, item_key
+
+
+class LocalResolver(ABC):
+    """
+    Answers one stage on the CPU instead of calling the LLM.
+    guess() returns a schema-valid result and whether it is confident enough to use. Unconfident
+    guesses defer to the LLM; a deterministic audit_rate share of the confident ones goes to the LLM
+    as well. Whenever both answers exist they are compared, so the agreement rate says when the
+    local answer can be trusted.
+    """
+
+    stage: str = ""
+
+    def __init__(self, audit_rate: float = 0.0) -> None:
+        self.audit_rate = audit_rate
+        self.counts: Dict[str, int] = defaultdict(int)
+        self.compared: Dict[bool, int] = defaultdict(int)  # by confident
+        self.agreed: Dict[bool, int] = defaultdict(int)
+
+    @abstractmethod
+    def guess(self, cfg: SynthesisConfig, state: ItemState) -> Tuple[Any, bool]:
+        """(local result, confident) for one item."""
+
+    @abstractmethod
+    def agrees(self, cfg: SynthesisConfig, local: Any, llm: Any) -> bool:
+        """Whether the local and the LLM result agree (counted by compare)."""
+
+    def audited(self, state: ItemState) -> bool:
+        return random.Random(f"{item_key(state.item)}:{self.stage}:audit").random() < self.audit_rate
+
+    def compare(self, cfg: SynthesisConfig, local: Any, confident: bool, llm: Any) -> None:
+        self.compared[confident] += 1
+        self.agreed[confident] += self.agrees(cfg, local, llm)
+
+    def summary(self) -> Dict[str, Any]:
+        def rate(confident: bool) -> Any:
+            n = self.compared[confident]
+            return round(self.agreed[confident] / n, 4) if n else None
+
+        return {
+            **self.counts,
+            "agreement_confident": rate(True),
+            "agreement_deferred": rate(False),
+            "compared_confident": self.compared[True],
+            "compared_deferred": self.compared[False],
+        }
@@ -0,0 +1,119 @@
+import asyncio
+import email.utils
+import random
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import openai
+
+from .schemas import SchemaError
+
+NON_RETRYABLE = "non_retryable"
+RATE_LIMITED = "rate_limited"
+TRANSIENT = "transient"
+PARSE = "parse"
+SCHEMA = "schema"
+
+
+def classify_error(err: BaseException) -> str:
+    """
+    Sort a failed attempt into one of NON_RETRYABLE (bad request, auth, context too long),
+    RATE_LIMITED (429), TRANSIENT (network, timeout, 408/409/5xx, anything unknown)
+    PARSE (the completion was not valid JSON) or SCHEMA (valid JSON of the wrong shape).
+    """
+    if isinstance(err, SchemaError):
+        return SCHEMA
+    if isinstance(err, openai.RateLimitError):
+        return RATE_LIMITED
+    if isinstance(err, (openai.APIConnectionError, asyncio.TimeoutError)):
+        return TRANSIENT
+    if isinstance(err, openai.APIStatusError):
+        if err.status_code == 429:
+            return RATE_LIMITED
+        if err.status_code in (408, 409) or err.status_code >= 500:
+            return TRANSIENT
+        return NON_RETRYABLE
+    if isinstance(err, ValueError):  # json.JSONDecodeError and friends
+        return PARSE
+    return TRANSIENT
+
+
+def retry_after_s(err: BaseException) -> Optional[float]:
+    """Server hint from retry-after-ms / retry-after (seconds or HTTP date), if any."""
+    response = getattr(err, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(0.0, float(value) / 1000.0)
+        except ValueError:
+            pass
+
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    How chat_once_json retries a failed attempt.
+    Transient, parse and schema failures share max_attempts; rate-limited attempts have their own,
+    larger allowance. Backoff is capped exponential with jitter; a Retry-After hint from the
+    server (up to max_retry_after_s) replaces it. Parse and schema failures are retried without waiting.
+    """
+    max_attempts: int = 3
+    max_rate_limited_attempts: int = 8
+    base_delay_s: float = 1.0
+    max_delay_s: float = 30.0
+    jitter: float = 0.5
+    max_retry_after_s: float = 120.0
+
+    def should_retry(self, kind: str, attempts: int, rate_limited_attempts: int) -> bool:
+        if kind == NON_RETRYABLE:
+            return False
+        if kind == RATE_LIMITED:
+            return rate_limited_attempts < self.max_rate_limited_attempts
+        return attempts < self.max_attempts
+
+    def delay_s(self, kind: str, retry_index: int, err: BaseException) -> float:
+        if kind in (PARSE, SCHEMA):
+            return 0.0
+        hint = retry_after_s(err)
+        if hint is not None:
+            return min(hint, self.max_retry_after_s)
+        delay = min(self.max_delay_s, self.base_delay_s * (2 ** retry_index))
+        return delay * (1.0 - self.jitter + self.jitter * random.random())
+
+
+class RetryStats:
+    """Retry and give-up counts per (stage, error kind)."""
+
+    def __init__(self) -> None:
+        self.retries: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.failures: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    def record_retry(self, stage: str, kind: str) -> None:
+        self.retries[stage][kind] += 1
+
+    def record_failure(self, stage: str, kind: str) -> None:
+        self.failures[stage][kind] += 1
+
+    def summary(self) -> Dict[str, Dict[str, Dict[str, int]]]:
+        return {
+            "retries": {stage: dict(kinds) for stage, kinds in self.retries.items()},
+            "failures": {stage: dict(kinds) for stage, kinds in self.failures.items()},
+        }
@@ -0,0 +1,55 @@
+from collections import defaultdict
+from typing import Any, Callable, Dict, Optional
+
+from .config import SynthesisConfig
+from .stages import EVALUATE_REASON
+from .utils import top_similarity
+
+ACCEPTED = "accepted"
+FAILED = "failed"
+LOW_CONFIDENCE = "low_confidence"
+
+
+def stage_model(cfg: SynthesisConfig, stage: str) -> str:
+    """The model that answers `stage` (or that a cascade escalates to)."""
+    return cfg.stage_models.get(stage, cfg.model_id)
+
+
+def cascade_model(cfg: SynthesisConfig, stage: str) -> Optional[str]:
+    """The smaller model tried first for `stage`, if the stage is cascaded."""
+    model_id = cfg.cascade_models.get(stage)
+    return None if model_id == stage_model(cfg, stage) else model_id
+
+
+def _evaluate_confident(cfg: SynthesisConfig, result: Any) -> bool:
+    """top_sim decides the step 7 branches; an answer within cascade_margin of a threshold is a coin flip."""
+    top_sim = top_similarity(result)
+    return all(
+        abs(top_sim - threshold) >= cfg.cascade_margin
+        for threshold in (cfg.high_confidence_threshold, cfg.low_confidence_threshold)
+    )
+
+
+# Stage name -> whether a (valid) cascade answer is confident enough to keep.
+# Stages without an entry escalate on failure only.
+CONFIDENCE_CHECKS: Dict[str, Callable[[SynthesisConfig, Any], bool]] = {
+    EVALUATE_REASON: _evaluate_confident,
+}
+
+
+def is_confident(cfg: SynthesisConfig, stage: str, result: Any) -> bool:
+    check = CONFIDENCE_CHECKS.get(stage)
+    return check is None or check(cfg, result)
+
+
+class CascadeStats:
+    """Per stage: cascade answers kept, and escalations because the small model failed or was unsure."""
+
+    def __init__(self) -> None:
+        self.counts: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    def record(self, stage: str, outcome: str) -> None:
+        self.counts[stage][outcome] += 1
+
+    def summary(self) -> Dict[str, Dict[str, int]]:
+        return {stage: dict(outcomes) for stage, outcomes in self.counts.items()}
@@ -0,0 +1,266 @@
+import asyncio
+import dataclasses
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Union
+
+from openai import AsyncOpenAI
+
+from .cache import ResponseCache
+from .classifier import build_category_resolver
+from .client import TokenUsage, build_client, build_client_pool, chat_once_json
+from .config import SynthesisConfig
+from .io_utils import JsonlWriter
+from .json_repair import RepairStats
+from .lease import LeaseQueue, SampleCompletion
+from .ledger import UsageLedger
+from .limiter import AdaptiveLimiter, RateLimiter
+from .metrics import Metrics, serve_metrics, write_json_atomic, write_metrics_periodically
+from .pool import ClientPool
+from .resolvers import LocalResolver
+from .retry import RetryPolicy, RetryStats
+from .routing import ACCEPTED, FAILED, LOW_CONFIDENCE, CascadeStats, cascade_model, is_confident, stage_model
+from .schemas import stage_validator
+from .similarity import build_similarity_resolver
+from .stages import ItemState, Prompt
+from .tracing import Tracer, trace_async, trace_sync
+from .utils import accumulate_token_usage, empty_token_usage
+
+
+@dataclass
+class Runtime:
+    """
+    Per-run state shared by every item: the config, the API client and
+    the services each LLM call goes through.
+    """
+    cfg: SynthesisConfig
+    client: Union[AsyncOpenAI, ClientPool]
+    writer: JsonlWriter
+    retry_policy: RetryPolicy = field(default_factory=RetryPolicy)
+    retry_stats: RetryStats = field(default_factory=RetryStats)
+    repair_stats: RepairStats = field(default_factory=RepairStats)
+    cache: Optional[ResponseCache] = None
+    limiter: Optional[AdaptiveLimiter] = None
+    request_slots: Optional[asyncio.Semaphore] = None
+    rate_limiters: Dict[str, RateLimiter] = field(default_factory=dict)
+    ledger: UsageLedger = field(default_factory=UsageLedger)
+    leases: Optional[LeaseQueue] = None
+    completion: Optional[SampleCompletion] = None
+    metrics: Metrics = field(default_factory=Metrics)
+    tracer: Optional[Tracer] = None
+    model_clients: Dict[str, Union[AsyncOpenAI, ClientPool]] = field(default_factory=dict)
+    cascade_stats: CascadeStats = field(default_factory=CascadeStats)
+    resolvers: Dict[str, LocalResolver] = field(default_factory=dict)
+    failed_samples: int = 0
+    _exporters: List[asyncio.Future] = field(default_factory=list, init=False)
+    _metrics_server: Optional[asyncio.AbstractServer] = field(default=None, init=False)
+
+    async def start(self) -> None:
+        """Start the output writer, the configured metrics exporters and the tracer."""
+        if self.tracer is not None:
+            self.tracer.start()
+        self.writer.start()
+        if self.cfg.metrics_port is not None:
+            self._metrics_server = await serve_metrics(self.metrics, self.cfg.metrics_host, self.cfg.metrics_port)
+            print(f"[Metrics] serving http://{self.cfg.metrics_host}:{self.cfg.metrics_port}/metrics")
+        if self.cfg.metrics_file:
+            self._exporters.append(asyncio.ensure_future(
+                write_metrics_periodically(self.metrics, self.cfg.metrics_file, self.cfg.metrics_interval_s)
+            ))
+
+    def collect_limiter_gauges(self, metrics: Metrics) -> None:
+        """The adaptive limiter's window and the RPM/TPM bucket levels, refreshed before every metrics export."""
+        if self.limiter is not None:
+            metrics.set_gauge("llm_concurrency_window", None, self.limiter.window)
+        for model_id, rate_limiter in self.rate_limiters.items():
+            for bucket, level in rate_limiter.levels().items():
+                metrics.set_gauge("rate_limit_available", {"model": model_id, "bucket": bucket}, round(level, 3))
+
+    def client_for(self, model_id: str) -> Union[AsyncOpenAI, ClientPool]:
+        return self.model_clients.get(model_id, self.client)
+
+    async def answer(self, stage: str, state: ItemState, prompt: Prompt, usage_all: TokenUsage) -> Any:
+        """
+        The result for `stage` of one item: from the stage's local resolver when it is confident
+        (and not audited), otherwise from the LLM, compared with the local guess.
+        The usage of its calls is added to usage_all and their count kept in state.calls.
+        """
+        stage_usage = empty_token_usage()
+        try:
+            return await self._answer(stage, state, prompt, stage_usage)
+        finally:
+            state.calls[stage] = stage_usage.get("calls", 0)
+            accumulate_token_usage(usage_all, stage_usage)
+
+    async def _answer(self, stage: str, state: ItemState, prompt: Prompt, usage_all: TokenUsage) -> Any:
+        resolver = self.resolvers.get(stage)
+        if resolver is None:
+            return await self.chat(stage, prompt[0], prompt[1], usage_all)
+        with trace_sync(self.tracer, "local_resolve", "cpu", stage=stage):
+            local, confident = resolver.guess(self.cfg, state)
+        outcome = "deferred"
+        if confident:
+            outcome = "audited" if resolver.audited(state) else "local"
+        resolver.counts[outcome] += 1
+        self.metrics.inc("local_answers_total", {"stage": stage, "outcome": outcome})
+        if outcome == "local":
+            return local
+        parsed = await self.chat(stage, prompt[0], prompt[1], usage_all)
+        resolver.compare(self.cfg, local, confident, parsed)
+        return parsed
+
+    async def chat(self, stage: str, system_prompt: str, user_content: str, usage_all: TokenUsage) -> Any:
+        """
+        The parsed answer for `stage` from its routed model; adds the usage of every call to usage_all.
+        A cascaded stage is first asked of its smaller model and escalated when that answer fails or is unsure.
+        """
+        small_model = cascade_model(self.cfg, stage)
+        if small_model is not None:
+            try:
+                parsed = await self._chat_model(
+                    stage, small_model, system_prompt, user_content, usage_all,
+                    retry_policy=dataclasses.replace(self.retry_policy, max_attempts=self.cfg.cascade_max_attempts),
+                )
+                outcome = ACCEPTED if is_confident(self.cfg, stage, parsed) else LOW_CONFIDENCE
+            except Exception:
+                outcome = FAILED
+            self.cascade_stats.record(stage, outcome)
+            self.metrics.inc("cascade_total", {"stage": stage, "outcome": outcome})
+            if outcome == ACCEPTED:
+                return parsed
+        return await self._chat_model(stage, stage_model(self.cfg, stage), system_prompt, user_content, usage_all)
+
+    async def _chat_model(
+        self,
+        stage: str,
+        model_id: str,
+        system_prompt: str,
+        user_content: str,
+        usage_all: TokenUsage,
+        retry_policy: Optional[RetryPolicy] = None,
+    ) -> Any:
+        """One chat_once_json call for `stage` to model_id with this run's services."""
+        started = time.monotonic()
+        outcome = "error"
+        span = trace_async(
+            self.tracer, stage, "stage", track=stage, model=model_id, prompt_chars=len(system_prompt) + len(user_content)
+        )
+        try:
+            with span:
+                parsed, usage_item = await chat_once_json(
+                    client=self.client_for(model_id),
+                    model_id=model_id,
+                    system_prompt=system_prompt,
+                    user_content=user_content,
+                    retry_policy=retry_policy or self.retry_policy,
+                    retry_stats=self.retry_stats,
+                    stage=stage,
+                    repair_stats=self.repair_stats,
+                    validate=stage_validator(stage) if self.cfg.validate_schemas else None,
+                    reask_with_error=self.cfg.schema_reask_with_error,
+                    cache=self.cache,
+                    limiter=self.limiter,
+                    request_slots=self.request_slots,
+                    rate_limiter=self.rate_limiters.get(model_id),
+                    expected_completion_tokens=self.cfg.expected_completion_tokens,
+                    ledger=self.ledger,
+                    metrics=self.metrics,
+                    tracer=self.tracer,
+                )
+            outcome = "ok"
+        finally:
+            labels = {"stage": stage, "model": model_id}
+            self.metrics.observe("stage_seconds", labels, time.monotonic() - started)
+            self.metrics.inc("stage_calls_total", {**labels, "outcome": outcome})
+        accumulate_token_usage(usage_all, usage_item)
+        return parsed
+
+    async def aclose(self) -> None:
+        await self.writer.close()
+        for client in [self.client, *self.model_clients.values()]:
+            await client.close()
+        if self.cache is not None:
+            self.cache.close()
+        for task in self._exporters:
+            task.cancel()
+        await asyncio.gather(*self._exporters, return_exceptions=True)
+        if self._metrics_server is not None:
+            self._metrics_server.close()
+            await self._metrics_server.wait_closed()
+        if self.cfg.metrics_file:
+            write_json_atomic(self.cfg.metrics_file, self.metrics.snapshot())
+        if self.tracer is not None:
+            await self.tracer.close()
+
+
+def build_runtime(cfg: SynthesisConfig) -> Runtime:
+    if cfg.endpoints:
+        client = build_client_pool(cfg.endpoints, max_failures=cfg.endpoint_max_failures, eject_s=cfg.endpoint_eject_s)
+    else:
+        client = build_client(cfg.base_url, cfg.api_key_env)
+    model_clients = {
+        model_id: build_client_pool(endpoints, max_failures=cfg.endpoint_max_failures, eject_s=cfg.endpoint_eject_s)
+        for model_id, endpoints in cfg.model_endpoints.items()
+    }
+    cache = None
+    if cfg.cache_path:
+        cache = ResponseCache(cfg.cache_path, max_age_s=cfg.cache_max_age_s, max_bytes=cfg.cache_max_bytes)
+    limiter = None
+    if cfg.adaptive_concurrency:
+        limiter = AdaptiveLimiter(
+            cfg.max_concurrency,
+            min_limit=cfg.adaptive_min_concurrency,
+            max_limit=cfg.adaptive_max_concurrency,
+            latency_target_s=cfg.adaptive_latency_target_s,
+        )
+    rate_limiters = {
+        model_id: RateLimiter(limit.rpm, limit.tpm, burst_s=cfg.rate_limit_burst_s)
+        for model_id, limit in cfg.rate_limits.items()
+    }
+    retry_policy = RetryPolicy(
+        max_attempts=cfg.retry_max_attempts,
+        max_rate_limited_attempts=cfg.retry_max_rate_limited_attempts,
+        base_delay_s=cfg.retry_base_delay_s,
+        max_delay_s=cfg.retry_max_delay_s,
+        max_retry_after_s=cfg.retry_max_retry_after_s,
+    )
+    resolvers: Dict[str, LocalResolver] = {}
+    if cfg.local_classifier:
+        resolver = build_category_resolver(cfg)
+        resolvers[resolver.stage] = resolver
+    if cfg.local_similarity:
+        resolver = build_similarity_resolver(cfg)
+        resolvers[resolver.stage] = resolver
+    ledger = UsageLedger(cfg.model_prices, max_tokens=cfg.budget_tokens, max_cost=cfg.budget_cost)
+    tracer = Tracer(cfg.trace_file, loop_lag_interval_s=cfg.trace_loop_lag_interval_s) if cfg.trace_file else None
+    leases = None
+    completion = None
+    if cfg.lease_db:
+        leases = LeaseQueue(cfg.lease_db, cfg.worker_id, lease_s=cfg.lease_s, max_attempts=cfg.lease_max_attempts)
+        completion = SampleCompletion(leases)
+    writer = JsonlWriter(
+        cfg.output_file,
+        batch_size=cfg.write_batch_size,
+        flush_interval_s=cfg.write_flush_interval_s,
+        fsync=cfg.write_fsync,
+        # A sample only counts as done once the records of all its items are on disk
+        on_written=completion.written if completion else None,
+        tracer=tracer,
+    )
+    rt = Runtime(
+        cfg=cfg,
+        client=client,
+        model_clients=model_clients,
+        resolvers=resolvers,
+        writer=writer,
+        retry_policy=retry_policy,
+        cache=cache,
+        limiter=limiter,
+        rate_limiters=rate_limiters,
+        ledger=ledger,
+        leases=leases,
+        completion=completion,
+        tracer=tracer,
+    )
+    rt.metrics.add_collector(rt.collect_limiter_gauges)
+    return rt
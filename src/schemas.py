@@ -0,0 +1,163 @@
+"""
+Declarative schemas for the JSON each stage must return.
+
+A schema is a small dict:
+  "type":       "object" | "array" | "string" | "number"
+  "properties": {key: schema} - every listed key is required (objects)
+  "items":      schema for every element, "min_items": minimum length (arrays)
+  "includes":   {key: [values]} - each value must appear under `key` in some element (arrays)
+  "enum":       allowed values; "minimum" / "maximum" bound numbers
+
+sample_stage_result() draws a random result that satisfies a stage's schema (for the mock server
+and the dry-run estimator's placeholder results).
+"""
+import random
+from typing import Any, Callable, Dict, Optional
+
+from .stages import (
+    EVALUATE_REASON,
+    GT_INSIGHT_PATH,
+    INCORRECT_PATH,
+    INSIGHT_REASON,
+    INTENT_TREE,
+    NEGATIVE_REVISE,
+    REVISE,
+    UTTERANCE_CATEGORY_GT,
+    UTTERANCE_CATEGORY_REASON,
+)
+
+
+class SchemaError(ValueError):
+    """A parsed response that does not match its stage schema."""
+
+
+CATEGORIES = ["Statement", "Question", "Instruction"]
+
+_STRING = {"type": "string"}
+_STRINGS = {"type": "array", "min_items": 1, "items": _STRING}
+_VIEW = {"type": "object", "properties": {"reasoning": _STRING, "predictions": _STRINGS}}
+_PATHS = {
+    "type": "array",
+    "min_items": 1,
+    "items": {"type": "object", "properties": {"source_node": _STRING, "target_node": _STRING}},
+}
+_REVISION = {"type": "object", "properties": {"revised": _STRING, "predictions": _STRINGS}}
+
+STAGE_SCHEMAS: Dict[str, Dict[str, Any]] = {
+    INTENT_TREE: {"type": "object"},
+    UTTERANCE_CATEGORY_REASON: {
+        "type": "array",
+        "items": {"type": "object", "properties": {"category": {"enum": CATEGORIES}, "reasoning": _STRING}},
+        "includes": {"category": CATEGORIES},
+    },
+    UTTERANCE_CATEGORY_GT: {
+        "type": "object",
+        "properties": {"reasoning": _STRING, "predicted_category": {"enum": CATEGORIES}},
+    },
+    INSIGHT_REASON: {"type": "object", "properties": {"mining_view": _VIEW, "explore_view": _VIEW}},
+    EVALUATE_REASON: {
+        "type": "array",
+        "min_items": 1,
+        "items": {"type": "object", "properties": {"similarity": {"type": "number", "minimum": 0.0, "maximum": 1.0}}},
+    },
+    GT_INSIGHT_PATH: {
+        "type": "object",
+        "properties": {"insight": {"enum": ["Mining", "Exploration"]}, "path": _PATHS},
+    },
+    REVISE: _REVISION,
+    INCORRECT_PATH: {"type": "object", "properties": {"path": _PATHS}},
+    NEGATIVE_REVISE: _REVISION,
+}
+
+_TYPE_CHECKS: Dict[str, Callable[[Any], bool]] = {
+    "object": lambda v: isinstance(v, dict),
+    "array": lambda v: isinstance(v, list),
+    "string": lambda v: isinstance(v, str),
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+}
+
+
+def validate(value: Any, schema: Dict[str, Any], path: str = "$") -> Optional[str]:
+    """Return a description of the first violation, or None if value matches schema."""
+    expected = schema.get("type")
+    if expected is not None and not _TYPE_CHECKS[expected](value):
+        return f"{path}: expected {expected}, got {type(value).__name__}"
+    if "enum" in schema and value not in schema["enum"]:
+        return f"{path}: expected one of {schema['enum']}, got {value!r}"
+    if "minimum" in schema and value < schema["minimum"]:
+        return f"{path}: {value} is below {schema['minimum']}"
+    if "maximum" in schema and value > schema["maximum"]:
+        return f"{path}: {value} is above {schema['maximum']}"
+
+    for key, sub in schema.get("properties", {}).items():
+        if key not in value:
+            return f"{path}: missing key {key!r}"
+        err = validate(value[key], sub, f"{path}.{key}")
+        if err:
+            return err
+
+    if "min_items" in schema and len(value) < schema["min_items"]:
+        return f"{path}: expected at least {schema['min_items']} items, got {len(value)}"
+    if "items" in schema:
+        for i, element in enumerate(value):
+            err = validate(element, schema["items"], f"{path}[{i}]")
+            if err:
+                return err
+    for key, values in schema.get("includes", {}).items():
+        present = {element.get(key) for element in value if isinstance(element, dict)}
+        missing = [v for v in values if v not in present]
+        if missing:
+            return f"{path}: no element with {key} in {missing}"
+    return None
+
+
+def stage_validator(stage: str) -> Optional[Callable[[Any], None]]:
+    """A callable raising SchemaError when a parsed response for `stage` is invalid."""
+    schema = STAGE_SCHEMAS.get(stage)
+    if schema is None:
+        return None
+
+    def check(value: Any) -> None:
+        err = validate(value, schema)
+        if err:
+            raise SchemaError(f"{stage}: {err}")
+
+    return check
+
+
+_WORDS = "user intent topic attribute value request detail context answer follow up code example style".split()
+
+
+def _text(rng: random.Random, words: int = 8) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(words))
+
+
+def sample_value(schema: Dict[str, Any], rng: random.Random) -> Any:
+    """A random value that satisfies a mini-schema."""
+    if "enum" in schema:
+        return rng.choice(schema["enum"])
+    kind = schema.get("type")
+    if kind == "object":
+        if "properties" not in schema:  # free-form (the intent tree)
+            return {"Intent_Topic1": {"Slot1": _text(rng, 3), "Slot2": _text(rng, 3)}}
+        return {key: sample_value(sub, rng) for key, sub in schema["properties"].items()}
+    if kind == "array":
+        includes = schema.get("includes", {})
+        n = max(schema.get("min_items", 0), 2, *(len(v) for v in includes.values()))
+        items = [sample_value(schema.get("items", {"type": "string"}), rng) for _ in range(n)]
+        for key, values in includes.items():
+            for element, value in zip(items, values):
+                element[key] = value
+        return items
+    if kind == "number":
+        low, high = schema.get("minimum", 0.0), schema.get("maximum", 1.0)
+        return round(rng.uniform(low, high), 2)
+    return _text(rng)
+
+
+def sample_stage_result(stage: Optional[str], rng: random.Random) -> Any:
+    """A random schema-valid result for `stage` (a generic object for an unknown stage)."""
+    schema = STAGE_SCHEMAS.get(stage) if stage else None
+    if schema is None:
+        return {"answer": _text(rng)}
+    return sample_value(schema, rng)
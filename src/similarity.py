@@ -0,0 +1,334 @@
+# similarity.py
+# Local prefilter for the evaluate_reason stage.
+#
+# evaluate_reason mostly exists to produce top_sim, which only picks one of three step 7 branches.
+# NgramScorer scores each prediction against item["label"] with a cosine over hashed character
+# n-gram TF-IDF vectors, computed for whole batches of pairs at once in NumPy. A calibration fitted on
+# stored evaluate_reason answers maps the cosine to the LLM's similarity scale and sets two cutoffs:
+# items whose best score is at or above `upper` (LLM top_sim >= high_confidence_threshold with the target
+# precision) or at or below `lower` (LLM top_sim < low_confidence_threshold) skip the LLM; the rest still go to it.
+#
+#   python -m src.similarity calibrate --records data/synthesized_raw/LMSYS.jsonl --output data/similarity.npz
+#   python -m src.similarity bench --records data/synthesized_raw/LMSYS.jsonl [--calibration data/similarity.npz]
+#
+
+import argparse
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .config import SynthesisConfig
+from .io_utils import iter_jsonl
+from .resolvers import LocalResolver
+from .stages import EVALUATE_REASON, INSIGHT_REASON, ItemState
+from .utils import in_holdout, top_similarity
+
+# Marks answers given by the prefilter, so they are never used to calibrate it
+LOCAL_REASON_PREFIX = "[local similarity]"
+
+DEFAULT_DIM = 1 << 18
+NGRAM_RANGE = (2, 4)
+# Uncalibrated cutoffs on the raw cosine: only near-copies and no overlap at all skip the LLM
+DEFAULT_UPPER = 0.9
+DEFAULT_LOWER = 0.02
+
+_PRIME = np.uint64(1_000_003)
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+Vector = Tuple[np.ndarray, np.ndarray]  # (sorted feature ids, L2-normalized weights)
+
+
+def ngram_ids(text: str, dim: int = DEFAULT_DIM, ngram_range: Tuple[int, int] = NGRAM_RANGE) -> np.ndarray:
+    """Hashed ids of the character n-grams of the lowercased, space-padded, whitespace-collapsed text."""
+    normalized = " " + " ".join(text.lower().split()) + " "
+    codes = np.frombuffer(normalized.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    hashes = []
+    for n in range(ngram_range[0], ngram_range[1] + 1):
+        m = len(codes) - n + 1
+        if m <= 0:
+            continue
+        h = np.full(m, n, dtype=np.uint64)
+        for k in range(n):
+            h = h * _PRIME + codes[k:k + m]  # wraps modulo 2**64
+        hashes.append(h)
+    if not hashes:
+        return np.empty(0, dtype=np.int64)
+    h = np.concatenate(hashes)
+    h = (h ^ (h >> np.uint64(31))) * _MIX
+    return (h % np.uint64(dim)).astype(np.int64)
+
+
+@dataclass
+class Calibration:
+    """Cosine -> LLM similarity mapping (monotone, piecewise linear) and the two skip cutoffs."""
+    xs: np.ndarray
+    ys: np.ndarray
+    upper: float = DEFAULT_UPPER
+    lower: float = DEFAULT_LOWER
+
+    @classmethod
+    def identity(cls) -> "Calibration":
+        return cls(np.array([0.0, 1.0]), np.array([0.0, 1.0]))
+
+    def similarity(self, scores: np.ndarray) -> np.ndarray:
+        return np.clip(np.interp(scores, self.xs, self.ys), 0.0, 1.0)
+
+
+class NgramScorer:
+    """Character n-gram TF-IDF cosine; idf of ones (plain sublinear TF) until fitted."""
+
+    def __init__(self, idf: Optional[np.ndarray] = None, dim: int = DEFAULT_DIM) -> None:
+        self.dim = dim
+        self.idf = idf
+
+    def fit_idf(self, texts: Sequence[str]) -> None:
+        df = np.zeros(self.dim, dtype=np.float64)
+        for text in texts:
+            df[np.unique(ngram_ids(text, self.dim))] += 1
+        self.idf = (np.log((1 + len(texts)) / (1 + df)) + 1).astype(np.float32)
+
+    def vectorize(self, text: str) -> Vector:
+        ids, counts = np.unique(ngram_ids(text, self.dim), return_counts=True)
+        weights = 1.0 + np.log(counts)
+        if self.idf is not None:
+            weights = weights * self.idf[ids]
+        norm = np.linalg.norm(weights)
+        return ids, (weights / norm if norm else weights)
+
+    def cosine_pairs(self, queries: Sequence[str], candidates: Sequence[str]) -> np.ndarray:
+        """Cosine of queries[i] and candidates[i] for every i, as one batched sparse dot product."""
+        vectors: Dict[str, Vector] = {}
+        for text in (*queries, *candidates):
+            if text not in vectors:
+                vectors[text] = self.vectorize(text)
+
+        def stack(texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+            keys = [row * self.dim + vectors[t][0] for row, t in enumerate(texts)]
+            weights = [vectors[t][1] for t in texts]
+            return np.concatenate(keys), np.concatenate(weights)
+
+        q_keys, q_weights = stack(queries)
+        c_keys, c_weights = stack(candidates)
+        common, qi, ci = np.intersect1d(q_keys, c_keys, assume_unique=True, return_indices=True)
+        return np.bincount(common // self.dim, weights=q_weights[qi] * c_weights[ci], minlength=len(queries))
+
+
+def save_calibration(path: str, scorer: NgramScorer, calibration: Calibration) -> None:
+    np.savez_compressed(
+        path,
+        idf=scorer.idf,
+        xs=calibration.xs,
+        ys=calibration.ys,
+        cutoffs=np.array([calibration.upper, calibration.lower]),
+    )
+
+
+def load_calibration(path: str) -> Tuple[NgramScorer, Calibration]:
+    data = np.load(path)
+    upper, lower = data["cutoffs"]
+    return NgramScorer(data["idf"], dim=len(data["idf"])), Calibration(data["xs"], data["ys"], float(upper), float(lower))
+
+
+def predictions_of(insight_reason: Dict[str, Any]) -> List[str]:
+    return [str(p) for p in insight_reason["mining_view"]["predictions"] + insight_reason["explore_view"]["predictions"]]
+
+
+def branch(cfg: SynthesisConfig, top_sim: float) -> str:
+    if top_sim >= cfg.high_confidence_threshold:
+        return "high"
+    if top_sim < cfg.low_confidence_threshold:
+        return "low"
+    return "mid"
+
+
+def local_evaluation(
+    cfg: SynthesisConfig,
+    predictions: Sequence[str],
+    scores: np.ndarray,
+    calibration: Calibration,
+    decision: str,
+) -> List[Dict[str, Any]]:
+    """An evaluate_reason-shaped result whose top similarity lies in the decided branch."""
+    similarity = calibration.similarity(scores)
+    if decision == "high":
+        top = int(np.argmax(scores))
+        similarity[top] = max(similarity[top], cfg.high_confidence_threshold)
+    elif decision == "low":
+        similarity = np.minimum(similarity, cfg.low_confidence_threshold - 0.05)
+    return [
+        {"input": p, "reason": f"{LOCAL_REASON_PREFIX} cosine {s:.3f}", "similarity": round(float(v), 2)}
+        for p, s, v in zip(predictions, scores, similarity)
+    ]
+
+
+class SimilarityResolver(LocalResolver):
+    """Answers evaluate_reason locally when the best local score is past a calibrated cutoff."""
+
+    stage = EVALUATE_REASON
+
+    def __init__(self, scorer: NgramScorer, calibration: Calibration, audit_rate: float = 0.0) -> None:
+        super().__init__(audit_rate)
+        self.scorer = scorer
+        self.calibration = calibration
+
+    def guess(self, cfg: SynthesisConfig, state: ItemState) -> Tuple[Any, bool]:
+        predictions = predictions_of(state.results[INSIGHT_REASON])
+        label = str(state.item["label"])
+        scores = self.scorer.cosine_pairs([label] * len(predictions), predictions)
+        top = float(scores.max()) if len(scores) else 0.0
+        decision = "high" if top >= self.calibration.upper else "low" if top <= self.calibration.lower else "mid"
+        return local_evaluation(cfg, predictions, scores, self.calibration, decision), decision != "mid"
+
+    def agrees(self, cfg: SynthesisConfig, local: Any, llm: Any) -> bool:
+        return branch(cfg, top_similarity(local)) == branch(cfg, top_similarity(llm))
+
+
+def build_similarity_resolver(cfg: SynthesisConfig) -> SimilarityResolver:
+    if cfg.local_similarity_calibration:
+        scorer, calibration = load_calibration(cfg.local_similarity_calibration)
+    else:
+        scorer, calibration = NgramScorer(), Calibration.identity()
+    return SimilarityResolver(scorer, calibration, audit_rate=cfg.local_audit_rate)
+
+
+# Calibration against stored evaluate_reason answers
+
+@dataclass
+class EvaluatedItem:
+    sample_id: Any
+    label: str
+    predictions: List[str]
+    llm_similarity: List[float]
+
+
+def iter_evaluated(path: str) -> List[EvaluatedItem]:
+    """Items with an LLM evaluate_reason, skipping ones the prefilter answered."""
+    items = []
+    for record in iter_jsonl(path):
+        evaluation = record.get("evaluate_reason") or []
+        if not evaluation or any(str(e.get("reason", "")).startswith(LOCAL_REASON_PREFIX) for e in evaluation):
+            continue
+        predictions = predictions_of(record["insight_reason"])
+        texts = [str(e.get("input") or (predictions[i] if i < len(predictions) else "")) for i, e in enumerate(evaluation)]
+        items.append(EvaluatedItem(record["sample_id"], str(record["label"]), texts, [float(e["similarity"]) for e in evaluation]))
+    return items
+
+
+def score_items(scorer: NgramScorer, items: Sequence[EvaluatedItem]) -> List[np.ndarray]:
+    queries = [item.label for item in items for _ in item.predictions]
+    candidates = [p for item in items for p in item.predictions]
+    scores = scorer.cosine_pairs(queries, candidates) if candidates else np.empty(0)
+    bounds = np.cumsum([0] + [len(item.predictions) for item in items])
+    return [scores[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+def _cutoff(local: np.ndarray, hit: np.ndarray, precision: float, min_support: int, descending: bool) -> Optional[float]:
+    """The loosest cutoff whose side (scores >= it if descending, <= it otherwise) meets the precision."""
+    order = np.argsort(-local if descending else local, kind="stable")
+    cumulative = np.cumsum(hit[order]) / np.arange(1, len(order) + 1)
+    ok = np.nonzero((cumulative >= precision) & (np.arange(1, len(order) + 1) >= min_support))[0]
+    return float(local[order][ok[-1]]) if len(ok) else None
+
+
+def fit_calibration(
+    cfg: SynthesisConfig,
+    scores: Sequence[np.ndarray],
+    items: Sequence[EvaluatedItem],
+    precision: float = 0.95,
+    min_support: int = 20,
+    bins: int = 20,
+) -> Calibration:
+    pair_scores = np.concatenate(scores)
+    pair_llm = np.concatenate([item.llm_similarity for item in items])
+    edges = np.unique(np.quantile(pair_scores, np.linspace(0, 1, bins + 1)))
+    which = np.clip(np.searchsorted(edges, pair_scores, side="right") - 1, 0, max(len(edges) - 2, 0))
+    xs, ys = [], []
+    for b in np.unique(which):
+        xs.append(pair_scores[which == b].mean())
+        ys.append(pair_llm[which == b].mean())
+    calibration = Calibration(np.array(xs), np.maximum.accumulate(np.array(ys)))
+
+    local_top = np.array([s.max() for s in scores])
+    llm_top = np.array([max(item.llm_similarity) for item in items])
+    upper = _cutoff(local_top, llm_top >= cfg.high_confidence_threshold, precision, min_support, descending=True)
+    lower = _cutoff(local_top, llm_top < cfg.low_confidence_threshold, precision, min_support, descending=False)
+    calibration.upper = upper if upper is not None else float("inf")
+    calibration.lower = lower if lower is not None else float("-inf")
+    return calibration
+
+
+def report(cfg: SynthesisConfig, calibration: Calibration, scores: Sequence[np.ndarray], items: Sequence[EvaluatedItem]) -> Dict[str, Any]:
+    """Share of items that would skip the LLM, and how often their branch matches the LLM's."""
+    n = len(items)
+    skipped = agreed = 0
+    for s, item in zip(scores, items):
+        top = float(s.max())
+        decision = "high" if top >= calibration.upper else "low" if top <= calibration.lower else "mid"
+        if decision == "mid":
+            continue
+        skipped += 1
+        agreed += decision == branch(cfg, max(item.llm_similarity))
+    return {
+        "items": n,
+        "upper": calibration.upper,
+        "lower": calibration.lower,
+        "skip_rate": round(skipped / n, 4) if n else 0.0,
+        "branch_agreement": round(agreed / skipped, 4) if skipped else None,
+    }
+
+
+def main() -> None:
+    from .synthesis import default_config
+
+    parser = argparse.ArgumentParser(description="Calibrate or benchmark the local evaluate_reason prefilter.")
+    parser.add_argument("command", choices=["calibrate", "bench"])
+    parser.add_argument("--records", type=str, default="data/synthesized_raw/LMSYS.jsonl", help="Synthesized records.")
+    parser.add_argument("--output", type=str, default="data/similarity.npz", help="Calibration file to write.")
+    parser.add_argument("--calibration", type=str, default=None, help="Calibration to benchmark (None: uncalibrated).")
+    parser.add_argument("--precision", type=float, default=0.95, help="Required branch precision of skipped items.")
+    parser.add_argument("--holdout", type=float, default=0.2, help="Share of samples held out for the report.")
+    parser.add_argument("--repeat", type=int, default=3, help="Timing repetitions for bench.")
+    args = parser.parse_args()
+
+    cfg = default_config()
+    items = iter_evaluated(args.records)
+    if not items:
+        parser.error(f"no LLM evaluate_reason answers in {args.records}")
+
+    if args.command == "calibrate":
+        train = [item for item in items if not in_holdout(item.sample_id, args.holdout)]
+        holdout = [item for item in items if in_holdout(item.sample_id, args.holdout)]
+        scorer = NgramScorer()
+        scorer.fit_idf([item.label for item in train] + [p for item in train for p in item.predictions])
+        calibration = fit_calibration(cfg, score_items(scorer, train), train, precision=args.precision)
+        print(f"Calibrated on {len(train)} items: {report(cfg, calibration, score_items(scorer, train), train)}")
+        if holdout:
+            print(f"Holdout ({len(holdout)} items): {report(cfg, calibration, score_items(scorer, holdout), holdout)}")
+        save_calibration(args.output, scorer, calibration)
+        print(f"[Done] calibration written to: {args.output}")
+        return
+
+    if args.calibration:
+        scorer, calibration = load_calibration(args.calibration)
+    else:
+        scorer, calibration = NgramScorer(), Calibration.identity()
+    pairs = sum(len(item.predictions) for item in items)
+    timings = {}
+    for name, run in (
+        ("batched", lambda: score_items(scorer, items)),
+        ("per_item", lambda: [score_items(scorer, [item]) for item in items]),
+    ):
+        best = float("inf")
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            run()
+            best = min(best, time.perf_counter() - started)
+        timings[name] = best
+        print(f"{name:<9} {pairs} pairs in {best * 1000:.1f} ms ({pairs / best:,.0f} pairs/s, {best / len(items) * 1e6:.0f} us/item)")
+    print(f"Prefilter: {report(cfg, calibration, score_items(scorer, items), items)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,413 @@
+"""
+Stage graph for synthesizing one item.
+
+Each stage renders its (system_prompt, user_content) from the item and the results of the
+stages it depends on, or returns None when the step 7 branch does not need it.
+Randomness is drawn from per-item, per-stage seeded generators so a stage's prompt is the
+same no matter in which order the stages happen to run.
+"""
+import random
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .config import SynthesisConfig
+from .history import compact_history
+from .utils import history_prefixes, top_similarity
+from .prompts import *
+
+
+INTENT_TREE = "intent_tree"
+UTTERANCE_CATEGORY_REASON = "utterance_category_reason"
+UTTERANCE_CATEGORY_GT = "utterance_category_gt"
+INSIGHT_REASON = "insight_reason"
+EVALUATE_REASON = "evaluate_reason"
+GT_INSIGHT_PATH = "gt_insight_path"
+REVISE = "revised_insight_reason"
+INCORRECT_PATH = "incorrect_path"
+NEGATIVE_REVISE = "negative_revise"
+
+Prompt = Tuple[str, str]
+
+
+@dataclass
+class ItemState:
+    """
+    One item plus the results of its finished stages (None marks a skipped stage).
+    chat_history is the full rendered history; compacted renderings are cached in histories by token budget.
+    For an item expanded from an earlier round's item (build_item_states), new_turns is the rendered round
+    added since that item and previous_intent_tree its intent tree, once known.
+    calls counts the billed API responses per finished stage (0 when answered locally or from the cache).
+    """
+    item: Dict[str, Any]
+    chat_history: str
+    results: Dict[str, Any] = field(default_factory=dict)
+    calls: Dict[str, int] = field(default_factory=dict)
+    histories: Dict[int, str] = field(default_factory=dict)
+    new_turns: Optional[str] = None
+    previous_intent_tree: Any = None
+
+
+@dataclass(frozen=True)
+class Stage:
+    name: str
+    deps: Tuple[str, ...]
+    build: Callable[[SynthesisConfig, ItemState], Optional[Prompt]]
+
+
+def stage_rng(state: ItemState, name: str) -> random.Random:
+    return random.Random(f"{state.item['sample_id']}:{state.item['item_id']}:{name}")
+
+
+def stage_history(cfg: SynthesisConfig, state: ItemState, name: str) -> str:
+    """
+    The history to embed in stage `name`'s prompt: the full history, or compacted to the stage's token budget.
+    Stages with the same budget share one rendering (computed once per item), so their prompts keep a common prefix.
+    """
+    budget = cfg.history_stage_max_tokens.get(name, cfg.history_max_tokens)
+    if budget is None:
+        return state.chat_history
+    if budget not in state.histories:
+        state.histories[budget] = compact_history(state.item["context"], budget, cfg.history_keep_last_rounds)
+    return state.histories[budget]
+
+
+def item_top_sim(state: ItemState) -> float:
+    return top_similarity(state.results[EVALUATE_REASON])
+
+
+def item_category(state: ItemState) -> str:
+    return state.results[UTTERANCE_CATEGORY_GT]["predicted_category"]
+
+
+def negative_category_reason(state: ItemState) -> Dict[str, Any]:
+    """The (random) category reasoning used by the rejected side in step 7."""
+    return stage_rng(state, NEGATIVE_REVISE).choice(state.results[UTTERANCE_CATEGORY_REASON])
+
+
+def _revise_prompt(
+    cfg: SynthesisConfig,
+    state: ItemState,
+    name: str,
+    category: str,
+    path: Any,
+) -> Prompt:
+    r = state.results
+    chat_history = stage_history(cfg, state, name)
+    if r[GT_INSIGHT_PATH]["insight"] == "Mining":
+        return Mining_Revise_Sys_Prompt, Mining_Revise_User_Prompt.format(
+            context=chat_history,
+            intent_tree=r[INTENT_TREE],
+            category=category,
+            predict_reasoning=r[INSIGHT_REASON]["mining_view"]["reasoning"],
+            path=path,
+        )
+    return Explore_Revise_Sys_Prompt, Explore_Revise_User_Prompt.format(
+        context=chat_history,
+        intent_tree=r[INTENT_TREE],
+        category=category,
+        predict_reasoning=r[INSIGHT_REASON]["explore_view"]["reasoning"],
+        path=path,
+    )
+
+
+# 1) Intent tree construction
+def build_intent_tree(cfg: SynthesisConfig, state: ItemState) -> Optional[Prompt]:
+    if cfg.incremental_intent_tree and state.previous_intent_tree is not None and state.new_turns:
+        return INCREMENTAL_EXTRACTION_SYS_PROMPT, INCREMENTAL_EXTRACTION_USER_PROMPT.format(
+            intent_tree=state.previous_intent_tree,
+            new_turns=state.new_turns,
+        )
+    return INITIAL_EXTRACTION_SYS_PROMPT, INITIAL_EXTRACTION_USER_PROMPT.format(
+        chat_history=stage_history(cfg, state, INTENT_TREE)
+    )
+
+
+# 2) Utterance category reasoning
+def build_utterance_category_reason(cfg: SynthesisConfig, state: ItemState) -> Optional[Prompt]:
+    return Utterance_Classification_Sys_Prompt, Utterance_Classification_User_Prompt.format(
+        chat_history=stage_history(cfg, state, UTTERANCE_CATEGORY_REASON), ground_truth=state.item["label"]
+    )
+
+
+# 3) Utterance category ground truth (derived from last assistant + user label)
+def build_utterance_category_gt(cfg: SynthesisConfig, state: ItemState) -> Optional[Prompt]:
+    return Utterance_Classification_GT_Sys_Prompt, Utterance_Classification_GT_User_Prompt.format(
+        assistant_message=state.item["context"][-1],
+        user_message=state.item["label"],
+    )
+
+
+# 4) Insight reasoning (mining view + exploration view)
+def build_insight_reason(cfg: SynthesisConfig, state: ItemState) -> Optional[Prompt]:
+    return Insight_Sys_Prompt, Insight_User_Prompt.format(
+        chat_history=stage_history(cfg, state, INSIGHT_REASON),
+        intent_tree=state.results[INTENT_TREE],
+        category=item_category(state),
+    )
+
+
+# 5) Evaluate predictions
+def build_evaluate_reason(cfg: SynthesisConfig, state: ItemState) -> Optional[Prompt]:
+    insight_reason = state.results[INSIGHT_REASON]
+    all_predictions = insight_reason["mining_view"]["predictions"] + insight_reason["explore_view"]["predictions"]
+    if len(all_predictions) != cfg.max_pred_nums:
+        print(f"item id:{state.item['sample_id']}: predictions number error")
+
+    predictions_text = ""
+    for i, v in enumerate(all_predictions):
+        predictions_text += f"Predictive Input {i + 1}: {v}\n"
+
+    return Evaluate_Sys_Prompt, Evaluate_User_Prompt.format(
+        context=stage_history(cfg, state, EVALUATE_REASON),
+        label=state.item["label"],
+        predict_input=predictions_text,
+    )
+
+
+# 6) GT insight and GT path
+def build_gt_insight_path(cfg: SynthesisConfig, state: ItemState) -> Optional[Prompt]:
+    return GT_Insight_Path_Sys_Prompt, GT_Insight_Path_User_Prompt.format(
+        context=stage_history(cfg, state, GT_INSIGHT_PATH),
+        intent_tree=state.results[INTENT_TREE],
+        label=state.item["label"],
+    )
+
+
+# 7a) Chosen side: revise the GT-view reasoning along the (shuffled) GT paths, unless top_sim is high
+def build_revise(cfg: SynthesisConfig, state: ItemState) -> Optional[Prompt]:
+    if item_top_sim(state) >= cfg.high_confidence_threshold:
+        return None
+    revised_path = list(state.results[GT_INSIGHT_PATH]["path"])
+    stage_rng(state, REVISE).shuffle(revised_path)
+    return _revise_prompt(cfg, state, REVISE, item_category(state), revised_path)
+
+
+# 7b) Rejected side: incorrect paths around the GT path, unless top_sim is low
+def build_incorrect_path(cfg: SynthesisConfig, state: ItemState) -> Optional[Prompt]:
+    if item_top_sim(state) < cfg.low_confidence_threshold:
+        return None
+    r = state.results
+    gt_insight_path = r[GT_INSIGHT_PATH]
+    negative_label = state.item["negative_label"]
+    if len(negative_label) != 0:
+        return Incorrect_Path_With_Reference_Sys_Prompt, Incorrect_Path_With_Reference_User_Prompt.format(
+            intent_tree=r[INTENT_TREE],
+            gt_insight=gt_insight_path["insight"],
+            gt_path=gt_insight_path["path"][0],
+            error_user_input=negative_label,
+        )
+    return Incorrect_Path_Sys_Prompt, Incorrect_Path_User_Prompt.format(
+        intent_tree=r[INTENT_TREE],
+        gt_insight=gt_insight_path["insight"],
+        gt_path=gt_insight_path["path"][0],
+    )
+
+
+# 7c) Rejected side: revise the GT-view reasoning along the incorrect paths
+def build_negative_revise(cfg: SynthesisConfig, state: ItemState) -> Optional[Prompt]:
+    incorrect_path = state.results[INCORRECT_PATH]
+    if incorrect_path is None:
+        return None
+    category = negative_category_reason(state)["category"]
+    return _revise_prompt(cfg, state, NEGATIVE_REVISE, category, incorrect_path["path"])
+
+
+STAGES: List[Stage] = [
+    Stage(INTENT_TREE, (), build_intent_tree),
+    Stage(UTTERANCE_CATEGORY_REASON, (), build_utterance_category_reason),
+    Stage(UTTERANCE_CATEGORY_GT, (), build_utterance_category_gt),
+    Stage(INSIGHT_REASON, (INTENT_TREE, UTTERANCE_CATEGORY_GT), build_insight_reason),
+    Stage(EVALUATE_REASON, (INSIGHT_REASON,), build_evaluate_reason),
+    Stage(GT_INSIGHT_PATH, (INTENT_TREE,), build_gt_insight_path),
+    Stage(REVISE, (EVALUATE_REASON, GT_INSIGHT_PATH), build_revise),
+    Stage(INCORRECT_PATH, (EVALUATE_REASON, GT_INSIGHT_PATH), build_incorrect_path),
+    Stage(NEGATIVE_REVISE, (INCORRECT_PATH, UTTERANCE_CATEGORY_REASON), build_negative_revise),
+]
+
+STAGES_BY_NAME: Dict[str, Stage] = {stage.name: stage for stage in STAGES}
+
+
+def item_key(item: Dict[str, Any]) -> str:
+    return f"{item['sample_id']}:{item['item_id']}"
+
+
+def build_item(sample: Dict[str, Any], item_id: int = 0) -> Optional[Dict[str, Any]]:
+    """
+    Convert one LMSYS conversation sample into an item for synthesis
+    (None if it has less than 2 rounds of messages).
+    Item 0 predicts the final user turn; item k predicts the user turn k rounds earlier.
+    """
+    conversation = sample["conversation"]
+    if item_id:
+        conversation = conversation[:len(conversation) - 2 * item_id]
+    rounds = len(conversation) // 2
+    if rounds < 2:
+        return None
+
+    seed = sample["id"] if item_id == 0 else f"{sample['id']}:{item_id}"
+    selected_round = random.Random(seed).randint(0, rounds - 2)
+
+    item: Dict[str, Any] = {
+        "sample_id": sample["id"],
+        "item_id": item_id,
+        "context": conversation[:-2],
+        "label": conversation[-2]["content"],
+        "negative_label": [],
+    }
+
+    # Negative labels are taken from earlier turns, separated by at least one round.
+    if len(conversation) - (selected_round * 2 + 6) >= 0:
+        item["negative_label"].append("Incorrect Input 1: " + str(conversation[selected_round * 2 + 4]["content"]))
+    if len(conversation) - (selected_round * 2 + 8) >= 0:
+        item["negative_label"].append("Incorrect Input 2: " + str(conversation[selected_round * 2 + 6]["content"]))
+
+    return item
+
+
+def item_ids(cfg: SynthesisConfig, sample: Dict[str, Any]) -> List[int]:
+    """
+    The item ids to synthesize from a sample, earliest round first: only 0 (the final round), or with
+    expand_rounds every round whose context has at least expand_min_context_rounds rounds
+    (the latest max_items_per_sample of them).
+    """
+    rounds = len(sample["conversation"]) // 2
+    if not cfg.expand_rounds:
+        return [0] if rounds >= 2 else []
+    last = rounds - 1 - max(cfg.expand_min_context_rounds, 1)
+    ids = list(range(last, -1, -1))
+    if cfg.max_items_per_sample is not None:
+        ids = ids[max(len(ids) - cfg.max_items_per_sample, 0):] if cfg.max_items_per_sample > 0 else []
+    return ids
+
+
+def build_item_states(cfg: SynthesisConfig, sample: Dict[str, Any]) -> List[ItemState]:
+    """
+    The items of a sample (see item_ids) as states, earliest round first. The histories are rendered
+    once for the longest context and shared as prefixes; each item after the first gets the round
+    added since the previous one as new_turns, for an incremental intent tree.
+    """
+    items = [item for item in (build_item(sample, k) for k in item_ids(cfg, sample)) if item is not None]
+    if not items:
+        return []
+    conversation = sample["conversation"]
+    histories = history_prefixes(conversation, [len(item["context"]) for item in items])
+    states = []
+    previous: Optional[str] = None
+    for item in items:
+        chat_history = histories[len(item["context"])]
+        new_turns = None
+        if previous is not None and chat_history.startswith(previous):
+            new_turns = chat_history[len(previous):].lstrip("\n")
+        states.append(ItemState(item=item, chat_history=chat_history, new_turns=new_turns))
+        previous = chat_history
+    return states
+
+
+def resolve_ready_stages(cfg: SynthesisConfig, state: ItemState) -> List[Tuple[Stage, Prompt]]:
+    """
+    Stages whose inputs are all available and which still need an LLM call, with their prompts.
+    Stages the step 7 branch skips are resolved to None in state.results along the way.
+    """
+    ready: List[Tuple[Stage, Prompt]] = []
+    for stage in STAGES:  # topologically ordered
+        if stage.name in state.results:
+            continue
+        if not all(dep in state.results for dep in stage.deps):
+            continue
+        prompt = stage.build(cfg, state)
+        if prompt is None:
+            state.results[stage.name] = None
+        else:
+            ready.append((stage, prompt))
+    return ready
+
+
+def is_complete(state: ItemState) -> bool:
+    return all(stage.name in state.results for stage in STAGES)
+
+
+def normalize_revision(cfg: SynthesisConfig, revised_insight_reason: Dict[str, Any]) -> Dict[str, Any]:
+    """Normalize wording in revised reasoning and only keep half predictions for the revised side."""
+    revised = dict(revised_insight_reason)
+    revised["revised"] = revised["revised"].replace("mining path", "mining view")
+    revised["revised"] = revised["revised"].replace("exploration path", "exploration view")
+    revised["predictions"] = revised["predictions"][: cfg.max_pred_nums // 2]
+    return revised
+
+
+def _apply_revision(
+    insight_reason: Dict[str, Any],
+    insight_gt: str,
+    revised_insight_reason: Dict[str, Any],
+) -> Dict[str, Any]:
+    """Replace the GT view of insight_reason with the revised reasoning and predictions."""
+    result = {
+        "mining_view": insight_reason["mining_view"],
+        "explore_view": insight_reason["explore_view"],
+    }
+    view = "mining_view" if insight_gt == "Mining" else "explore_view"
+    result[view] = {
+        "reasoning": revised_insight_reason["revised"],
+        "predictions": revised_insight_reason["predictions"],
+    }
+    return result
+
+
+def assemble_record(cfg: SynthesisConfig, state: ItemState, usage_all: Dict[str, int]) -> Dict[str, Any]:
+    """
+    Build the synthesized output record (chosen / rejected) once every stage is resolved.
+    """
+    r = state.results
+    intent_tree = r[INTENT_TREE]
+    utterance_category_reason = r[UTTERANCE_CATEGORY_REASON]
+    insight_reason = r[INSIGHT_REASON]
+    insight_gt = r[GT_INSIGHT_PATH]["insight"]
+    category = item_category(state)
+    top_sim = item_top_sim(state)
+
+    new_json = dict(state.item)
+    new_json["chat_history"] = state.chat_history
+    new_json["intent_tree"] = intent_tree
+    new_json["utterance_category_reason"] = utterance_category_reason
+    new_json["utterance_category_gt"] = r[UTTERANCE_CATEGORY_GT]
+    new_json["insight_reason"] = insight_reason
+    new_json["evaluate_reason"] = r[EVALUATE_REASON]
+    new_json["top_sim"] = top_sim
+    new_json["gt_insight_path"] = r[GT_INSIGHT_PATH]
+
+    matched_category_reason = [x for x in utterance_category_reason if x["category"] == category][0]
+
+    if r[REVISE] is None:
+        chosen = {
+            "intent_tree": intent_tree,
+            "utterance_category_reason": matched_category_reason,
+            "insight_reason": insight_reason,
+        }
+    else:
+        revised_insight_reason = normalize_revision(cfg, r[REVISE])
+        new_json["revised_insight_reason"] = revised_insight_reason
+        chosen = {
+            "intent_tree": intent_tree,
+            "utterance_category_reason": matched_category_reason,
+            "insight_reason": _apply_revision(insight_reason, insight_gt, revised_insight_reason),
+        }
+
+    if r[NEGATIVE_REVISE] is None:
+        rejected = {
+            "intent_tree": intent_tree,
+            "utterance_category_reason": matched_category_reason,
+            "insight_reason": insight_reason,
+        }
+    else:
+        rejected = {
+            "incorrect_path": r[INCORRECT_PATH]["path"],
+            "intent_tree": intent_tree,
+            "utterance_category_reason": negative_category_reason(state),
+            "insight_reason": _apply_revision(insight_reason, insight_gt, normalize_revision(cfg, r[NEGATIVE_REVISE])),
+        }
+
+    new_json["usage"] = usage_all
+    new_json["stage_calls"] = dict(state.calls)
+    new_json["chosen"] = chosen
+    new_json["rejected"] = rejected
+    return new_json
@@ -0,0 +1,71 @@
+import json
+import os
+from typing import Any, Dict, Iterator
+
+from .config import SynthesisConfig
+from .io_utils import iter_jsonl, load_completed_keys, repair_jsonl_tail
+from .stages import INTENT_TREE, ItemState, build_item_states, item_key
+from .utils import accumulate_token_usage, empty_token_usage
+
+
+class StageStore:
+    """
+    Append-only JSONL of finished stage results, one line per (item, stage):
+    {"key": "<sample_id>:<item_id>", "stage": ..., "result": ..., "usage": {...}}.
+    Lets runs that execute stages outside process_item (batch files, stage waves)
+    checkpoint every result and pick up where they stopped.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self.usage: Dict[str, Dict[str, int]] = {}
+        self.calls: Dict[str, Dict[str, int]] = {}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        repair_jsonl_tail(path)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        self._apply(json.loads(line))
+        self._file = open(path, "a", encoding="utf-8")
+
+    def _apply(self, entry: Dict[str, Any]) -> None:
+        key = entry["key"]
+        self.results.setdefault(key, {})[entry["stage"]] = entry["result"]
+        self.calls.setdefault(key, {})[entry["stage"]] = entry.get("usage", {}).get("calls", 0)
+        usage = self.usage.setdefault(key, empty_token_usage())
+        accumulate_token_usage(usage, entry.get("usage", {}))
+
+    def record(self, key: str, stage: str, result: Any, usage: Dict[str, int]) -> None:
+        entry = {"key": key, "stage": stage, "result": result, "usage": usage}
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._apply(entry)
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def iter_pending_states(cfg: SynthesisConfig, store: StageStore) -> Iterator[ItemState]:
+    """
+    Items from the input that are not in the output yet, with their stored stage results.
+    An expanded item's intent tree builds on the previous round's if that one is already stored.
+    """
+    completed = load_completed_keys(cfg.output_file)
+    for sample in iter_jsonl(cfg.input_file):
+        for state in build_item_states(cfg, sample):
+            item = state.item
+            if (item["sample_id"], item["item_id"]) in completed:
+                continue
+            state.results = dict(store.results.get(item_key(item), {}))
+            state.calls = dict(store.calls.get(item_key(item), {}))
+            if state.new_turns:
+                previous_key = item_key({"sample_id": item["sample_id"], "item_id": item["item_id"] + 1})
+                state.previous_intent_tree = store.results.get(previous_key, {}).get(INTENT_TREE)
+            yield state
@@ -1,426 +1,291 @@
+import argparse
 import asyncio
-import random
-from typing import Any, Dict, List
+import dataclasses
+import time
+from typing import Any, Dict, Optional, Set, Tuple
 
 from tqdm.asyncio import tqdm_asyncio
 
 from .config import SynthesisConfig
-from .client import build_client, chat_once_json
-from .utils import messages2history_round, accumulate_token_usage, top_similarity
-from .io_utils import read_jsonl, append_jsonl, sum_usage_from_jsonl
-from .prompts import *
-
-
-async def negative_construct_v2(
-    client,
-    cfg: SynthesisConfig,
-    intent_tree: Dict[str, Any],
-    gt_insight: str,
-    gt_path: Any,
-    negative_label: List[str],
-    chat_history: str,
-    utterance_category_reasons: List[Dict[str, Any]],
-    insight_reason_original: Dict[str, Any],
+from .estimate import add_estimate_args, estimate_from_args
+from .lease import LeaseQueue, read_sample_at, worker_config
+from .metrics import ITEM_BUCKETS_S
+from .ledger import UsageLedger
+from .pool import ClientPool
+from .runtime import Runtime, build_runtime
+from .stages import INTENT_TREE, STAGES, ItemState, Stage, assemble_record, build_item_states, item_ids, item_key
+from .tracing import trace_async, trace_sync
+from .utils import cached_token_ratio, empty_token_usage
+from .io_utils import iter_jsonl, count_lines, load_completed_keys, repair_jsonl_tail, sum_usage_from_jsonl
+
+
+async def run_stage_graph(
+    rt: Runtime,
+    state: ItemState,
     usage_all: Dict[str, int],
-) -> Dict[str, Any]:
+    previous_tree: Optional[asyncio.Future] = None,
+    tree: Optional[asyncio.Future] = None,
+) -> None:
     """
-    Construct a rejected sample by creating an incorrect path and revising reasoning.
+    Run the stages of one item as a dependency graph: every stage starts as soon as
+    the stages it depends on have finished, so independent LLM calls overlap.
+    The intent tree stage first waits for previous_tree (the previous round's tree, None if that
+    item failed) to build on, and its result is passed on through tree.
     """
-    if len(negative_label) != 0:
-        incorrect_view_text, usage_item = await chat_once_json(
-            client=client,
-            model_id=cfg.model_id,
-            system_prompt=Incorrect_Path_With_Reference_Sys_Prompt,
-            user_content=Incorrect_Path_With_Reference_User_Prompt.format(
-                intent_tree=intent_tree,
-                gt_insight=gt_insight,
-                gt_path=gt_path,
-                error_user_input=negative_label,
-            ),
-        )
-        accumulate_token_usage(usage_all, usage_item)
-        incorrect_path = incorrect_view_text["path"]
-    else:
-        incorrect_view_text, usage_item = await chat_once_json(
-            client=client,
-            model_id=cfg.model_id,
-            system_prompt=Incorrect_Path_Sys_Prompt,
-            user_content=Incorrect_Path_User_Prompt.format(
-                intent_tree=intent_tree,
-                gt_insight=gt_insight,
-                gt_path=gt_path,
-            ),
-        )
-        accumulate_token_usage(usage_all, usage_item)
-        incorrect_path = incorrect_view_text["path"]
-
-    utterance_category_reason = random.choice(utterance_category_reasons)
-    category = utterance_category_reason["category"]
-
-    if gt_insight == "Mining":
-        revised_insight_reason, usage_item = await chat_once_json(
-            client=client,
-            model_id=cfg.model_id,
-            system_prompt=Mining_Revise_Sys_Prompt,
-            user_content=Mining_Revise_User_Prompt.format(
-                context=chat_history,
-                intent_tree=intent_tree,
-                category=category,
-                predict_reasoning=insight_reason_original["mining_view"]["reasoning"],
-                path=incorrect_path,
-            ),
-        )
-        accumulate_token_usage(usage_all, usage_item)
-    else:
-        revised_insight_reason, usage_item = await chat_once_json(
-            client=client,
-            model_id=cfg.model_id,
-            system_prompt=Explore_Revise_Sys_Prompt,
-            user_content=Explore_Revise_User_Prompt.format(
-                context=chat_history,
-                intent_tree=intent_tree,
-                category=category,
-                predict_reasoning=insight_reason_original["explore_view"]["reasoning"],
-                path=incorrect_path,
-            ),
-        )
-        accumulate_token_usage(usage_all, usage_item)
-
-    # Normalize wording in revised reasoning
-    revised_insight_reason["revised"] = revised_insight_reason["revised"].replace("mining path", "mining view")
-    revised_insight_reason["revised"] = revised_insight_reason["revised"].replace("exploration path", "exploration view")
-
-    # Only keep half predictions for the revised side
-    revised_insight_reason["predictions"] = revised_insight_reason["predictions"][: cfg.max_pred_nums // 2]
-
-    rejected: Dict[str, Any] = {
-        "incorrect_path": incorrect_path,
-        "intent_tree": intent_tree,
-        "utterance_category_reason": utterance_category_reason,
-        "insight_reason": {},
-    }
-
-    if gt_insight == "Mining":
-        rejected["insight_reason"]["mining_view"] = {
-            "reasoning": revised_insight_reason["revised"],
-            "predictions": revised_insight_reason["predictions"],
-        }
-        rejected["insight_reason"]["explore_view"] = insight_reason_original["explore_view"]
-    else:
-        rejected["insight_reason"]["mining_view"] = insight_reason_original["mining_view"]
-        rejected["insight_reason"]["explore_view"] = {
-            "reasoning": revised_insight_reason["revised"],
-            "predictions": revised_insight_reason["predictions"],
-        }
-
-    return rejected
-
-
-async def process_item(client, cfg: SynthesisConfig, item: Dict[str, Any]) -> None:
+    tasks: Dict[str, asyncio.Future] = {}
+
+    async def run_stage(stage: Stage) -> None:
+        if stage.deps:
+            await asyncio.gather(*(tasks[dep] for dep in stage.deps))
+        if stage.name == INTENT_TREE and previous_tree is not None:
+            state.previous_intent_tree = await asyncio.shield(previous_tree)
+        with trace_sync(rt.tracer, "build_prompt", "cpu", stage=stage.name):
+            prompt = stage.build(rt.cfg, state)
+        if prompt is None:
+            state.results[stage.name] = None
+            return
+        state.results[stage.name] = await rt.answer(stage.name, state, prompt, usage_all)
+        if stage.name == INTENT_TREE and tree is not None and not tree.done():
+            tree.set_result(state.results[stage.name])
+
+    for stage in STAGES:
+        tasks[stage.name] = asyncio.ensure_future(run_stage(stage))
+    try:
+        await asyncio.gather(*tasks.values())
+    finally:
+        for task in tasks.values():
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+
+async def process_item(
+    rt: Runtime,
+    state: ItemState,
+    previous_tree: Optional[asyncio.Future] = None,
+    tree: Optional[asyncio.Future] = None,
+) -> None:
     """
     Process one training item and append the synthesized record into output jsonl.
     """
-    usage_all = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
-    chat_history = messages2history_round(item["context"])
-
-    new_json = dict(item)
-    new_json["chat_history"] = chat_history
-
-    # 1) Intent tree construction
-    intent_tree, usage_item = await chat_once_json(
-        client=client,
-        model_id=cfg.model_id,
-        system_prompt=INITIAL_EXTRACTION_SYS_PROMPT,
-        user_content=INITIAL_EXTRACTION_USER_PROMPT.format(chat_history=chat_history),
-    )
-    accumulate_token_usage(usage_all, usage_item)
-    new_json["intent_tree"] = intent_tree
-
-    # 2) Utterance category reasoning
-    utterance_category_reason, usage_item = await chat_once_json(
-        client=client,
-        model_id=cfg.model_id,
-        system_prompt=Utterance_Classification_Sys_Prompt,
-        user_content=Utterance_Classification_User_Prompt.format(
-            chat_history=chat_history, ground_truth=item["label"]
-        ),
-    )
-    accumulate_token_usage(usage_all, usage_item)
-    new_json["utterance_category_reason"] = utterance_category_reason
-
-    # 3) Utterance category ground truth (derived from last assistant + user label)
-    utterance_category, usage_item = await chat_once_json(
-        client=client,
-        model_id=cfg.model_id,
-        system_prompt=Utterance_Classification_GT_Sys_Prompt,
-        user_content=Utterance_Classification_GT_User_Prompt.format(
-            assistant_message=item["context"][-1],
-            user_message=item["label"],
-        ),
-    )
-    accumulate_token_usage(usage_all, usage_item)
-    category = utterance_category["predicted_category"]
-    new_json["utterance_category_gt"] = utterance_category
-
-    # 4) Insight reasoning (mining view + exploration view)
-    insight_reason, usage_item = await chat_once_json(
-        client=client,
-        model_id=cfg.model_id,
-        system_prompt=Insight_Sys_Prompt,
-        user_content=Insight_User_Prompt.format(
-            chat_history=chat_history,
-            intent_tree=intent_tree,
-            category=category,
-        ),
-    )
-    accumulate_token_usage(usage_all, usage_item)
-    new_json["insight_reason"] = insight_reason
-
-    # 5) Evaluate predictions
-    all_predictions = insight_reason["mining_view"]["predictions"] + insight_reason["explore_view"]["predictions"]
-    if len(all_predictions) != cfg.max_pred_nums:
-        print(f"item id:{item['sample_id']}: predictions number error")
-
-    predictions_text = ""
-    for i, v in enumerate(all_predictions):
-        predictions_text += f"Predictive Input {i + 1}: {v}\n"
-
-    evaluate_reason, usage_item = await chat_once_json(
-        client=client,
-        model_id=cfg.model_id,
-        system_prompt=Evaluate_Sys_Prompt,
-        user_content=Evaluate_User_Prompt.format(
-            context=chat_history,
-            label=item["label"],
-            predict_input=predictions_text,
-        ),
-    )
-    accumulate_token_usage(usage_all, usage_item)
-    new_json["evaluate_reason"] = evaluate_reason
-
-    top_sim = top_similarity(evaluate_reason)
-    new_json["top_sim"] = top_sim
-
-    # 6) Get GT insight and GT path
-    gt_insight_path, usage_item = await chat_once_json(
-        client=client,
-        model_id=cfg.model_id,
-        system_prompt=GT_Insight_Path_Sys_Prompt,
-        user_content=GT_Insight_Path_User_Prompt.format(
-            context=chat_history,
-            intent_tree=intent_tree,
-            label=item["label"],
-        ),
-    )
-    accumulate_token_usage(usage_all, usage_item)
-    new_json["gt_insight_path"] = gt_insight_path
-
-    insight_gt = gt_insight_path["insight"]
-    revised_path = gt_insight_path["path"]
-
-    # 7) Build chosen and rejected
-    chosen: Dict[str, Any] = {}
-    rejected: Dict[str, Any] = {}
-
-    if top_sim >= cfg.high_confidence_threshold:
-        chosen = {
-            "intent_tree": intent_tree,
-            "utterance_category_reason": [x for x in utterance_category_reason if x["category"] == category][0],
-            "insight_reason": insight_reason,
-        }
-        rejected = await negative_construct_v2(
-            client, cfg, intent_tree, insight_gt, revised_path[0],
-            item["negative_label"], chat_history, utterance_category_reason,
-            insight_reason, usage_all
-        )
-
-    elif top_sim >= cfg.low_confidence_threshold:
-        gt_path = revised_path[0]
-        random.shuffle(revised_path)
-
-        if insight_gt == "Mining":
-            revised_insight_reason, usage_item = await chat_once_json(
-                client=client,
-                model_id=cfg.model_id,
-                system_prompt=Mining_Revise_Sys_Prompt,
-                user_content=Mining_Revise_User_Prompt.format(
-                    context=chat_history,
-                    intent_tree=intent_tree,
-                    category=category,
-                    predict_reasoning=insight_reason["mining_view"]["reasoning"],
-                    path=revised_path,
-                ),
-            )
-        else:
-            revised_insight_reason, usage_item = await chat_once_json(
-                client=client,
-                model_id=cfg.model_id,
-                system_prompt=Explore_Revise_Sys_Prompt,
-                user_content=Explore_Revise_User_Prompt.format(
-                    context=chat_history,
-                    intent_tree=intent_tree,
-                    category=category,
-                    predict_reasoning=insight_reason["explore_view"]["reasoning"],
-                    path=revised_path,
-                ),
-            )
-        accumulate_token_usage(usage_all, usage_item)
-
-        revised_insight_reason["revised"] = revised_insight_reason["revised"].replace("mining path", "mining view")
-        revised_insight_reason["revised"] = revised_insight_reason["revised"].replace("exploration path", "exploration view")
-        revised_insight_reason["predictions"] = revised_insight_reason["predictions"][: cfg.max_pred_nums // 2]
-        new_json["revised_insight_reason"] = revised_insight_reason
-
-        chosen = {
-            "intent_tree": intent_tree,
-            "utterance_category_reason": [x for x in utterance_category_reason if x["category"] == category][0],
-            "insight_reason": {
-                "mining_view": insight_reason["mining_view"],
-                "explore_view": insight_reason["explore_view"],
-            },
-        }
-        if insight_gt == "Mining":
-            chosen["insight_reason"]["mining_view"] = {
-                "reasoning": revised_insight_reason["revised"],
-                "predictions": revised_insight_reason["predictions"],
-            }
-        else:
-            chosen["insight_reason"]["explore_view"] = {
-                "reasoning": revised_insight_reason["revised"],
-                "predictions": revised_insight_reason["predictions"],
-            }
-
-        rejected = await negative_construct_v2(
-            client, cfg, intent_tree, insight_gt, gt_path,
-            item["negative_label"], chat_history, utterance_category_reason,
-            insight_reason, usage_all
-        )
-
-    else:
-        random.shuffle(revised_path)
-
-        if insight_gt == "Mining":
-            revised_insight_reason, usage_item = await chat_once_json(
-                client=client,
-                model_id=cfg.model_id,
-                system_prompt=Mining_Revise_Sys_Prompt,
-                user_content=Mining_Revise_User_Prompt.format(
-                    context=chat_history,
-                    intent_tree=intent_tree,
-                    category=category,
-                    predict_reasoning=insight_reason["mining_view"]["reasoning"],
-                    path=revised_path,
-                ),
-            )
-        else:
-            revised_insight_reason, usage_item = await chat_once_json(
-                client=client,
-                model_id=cfg.model_id,
-                system_prompt=Explore_Revise_Sys_Prompt,
-                user_content=Explore_Revise_User_Prompt.format(
-                    context=chat_history,
-                    intent_tree=intent_tree,
-                    category=category,
-                    predict_reasoning=insight_reason["explore_view"]["reasoning"],
-                    path=revised_path,
-                ),
-            )
-        accumulate_token_usage(usage_all, usage_item)
-
-        revised_insight_reason["revised"] = revised_insight_reason["revised"].replace("mining path", "mining view")
-        revised_insight_reason["revised"] = revised_insight_reason["revised"].replace("exploration path", "exploration view")
-        revised_insight_reason["predictions"] = revised_insight_reason["predictions"][: cfg.max_pred_nums // 2]
-        new_json["revised_insight_reason"] = revised_insight_reason
-
-        chosen = {
-            "intent_tree": intent_tree,
-            "utterance_category_reason": [x for x in utterance_category_reason if x["category"] == category][0],
-            "insight_reason": {
-                "mining_view": insight_reason["mining_view"],
-                "explore_view": insight_reason["explore_view"],
-            },
-        }
-        if insight_gt == "Mining":
-            chosen["insight_reason"]["mining_view"] = {
-                "reasoning": revised_insight_reason["revised"],
-                "predictions": revised_insight_reason["predictions"],
-            }
-        else:
-            chosen["insight_reason"]["explore_view"] = {
-                "reasoning": revised_insight_reason["revised"],
-                "predictions": revised_insight_reason["predictions"],
-            }
-
-        rejected = {
-            "intent_tree": intent_tree,
-            "utterance_category_reason": [x for x in utterance_category_reason if x["category"] == category][0],
-            "insight_reason": insight_reason,
-        }
-
-    new_json["usage"] = usage_all
-    new_json["chosen"] = chosen
-    new_json["rejected"] = rejected
-
-    append_jsonl(cfg.output_file, new_json)
-
-
-async def process_sample(client, cfg: SynthesisConfig, sample: Dict[str, Any]) -> None:
+    usage_all = empty_token_usage()
+    started = time.monotonic()
+    try:
+        with trace_async(rt.tracer, "item", "item", track=item_key(state.item)) as span:
+            await run_stage_graph(rt, state, usage_all, previous_tree, tree)
+
+            with trace_sync(rt.tracer, "assemble_record", "cpu"):
+                record = assemble_record(rt.cfg, state, usage_all)
+            span["total_tokens"] = usage_all["total_tokens"]
+            await rt.writer.write(record)
+    finally:
+        # The next round then extracts its intent tree from the full history
+        if tree is not None and not tree.done():
+            tree.set_result(None)
+    rt.metrics.observe("item_seconds", None, time.monotonic() - started, buckets=ITEM_BUCKETS_S)
+
+
+async def process_sample(rt: Runtime, sample: Dict[str, Any], completed: Set[Tuple[Any, Any]]) -> None:
     """
-    Convert one LMSYS conversation sample into an item for synthesis.
+    Convert one LMSYS conversation sample into its items (one, or one per round with expand_rounds)
+    and synthesize those not in the output yet. The items run concurrently; each item's intent tree
+    builds on the previous round's as soon as that one is known.
     """
-    conversation = sample["conversation"]
-    rounds = len(conversation) // 2
-    if rounds < 2:
+    with trace_sync(rt.tracer, "render_history", "cpu", messages=len(sample["conversation"])):
+        states = build_item_states(rt.cfg, sample)
+    if not states:
         print(f"Skipping sample {sample['id']} because it has less than 2 rounds of messages")
+        if rt.leases is not None:
+            await asyncio.to_thread(rt.leases.complete, [str(sample["id"])])
         return
-
-    random.seed(sample["id"])
-    selected_round = random.randint(0, rounds - 2)
-
-    item: Dict[str, Any] = {
-        "sample_id": sample["id"],
-        "item_id": 0,
-        "context": conversation[:-2],
-        "label": conversation[-2]["content"],
-        "negative_label": [],
-    }
-
-    # Negative labels are taken from earlier turns, separated by at least one round.
-    if len(conversation) - (selected_round * 2 + 6) >= 0:
-        item["negative_label"].append("Incorrect Input 1: " + str(conversation[selected_round * 2 + 4]["content"]))
-    if len(conversation) - (selected_round * 2 + 8) >= 0:
-        item["negative_label"].append("Incorrect Input 2: " + str(conversation[selected_round * 2 + 6]["content"]))
-
-    await process_item(client, cfg, item)
-
-
-async def process_sample_with_semaphore(sample, semaphore, pbar, client, cfg):
-    async with semaphore:
+    states = [state for state in states if (state.item["sample_id"], state.item["item_id"]) not in completed]
+    if not states:
+        return
+    if rt.completion is not None:
+        rt.completion.expect(str(sample["id"]), len(states))
+
+    loop = asyncio.get_running_loop()
+    tasks = []
+    previous: Optional[Tuple[ItemState, asyncio.Future]] = None
+    for state in states:
+        tree = loop.create_future()
+        previous_tree = None
+        if previous is not None and previous[0].item["item_id"] == state.item["item_id"] + 1:
+            previous_tree = previous[1]
+        tasks.append(asyncio.ensure_future(process_item(rt, state, previous_tree, tree)))
+        previous = (state, tree)
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+
+async def produce_samples(
+    cfg: SynthesisConfig,
+    queue: asyncio.Queue,
+    completed: Set[Tuple[Any, Any]],
+    num_workers: int,
+    ledger: Optional[UsageLedger] = None,
+) -> None:
+    """
+    Stream samples from the input file into the bounded queue, then one stop marker per worker.
+    Stops early once the ledger's budget is exhausted (workers then skip what is still queued).
+    """
+    for sample in iter_jsonl(cfg.input_file):
+        ids = item_ids(cfg, sample)
+        if ids and all((sample["id"], item_id) in completed for item_id in ids):
+            continue
+        if ledger is not None and ledger.exhausted:
+            print(f"[Budget] exhausted, not scheduling further samples (from sample {sample['id']} on)")
+            break
+        await queue.put(sample)
+    for _ in range(num_workers):
+        await queue.put(None)
+
+
+async def produce_leased_samples(
+    cfg: SynthesisConfig,
+    queue: asyncio.Queue,
+    leases: LeaseQueue,
+    num_workers: int,
+    ledger: Optional[UsageLedger] = None,
+) -> None:
+    """
+    Claim samples from the shared lease queue into the bounded queue until none are left to claim
+    and no other worker holds a live lease (whose samples could still come back), then one stop marker per worker.
+    """
+    with open(cfg.input_file, "rb") as f:
+        while True:
+            if ledger is not None and ledger.exhausted:
+                print("[Budget] exhausted, not claiming further samples")
+                break
+            claimed = await asyncio.to_thread(leases.claim, num_workers)
+            if not claimed:
+                if await asyncio.to_thread(leases.in_flight) == 0:
+                    break
+                await asyncio.sleep(cfg.lease_poll_s)
+                continue
+            for _, offset in claimed:
+                await queue.put(read_sample_at(f, offset))
+    for _ in range(num_workers):
+        await queue.put(None)
+
+
+async def heartbeat_leases(cfg: SynthesisConfig, leases: LeaseQueue) -> None:
+    while True:
+        await asyncio.sleep(cfg.lease_heartbeat_s)
+        await asyncio.to_thread(leases.heartbeat)
+
+
+async def sample_worker(rt: Runtime, queue: asyncio.Queue, pbar, completed: Set[Tuple[Any, Any]]) -> None:
+    while True:
+        sample = await queue.get()
+        if sample is None:
+            return
+        if rt.ledger.exhausted:
+            # Over budget: drain the queue, only in-flight samples finish.
+            if rt.leases is not None:
+                await asyncio.to_thread(rt.leases.release, str(sample["id"]))
+            continue
         try:
-            await process_sample(client, cfg, sample)
+            await process_sample(rt, sample, completed)
+            rt.metrics.inc("samples_total", {"outcome": "ok"})
+        except Exception as e:
+            # The failing stage has already used up its retries; keep the run going.
+            rt.failed_samples += 1
+            rt.metrics.inc("samples_total", {"outcome": "failed"})
+            print(f"[Error] sample {sample.get('id')}: {e}")
+            if rt.leases is not None:
+                await asyncio.to_thread(rt.leases.release, str(sample["id"]))
         finally:
+            if rt.limiter is not None:
+                pbar.set_postfix(window=rt.limiter.window, refresh=False)
             pbar.update(1)
 
 
-async def run(cfg: SynthesisConfig) -> None:
-    client = build_client(cfg.base_url, cfg.api_key_env)
-    samples = read_jsonl(cfg.input_file)
-
-    semaphore = asyncio.Semaphore(cfg.max_concurrency)
-    with tqdm_asyncio(total=len(samples), desc="Syn", ncols=100) as pbar:
-        tasks = [
-            process_sample_with_semaphore(sample, semaphore, pbar, client, cfg)
-            for sample in samples
-        ]
-        await asyncio.gather(*tasks)
-
-    usage_all = sum_usage_from_jsonl(cfg.output_file)
+async def run(cfg: SynthesisConfig) -> Runtime:
+    if cfg.lease_db:
+        cfg = worker_config(cfg)
+        print(f"[Lease] worker {cfg.worker_id} writing to {cfg.output_file}")
+    rt = build_runtime(cfg)
+    if rt.limiter is None:
+        # A worker runs the stages of a sample's items concurrently; max_concurrency bounds the requests.
+        rt.request_slots = asyncio.Semaphore(cfg.max_concurrency)
+
+    completed: Set[Tuple[Any, Any]] = set()
+    if rt.leases is not None:
+        # The lease queue tracks what is done; only make sure the shard ends on a clean line.
+        repair_jsonl_tail(cfg.output_file)
+        added = await asyncio.to_thread(rt.leases.seed, cfg.input_file)
+        stats = rt.leases.stats()
+        print(f"[Lease] {added} samples added to {cfg.lease_db}, queue: {stats}")
+        total = stats.get("pending", 0) + stats.get("leased", 0) - stats["exhausted"]
+    else:
+        if cfg.resume:
+            completed = load_completed_keys(cfg.output_file)
+            if completed:
+                print(f"[Resume] {len(completed)} items already in {cfg.output_file}")
+        total = max(count_lines(cfg.input_file) - len({sample_id for sample_id, _ in completed}), 0)
+    await rt.start()
+
+    # A fixed worker pool fed through a bounded queue keeps memory flat regardless of input size.
+    # The request slots (or the adaptive limiter's window), not the worker count, bound concurrency.
+    num_workers = cfg.adaptive_max_concurrency if cfg.adaptive_concurrency else cfg.max_concurrency
+    queue: asyncio.Queue = asyncio.Queue(maxsize=num_workers * 2)
+    with tqdm_asyncio(total=total, desc="Syn", ncols=100) as pbar:
+        if rt.leases is not None:
+            tasks = [asyncio.ensure_future(produce_leased_samples(cfg, queue, rt.leases, num_workers, rt.ledger))]
+            heartbeat = asyncio.ensure_future(heartbeat_leases(cfg, rt.leases))
+        else:
+            tasks = [asyncio.ensure_future(produce_samples(cfg, queue, completed, num_workers, rt.ledger))]
+            heartbeat = None
+        tasks += [asyncio.ensure_future(sample_worker(rt, queue, pbar, completed)) for _ in range(num_workers)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks + ([heartbeat] if heartbeat else []):
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if heartbeat is not None:
+                await asyncio.gather(heartbeat, return_exceptions=True)
+            await rt.aclose()
+
+    print(f"Failed samples: {rt.failed_samples}")
+    if rt.leases is not None:
+        print(f"[Lease] queue: {rt.leases.stats()}")
+        rt.leases.close()
+    print_run_stats(rt)
+    return rt
+
+
+def print_run_stats(rt: Runtime) -> None:
+    print(f"Retries: {rt.retry_stats.summary()}")
+    print(f"Spend this run: {rt.ledger.total_tokens} tokens, cost {rt.ledger.total_cost:.4f}")
+    for key, entry in rt.ledger.summary().items():
+        print(f"  {key}: {entry}")
+    print(f"JSON repairs: {rt.repair_stats.summary()}")
+    if rt.cache is not None:
+        print(f"Cache: {rt.cache.stats()}")
+    if rt.limiter is not None:
+        print(f"Adaptive concurrency: {rt.limiter.stats()}")
+    if isinstance(rt.client, ClientPool):
+        print(f"Endpoints: {rt.client.stats()}")
+    for model_id, client in rt.model_clients.items():
+        print(f"Endpoints [{model_id}]: {client.stats()}")
+    if rt.cfg.cascade_models:
+        print(f"Cascade: {rt.cascade_stats.summary()}")
+    for stage, resolver in rt.resolvers.items():
+        print(f"Local answers [{stage}]: {resolver.summary()}")
+    for model_id, rate_limiter in rt.rate_limiters.items():
+        print(f"Rate limiter [{model_id}]: {rate_limiter.stats()}")
+
+    usage_all = sum_usage_from_jsonl(rt.cfg.output_file)
     print(f"Total usage: {usage_all}")
+    print(f"Prompt cache hit ratio: {cached_token_ratio(usage_all):.1%}")
 
 
-def main():
+def default_config() -> SynthesisConfig:
     # You can replace these defaults with argparse later if needed.
-    cfg = SynthesisConfig(
+    return SynthesisConfig(
         base_url="https://open.bigmodel.cn/api/paas/v4/",
         api_key_env="ZAI_API_KEY",
         model_id="glm-4.6",
@@ -428,6 +293,22 @@ def main():
         output_file=r"data\synthesized_raw\LMSYS.jsonl",
         max_concurrency=10,
     )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthesize preference data from LMSYS conversations.")
+    parser.add_argument("--lease-db", type=str, default=None, help="Shared lease queue; run as one of several workers.")
+    parser.add_argument("--worker-id", type=str, default=None, help="Worker id for the lease queue and output shard.")
+    parser.add_argument("--dry-run", action="store_true", help="Project tokens, cost and duration without calling the API.")
+    add_estimate_args(parser)
+    args = parser.parse_args()
+
+    cfg = default_config()
+    if args.dry_run:
+        estimate_from_args(cfg, args)
+        return
+    if args.lease_db:
+        cfg = dataclasses.replace(cfg, lease_db=args.lease_db, worker_id=args.worker_id)
     asyncio.run(run(cfg))
 
 
@@ -0,0 +1,158 @@
+import asyncio
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# (track id, args of the innermost async span) of the running task; tasks inherit it when created
+_current: contextvars.ContextVar[Optional[Tuple[str, Dict[str, Any]]]] = contextvars.ContextVar(
+    "trace_span", default=None
+)
+
+
+class Tracer:
+    """
+    Opt-in timeline of a run in the Chrome trace event format (chrome://tracing, ui.perfetto.dev).
+
+    - async spans ("b"/"e" events) for items, stage calls and, nested in a stage, each API attempt,
+      limiter wait and retry backoff; every item and stage call gets its own track
+    - sync spans ("X" events) for blocking work on a thread: prompt rendering, JSON parsing,
+      record assembly, output batches
+    - event-loop lag sampled every loop_lag_interval_s: an "event_loop_lag_ms" counter and a
+      "loop blocked" slice wherever the loop was stalled for a whole interval or more
+    Events are kept in memory (at most max_events) and written when the tracer is closed.
+    """
+
+    def __init__(self, path: str, loop_lag_interval_s: float = 0.05, max_events: int = 1_000_000) -> None:
+        self.path = path
+        self.loop_lag_interval_s = loop_lag_interval_s
+        self.max_events = max_events
+        self.events: List[Dict[str, Any]] = []
+        self.dropped = 0
+        self.pid = os.getpid()
+        self._t0 = time.perf_counter()
+        self._tids: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._lag_task: Optional[asyncio.Future] = None
+
+    def _ts(self, t: Optional[float] = None) -> float:
+        return round(((time.perf_counter() if t is None else t) - self._t0) * 1e6, 1)
+
+    def _tid(self, name: Optional[str] = None) -> int:
+        ident = threading.get_ident()
+        tid = self._tids.get(ident)
+        if tid is None:
+            with self._lock:
+                tid = self._tids.setdefault(ident, len(self._tids) + 1)
+            label = name or threading.current_thread().name
+            self._emit({"ph": "M", "name": "thread_name", "pid": self.pid, "tid": tid, "args": {"name": label}})
+        return tid
+
+    def _emit(self, event: Dict[str, Any]) -> None:
+        with self._lock:
+            if len(self.events) >= self.max_events:
+                self.dropped += 1
+                return
+            self.events.append(event)
+
+    @contextmanager
+    def async_span(self, name: str, cat: str, track: Optional[str] = None, **args: Any) -> Iterator[Dict[str, Any]]:
+        """
+        A span in an async track: `track` starts a new one (nested under the current track's name),
+        otherwise the span nests in the current track. Yields the args dict; whatever is added to it
+        (or via annotate()) lands on the end event.
+        """
+        parent = _current.get()
+        if track is None:
+            span_id = parent[0] if parent else name
+        else:
+            span_id = f"{parent[0]}/{track}" if parent else track
+        end_args: Dict[str, Any] = {}
+        base = {"cat": cat, "name": name, "id": span_id, "pid": self.pid, "tid": self._tid()}
+        self._emit({**base, "ph": "b", "ts": self._ts(), "args": args})
+        token = _current.set((span_id, end_args))
+        try:
+            yield end_args
+        except BaseException as e:
+            end_args.setdefault("error", type(e).__name__)
+            raise
+        finally:
+            _current.reset(token)
+            self._emit({**base, "ph": "e", "ts": self._ts(), "args": end_args})
+
+    @contextmanager
+    def sync_span(self, name: str, cat: str, **args: Any) -> Iterator[Dict[str, Any]]:
+        """A span of blocking work on the calling thread."""
+        tid = self._tid()
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            end = time.perf_counter()
+            self._emit({
+                "ph": "X", "cat": cat, "name": name, "pid": self.pid, "tid": tid,
+                "ts": self._ts(start), "dur": round((end - start) * 1e6, 1), "args": args,
+            })
+
+    def annotate(self, **args: Any) -> None:
+        """Add args to the end event of the innermost async span of the running task."""
+        current = _current.get()
+        if current is not None:
+            current[1].update(args)
+
+    def counter(self, name: str, **values: float) -> None:
+        self._emit({"ph": "C", "name": name, "pid": self.pid, "tid": self._tid(), "ts": self._ts(), "args": values})
+
+    async def _sample_loop_lag(self) -> None:
+        interval = self.loop_lag_interval_s
+        lagging = False
+        expected = time.perf_counter() + interval
+        while True:
+            await asyncio.sleep(interval)
+            now = time.perf_counter()
+            lag = max(0.0, now - expected)
+            if lag >= 0.001 or lagging:
+                self.counter("event_loop_lag_ms", lag=round(lag * 1000, 2))
+                lagging = lag >= 0.001
+            if lag >= interval:
+                self._emit({
+                    "ph": "X", "cat": "loop", "name": "loop blocked", "pid": self.pid, "tid": self._tid(),
+                    "ts": self._ts(expected), "dur": round(lag * 1e6, 1), "args": {"lag_ms": round(lag * 1000, 2)},
+                })
+            expected = now + interval
+
+    def start(self) -> None:
+        """Start sampling event-loop lag (call from the event loop)."""
+        self._tid("event loop")
+        self._lag_task = asyncio.ensure_future(self._sample_loop_lag())
+
+    async def close(self) -> None:
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            await asyncio.gather(self._lag_task, return_exceptions=True)
+        if self.dropped:
+            print(f"[Trace] event limit reached, {self.dropped} events dropped")
+        await asyncio.to_thread(self._write)
+        print(f"[Trace] {len(self.events)} events written to: {self.path}")
+
+    def _write(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            events = list(self.events)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False, default=str)
+
+
+def trace_async(tracer: Optional[Tracer], name: str, cat: str, track: Optional[str] = None, **args: Any):
+    """tracer.async_span, or a no-op context (yielding a throwaway dict) when tracing is off."""
+    return tracer.async_span(name, cat, track, **args) if tracer is not None else nullcontext({})
+
+
+def trace_sync(tracer: Optional[Tracer], name: str, cat: str, **args: Any):
+    """tracer.sync_span, or a no-op context (yielding a throwaway dict) when tracing is off."""
+    return tracer.sync_span(name, cat, **args) if tracer is not None else nullcontext({})
@@ -1,37 +1,85 @@
-from typing import Any, Dict, List
+import zlib
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
 
 
-def messages2history_round(messages: List[Dict[str, Any]]) -> str:
-    """
-    Convert OpenAI-style message list into a readable multi-round history string.
-    Round increases on each new user turn.
-    """
-    history_lines = []
+def _history_lines(messages: List[Dict[str, Any]]) -> Iterator[Tuple[int, str]]:
+    """(message index, line) of the rendered history, in order."""
     round_num = 1
     last_role = None
 
-    for message in messages:
+    for index, message in enumerate(messages):
         role = (message.get("role") or "").lower()
         content = (message.get("content") or "").strip()
 
         if role == "system":
-            history_lines.append(f"[System Prompt]: {content}")
+            yield index, f"[System Prompt]: {content}"
             continue
 
         if role == "user" and last_role != "user":
-            history_lines.append(f"\n[Round {round_num}]")
+            yield index, f"\n[Round {round_num}]"
             round_num += 1
 
-        history_lines.append(f"{role.capitalize()}: {content}")
+        yield index, f"{role.capitalize()}: {content}"
         last_role = role
 
-    return "\n".join(history_lines)
+
+def messages2history_round(messages: List[Dict[str, Any]]) -> str:
+    """
+    Convert OpenAI-style message list into a readable multi-round history string.
+    Round increases on each new user turn.
+    """
+    return "\n".join(line for _, line in _history_lines(messages))
+
+
+def history_prefixes(messages: List[Dict[str, Any]], lengths: Iterable[int]) -> Dict[int, str]:
+    """
+    messages2history_round(messages[:n]) for every n in lengths, rendered once for the longest
+    prefix; the shorter histories are slices of it.
+    """
+    lengths = sorted(set(lengths))
+    longest = lengths[-1] if lengths else 0
+    ends = [0] * (longest + 1)  # ends[i]: length of the rendering of messages[:i]
+    lines: List[str] = []
+    position = 0
+    for index, line in _history_lines(messages[:longest]):
+        position += len(line) + (1 if lines else 0)
+        lines.append(line)
+        ends[index + 1] = position
+    for i in range(1, longest + 1):
+        ends[i] = max(ends[i], ends[i - 1])
+    full = "\n".join(lines)
+    return {n: full[:ends[n]] for n in lengths}
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token count without a tokenizer: CJK characters count as one token each,
+    everything else as one token per four characters.
+    """
+    cjk = sum(1 for ch in text if "\u2e80" <= ch <= "\u9fff" or "\uac00" <= ch <= "\ud7af" or "\uff00" <= ch <= "\uffef")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def empty_token_usage() -> Dict[str, int]:
+    """Zeroed usage counters; cached_tokens is the part of prompt_tokens served from the provider's prefix cache."""
+    return {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cached_tokens": 0}
 
 
 def accumulate_token_usage(total: Dict[str, int], item: Dict[str, int]) -> None:
     total["prompt_tokens"] += item.get("prompt_tokens", 0)
     total["completion_tokens"] += item.get("completion_tokens", 0)
     total["total_tokens"] += item.get("total_tokens", 0)
+    total["cached_tokens"] = total.get("cached_tokens", 0) + item.get("cached_tokens", 0)
+    for key in ("calls", "cache_hits"):
+        if item.get(key):
+            total[key] = total.get(key, 0) + item[key]
+
+
+def cached_token_ratio(usage: Dict[str, int]) -> float:
+    """Share of prompt tokens that were prefix-cache hits."""
+    if not usage.get("prompt_tokens"):
+        return 0.0
+    return usage.get("cached_tokens", 0) / usage["prompt_tokens"]
 
 
 def top_similarity(result: List[Dict[str, Any]]) -> float:
@@ -44,3 +92,8 @@ def top_similarity(result: List[Dict[str, Any]]) -> float:
         if sim > top_sim:
             top_sim = sim
     return top_sim
+
+
+def in_holdout(sample_id: Any, share: float) -> bool:
+    """Deterministic train/holdout split by sample id (for calibrating local resolvers)."""
+    return zlib.crc32(str(sample_id).encode("utf-8")) % 10_000 < share * 10_000
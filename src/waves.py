@@ -0,0 +1,132 @@
+# waves.py
+# Breadth-first (stage-wave) execution of the synthesis pipeline.
+#
+# Instead of walking each item through all stages, run one stage for every pending item,
+# checkpoint the results in the stage store, then move on to the next stage:
+#
+#   intent_tree -> utterance_category_reason -> ... -> negative_revise -> write records
+#
+# Every request in a wave shares its system prompt, which keeps it hot in provider prefix caches,
+# each wave is a clean checkpoint (a rerun resumes at the first unfinished stage), and the worker
+# count can be tuned per stage (SynthesisConfig.stage_concurrency). The step 7 branches are still
+# decided per item from top_sim: REVISE / INCORRECT_PATH / NEGATIVE_REVISE skip themselves.
+#
+#   python -m src.waves
+#
+
+import asyncio
+from typing import List, Tuple
+
+from tqdm.asyncio import tqdm_asyncio
+
+from .config import SynthesisConfig
+from .runtime import Runtime, build_runtime
+from .stages import STAGES, ItemState, Prompt, Stage, assemble_record, is_complete, item_key
+from .state import StageStore, iter_pending_states
+from .synthesis import default_config, print_run_stats
+from .tracing import trace_async
+from .utils import empty_token_usage
+
+
+def collect_wave(cfg: SynthesisConfig, stage: Stage, states: List[ItemState]) -> List[Tuple[ItemState, Prompt]]:
+    """
+    The items that still need `stage` and have all its inputs, with their prompts, grouped by
+    system prompt. Items whose step 7 branch skips the stage are resolved to None instead.
+    """
+    wave = []
+    for state in states:
+        if stage.name in state.results or not all(dep in state.results for dep in stage.deps):
+            continue
+        prompt = stage.build(cfg, state)
+        if prompt is None:
+            state.results[stage.name] = None
+        else:
+            wave.append((state, prompt))
+    wave.sort(key=lambda entry: entry[1][0])
+    return wave
+
+
+async def run_wave(rt: Runtime, store: StageStore, stage: Stage, wave: List[Tuple[ItemState, Prompt]]) -> Tuple[int, int]:
+    """
+    Run one stage over a wave with a fixed worker pool; returns (done, failed) item counts.
+    Workers stop taking items once the usage budget is exhausted.
+    """
+    cfg = rt.cfg
+    num_workers = cfg.adaptive_max_concurrency if cfg.adaptive_concurrency else cfg.max_concurrency
+    num_workers = cfg.stage_concurrency.get(stage.name, num_workers)
+    entries = iter(wave)
+    done = 0
+    failed = 0
+
+    async def worker(pbar) -> None:
+        nonlocal done, failed
+        for state, prompt in entries:
+            if rt.ledger.exhausted:
+                return
+            usage = empty_token_usage()
+            try:
+                with trace_async(rt.tracer, "item", "item", track=item_key(state.item)):
+                    result = await rt.answer(stage.name, state, prompt, usage)
+            except Exception as e:
+                # The item stops here for this run; its later stages lack an input and are not collected.
+                failed += 1
+                print(f"[Error] {stage.name} for item {item_key(state.item)}: {e}")
+            else:
+                done += 1
+                state.results[stage.name] = result
+                store.record(item_key(state.item), stage.name, result, usage)
+            finally:
+                pbar.update(1)
+
+    with tqdm_asyncio(total=len(wave), desc=stage.name, ncols=100) as pbar:
+        tasks = [asyncio.ensure_future(worker(pbar)) for _ in range(max(1, min(num_workers, len(wave))))]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            store.flush()
+    return done, failed
+
+
+async def run_waves(cfg: SynthesisConfig) -> None:
+    rt = build_runtime(cfg)
+    store = StageStore(cfg.state_file)
+    # Breadth-first needs every pending item in memory at once; the items are small next to the calls.
+    states = list(iter_pending_states(cfg, store))
+    print(f"[Waves] {len(states)} pending items")
+    await rt.start()
+
+    try:
+        for stage in STAGES:  # topologically ordered, so one wave per stage suffices
+            if rt.ledger.exhausted:
+                print(f"[Budget] exhausted, stopping before the {stage.name} wave")
+                break
+            wave = collect_wave(cfg, stage, states)
+            if not wave:
+                continue
+            done, failed = await run_wave(rt, store, stage, wave)
+            print(f"[Wave] {stage.name}: {done} done, {failed} failed")
+
+        finished = 0
+        for state in states:
+            if is_complete(state):
+                await rt.writer.write(assemble_record(cfg, state, store.usage.get(item_key(state.item), {})))
+                finished += 1
+            else:
+                rt.failed_samples += 1
+    finally:
+        await rt.aclose()
+        store.close()
+
+    print(f"Finished items: {finished}, unfinished (rerun to resume): {rt.failed_samples}")
+    print_run_stats(rt)
+
+
+def main():
+    asyncio.run(run_waves(default_config()))
+
+
+if __name__ == "__main__":
+    main()
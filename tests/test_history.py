@@ -0,0 +1,45 @@
+import re
+
+import pytest
+
+from src.history import compact_history, render_rounds, split_rounds
+from src.utils import messages2history_round
+
+
+def _msg(role, content):
+    return {"role": role, "content": content}
+
+
+CONVERSATIONS = [
+    [_msg("user", "hi"), _msg("assistant", "hello"), _msg("user", "how are you?"), _msg("assistant", "fine")],
+    [_msg("assistant", "Welcome!"), _msg("user", "hi"), _msg("assistant", "hello"), _msg("user", "bye")],
+    [_msg("system", "Be brief."), _msg("assistant", "Welcome!"), _msg("user", "hi"), _msg("assistant", "hello")],
+    [_msg("user", "a"), _msg("system", "mid"), _msg("user", "b"), _msg("assistant", "c"), _msg("system", "late"),
+     _msg("user", "d"), _msg("user", "e"), _msg("assistant", "f")],
+    [_msg("assistant", "only"), _msg("system", "no users")],
+    [],
+]
+
+
+@pytest.mark.parametrize("messages", CONVERSATIONS)
+def test_unlimited_budget_matches_messages2history_round(messages):
+    expected = messages2history_round(messages)
+    assert compact_history(messages, max_tokens=10**9) == expected
+    assert render_rounds(split_rounds(messages)) == expected
+
+
+def test_compacted_rounds_keep_their_numbers():
+    long = "word " * 200
+    messages = [_msg("system", "Be brief."), _msg("assistant", "Welcome!")]
+    for i in range(6):
+        messages += [_msg("user", f"{i} {long}"), _msg("assistant", f"answer {i}")]
+    full = messages2history_round(messages)
+
+    truncated = compact_history(messages, max_tokens=800, keep_last_rounds=2)
+    assert truncated.startswith("[System Prompt]: Be brief.\nAssistant: Welcome!\n\n[Round 1]\nUser: 0 word")
+    assert re.findall(r"\[Round (\d+)\]", truncated) == ["1", "2", "3", "4", "5", "6"]
+    assert full.endswith(truncated[truncated.index("\n[Round 5]"):])
+
+    dropped = compact_history(messages, max_tokens=500, keep_last_rounds=2)
+    assert dropped.startswith("[System Prompt]: Be brief.\n\n[Rounds 1-4 omitted]\n\n[Round 5]")
+    assert full.endswith(dropped[dropped.index("\n[Round 5]"):])
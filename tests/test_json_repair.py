@@ -0,0 +1,52 @@
+import pytest
+
+from src.json_repair import salvage_json
+
+
+@pytest.mark.parametrize("text, repairs", [
+    ('```json\n{"a": 1}\n```', "strip_fence"),
+    ('```\n{"a": 1}\n```', "strip_fence"),
+    ('Here is the result:\n```json\n{"a": 1}\n```\nLet me know.', "strip_fence"),
+    ('```json\nSure: {"a": 1}\n```', "strip_fence+extract_balanced"),
+])
+def test_code_fences(text, repairs):
+    assert salvage_json(text) == ({"a": 1}, repairs)
+
+
+@pytest.mark.parametrize("text", [
+    'Sure! {"a": 1} Hope this helps.',
+    'Note [x]: {"a": 1}',
+    'Note [see {this}]: {"a": 1}',
+    'Stray ] bracket, then {"a": 1}',
+    '{"a": 1}\n\nThe "a" field is {not} optional.',
+])
+def test_prose_wrappers(text):
+    assert salvage_json(text) == ({"a": 1}, "extract_balanced")
+
+
+def test_prefers_the_outermost_value():
+    assert salvage_json('Result: {"a": [1, {"b": 2}]} [done]') == ({"a": [1, {"b": 2}]}, "extract_balanced")
+    assert salvage_json('Result: [{"a": 1}, {"b": 2}]') == ([{"a": 1}, {"b": 2}], "extract_balanced")
+
+
+def test_brackets_inside_strings():
+    assert salvage_json('Answer: {"a": "x]}{[y"}') == ({"a": "x]}{[y"}, "extract_balanced")
+
+
+@pytest.mark.parametrize("text, expected, repairs", [
+    ('{"a"： 1，"b"： [1， 2]}', {"a": 1, "b": [1, 2]}, "normalize_punctuation"),
+    ('{"a": 1, "b": [1, 2,],}', {"a": 1, "b": [1, 2]}, "normalize_punctuation"),
+    ('Note [x]: {"a"： "，：", "b": 2，}', {"a": "，：", "b": 2}, "extract_balanced+normalize_punctuation"),
+])
+def test_full_width_punctuation(text, expected, repairs):
+    assert salvage_json(text) == (expected, repairs)
+
+
+@pytest.mark.parametrize("text", [
+    'no json here',
+    'Note [x] only',
+    '{"a": [1, 2]',
+])
+def test_unsalvageable_raises(text):
+    with pytest.raises(ValueError):
+        salvage_json(text)
@@ -0,0 +1,154 @@
+import json
+import time
+
+import pytest
+
+from src.lease import DONE, LEASED, PENDING, LeaseQueue, SampleCompletion, merge_shards
+
+
+@pytest.fixture
+def input_file(tmp_path):
+    path = tmp_path / "input.jsonl"
+    path.write_text("".join(json.dumps({"id": f"s{i}", "messages": []}) + "\n" for i in range(4)), encoding="utf-8")
+    return str(path)
+
+
+@pytest.fixture
+def queues(tmp_path, input_file):
+    opened = []
+
+    def open_queue(worker_id, **kwargs):
+        queue = LeaseQueue(str(tmp_path / "leases.sqlite"), worker_id, **kwargs)
+        queue.seed(input_file)
+        opened.append(queue)
+        return queue
+
+    yield open_queue
+    for queue in opened:
+        queue.close()
+
+
+def _status(queue, sample_id):
+    return queue._conn.execute("SELECT status, worker FROM samples WHERE sample_id = ?", (sample_id,)).fetchone()
+
+
+def test_seed_is_idempotent(queues, input_file):
+    queue = queues("w1")
+    assert queue.seed(input_file) == 0
+    assert queue.stats() == {PENDING: 4, "exhausted": 0}
+
+
+def test_expired_lease_is_claimed_again(queues):
+    crashed = queues("w1", lease_s=0.05)
+    survivor = queues("w2", lease_s=60.0)
+    assert [sample_id for sample_id, _ in crashed.claim(2)] == ["s0", "s1"]
+    assert [sample_id for sample_id, _ in survivor.claim(4)] == ["s2", "s3"]
+
+    time.sleep(0.1)
+    assert survivor.in_flight() == 2
+    assert [sample_id for sample_id, _ in survivor.claim(4)] == ["s0", "s1"]
+    assert _status(survivor, "s0") == (LEASED, "w2")
+
+
+def test_live_lease_is_not_claimed_again(queues):
+    first = queues("w1", lease_s=60.0)
+    second = queues("w2", lease_s=60.0)
+    assert len(first.claim(4)) == 4
+    assert second.claim(4) == []
+
+
+def test_heartbeat_keeps_the_lease(queues):
+    holder = queues("w1", lease_s=0.2)
+    other = queues("w2")
+    holder.claim(1)
+    for _ in range(3):
+        time.sleep(0.1)
+        holder.heartbeat()
+    assert [sample_id for sample_id, _ in other.claim(4)] == ["s1", "s2", "s3"]
+
+
+def test_max_attempts_exhausts_a_sample(queues):
+    queue = queues("w1", lease_s=0.01, max_attempts=2)
+    for _ in range(2):
+        assert [sample_id for sample_id, _ in queue.claim(1)] == ["s0"]
+        time.sleep(0.05)
+    assert [sample_id for sample_id, _ in queue.claim(1)] == ["s1"]
+    assert queue.stats()["exhausted"] == 1
+
+
+def test_double_completion(queues):
+    slow = queues("w1", lease_s=0.05)
+    fast = queues("w2", lease_s=60.0)
+    slow.claim(1)
+    time.sleep(0.1)
+    assert [sample_id for sample_id, _ in fast.claim(1)] == ["s0"]
+
+    fast.complete(["s0"])
+    slow.complete(["s0"])  # the worker whose lease expired finishes too
+    slow.complete(["s0"])
+    assert _status(fast, "s0")[0] == DONE
+    assert fast.stats()[DONE] == 1
+    time.sleep(0.1)
+    assert "s0" not in [sample_id for sample_id, _ in fast.claim(4)]
+
+
+def test_sample_completion_waits_for_every_item(queues):
+    queue = queues("w1", lease_s=60.0)
+    queue.claim(2)
+    completion = SampleCompletion(queue)
+    completion.expect("s0", 3)
+
+    completion.written([{"sample_id": "s0", "item_id": 0}, {"sample_id": "s0", "item_id": 1}])
+    assert _status(queue, "s0")[0] == LEASED
+    completion.written([{"sample_id": "s0", "item_id": 2}, {"sample_id": "s1", "item_id": 0}])
+    assert _status(queue, "s0")[0] == DONE
+    assert _status(queue, "s1")[0] == DONE  # never expected: one item
+
+    # A record written again after completion leaves the sample done
+    completion.written([{"sample_id": "s0", "item_id": 2}])
+    assert queue.stats()[DONE] == 2
+
+
+def test_release_returns_the_sample(queues):
+    queue = queues("w1", lease_s=60.0)
+    queue.claim(1)
+    queue.release("s0")
+    assert _status(queue, "s0")[0] == PENDING
+    assert [sample_id for sample_id, _ in queue.claim(1)] == ["s0"]
+
+
+def _write_shard(path, records, partial=None):
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+        if partial is not None:
+            f.write(partial)
+
+
+def test_merge_shards_drops_duplicates_and_orders(tmp_path):
+    first, second = str(tmp_path / "out.w1.jsonl"), str(tmp_path / "out.w2.jsonl")
+    _write_shard(first, [
+        {"sample_id": 3, "item_id": 0, "worker": "w1"},
+        {"sample_id": 1, "item_id": 1, "worker": "w1"},
+        {"sample_id": 1, "item_id": 0, "worker": "w1"},
+    ])
+    _write_shard(second, [
+        {"sample_id": 1, "item_id": 0, "worker": "w2"},
+        {"sample_id": 2, "item_id": 0, "worker": "w2"},
+    ], partial='{"sample_id": 4, "item')
+    output = str(tmp_path / "merged" / "out.jsonl")
+
+    assert merge_shards([first, second], output) == {"records": 4, "duplicates": 1, "bad_lines": 1}
+    with open(output, encoding="utf-8") as f:
+        merged = [json.loads(line) for line in f]
+    assert [(r["sample_id"], r["item_id"]) for r in merged] == [(1, 0), (1, 1), (2, 0), (3, 0)]
+    assert merged[0]["worker"] == "w1"  # the first copy wins
+
+
+def test_merge_shards_terminates_the_last_line(tmp_path):
+    shard = tmp_path / "out.w1.jsonl"
+    shard.write_text(json.dumps({"sample_id": "a", "item_id": 0}), encoding="utf-8")
+    output = str(tmp_path / "out.jsonl")
+    assert merge_shards([str(shard)], output)["records"] == 1
+    with open(output, encoding="utf-8") as f:
+        assert f.read().endswith("\n")
@@ -0,0 +1,26 @@
+import string
+
+import pytest
+
+from src import prompts
+
+HISTORY_FIELDS = {"chat_history", "context"}
+
+USER_TEMPLATES = {
+    name: value for name, value in vars(prompts).items()
+    if isinstance(value, str) and name.lower().endswith("user_prompt")
+}
+
+
+def _fields(template):
+    return [field for _, field, _, _ in string.Formatter().parse(template) if field]
+
+
+@pytest.mark.parametrize("name", sorted(
+    name for name, template in USER_TEMPLATES.items() if HISTORY_FIELDS & set(_fields(template))
+))
+def test_history_leads_the_user_message(name):
+    # Static system prompt, then the item's history, then the stage variables: the longest prefix a
+    # provider's prompt cache can reuse across the items of a stage and the rounds of a conversation
+    assert _fields(USER_TEMPLATES[name])[0] in HISTORY_FIELDS
+